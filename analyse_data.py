@@ -1,14 +1,18 @@
-import openai
-import pandas as pd
+from sql_runner import QueryResult
+from llm_gateway import get_llm_gateway
 
-def analyse_and_format(user_request, sql_query, results, openai_api_key):
-    if not results:
-        return None, "No results found."
+def build_analysis_prompt(user_request, sql_query, results):
+    # pandas loads here, on the first answer, rather than when a bot imports this module
+    import pandas as pd
+    from result_digest import digest_frame
 
-    # Convert results to DataFrame for pretty display
-    if isinstance(results, list) and results and isinstance(results[0], dict):
+    # A digest computed over every fetched row instead of the first 20 rows verbatim
+    if isinstance(results, QueryResult):
+        df = results.to_frame()
+        table = digest_frame(df, results.total_rows, results.truncated)
+    elif isinstance(results, list) and results and isinstance(results[0], dict):
         df = pd.DataFrame(results)
-        table = df.head(20).to_markdown(index=False)  # Show up to 20 rows
+        table = digest_frame(df)
     else:
         df = None
         table = str(results)
@@ -17,18 +21,35 @@ def analyse_and_format(user_request, sql_query, results, openai_api_key):
         f"The user asked: \"{user_request}\"\n"
         f"The following SQL query was used to get the data:\n{sql_query}\n"
         f"The latest financial data in the dataset is from 1998.\n"
-        f"Here are the results:\n{table}\n"
+        f"Here is a summary of the results:\n{table}\n"
         "Please explain in plain English:\n"
         "- What the data shows in response to the user's request\n"
         "- How the result was calculated\n"
         "- Mention that the latest financial data is from 1998\n"
         "Keep it concise and readable for a non-technical user."
     )
+    return df, prompt
 
-    openai.api_key = openai_api_key
-    response = openai.chat.completions.create(
-        model="gpt-3.5-turbo",
-        messages=[{"role": "user", "content": prompt}]
-    )
-    explanation = response.choices[0].message.content.strip()
-    return df, explanation
\ No newline at end of file
+
+def analyse_and_format(user_request, sql_query, results, openai_api_key):
+    if not results:
+        return None, "No results found."
+
+    df, prompt = build_analysis_prompt(user_request, sql_query, results)
+    explanation = get_llm_gateway().complete(
+        "analysis", [{"role": "user", "content": prompt}], openai_api_key
+    ).strip()
+    return df, explanation
+
+
+def stream_analysis(user_request, sql_query, results, openai_api_key):
+    """
+    Streaming variant of analyse_and_format: yields the analysis text in chunks as the
+    completion arrives, so front ends can show it before the model has finished.
+    """
+    if not results:
+        yield "No results found."
+        return
+
+    _, prompt = build_analysis_prompt(user_request, sql_query, results)
+    yield from get_llm_gateway().stream("analysis", [{"role": "user", "content": prompt}], openai_api_key)
@@ -0,0 +1,126 @@
+import asyncio
+import contextvars
+import inspect
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+
+from telemetry import record
+
+
+ANALYSIS_TIMEOUT = float(os.getenv("ANALYSIS_TIMEOUT", "20"))
+CHART_SPEC_TIMEOUT = float(os.getenv("CHART_SPEC_TIMEOUT", "15"))
+CHART_DATA_TIMEOUT = float(os.getenv("CHART_DATA_TIMEOUT", "15"))
+CHART_RENDER_TIMEOUT = float(os.getenv("CHART_RENDER_TIMEOUT", "20"))
+CHART_UPLOAD_TIMEOUT = float(os.getenv("CHART_UPLOAD_TIMEOUT", "30"))
+# Export query plus upload; kept above EXPORT_STATEMENT_TIMEOUT_MS so the query gives up first
+EXPORT_TIMEOUT = float(os.getenv("EXPORT_TIMEOUT", "420"))
+
+# Blocking stages run here rather than in the loop's default executor, which asyncio.run
+# would wait for on exit, so a timed-out stage cannot hold up a partial answer
+_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="answer-stage")
+# Pipelines started with submit_stages run their event loop on a separate pool: a driver
+# only waits on its stages, and would starve them if it held a stage worker meanwhile
+ANSWER_PIPELINE_DRIVERS = int(os.getenv("ANSWER_PIPELINE_DRIVERS", "16"))
+_driver_executor = ThreadPoolExecutor(max_workers=ANSWER_PIPELINE_DRIVERS, thread_name_prefix="answer-pipeline")
+
+
+@dataclass
+class Stage:
+    """
+    One node of the answer DAG. `func` receives a dict with the values of its `deps`
+    and may be a coroutine function or a plain (blocking) function, which runs in a thread.
+    """
+    name: str
+    func: object
+    deps: tuple = ()
+    timeout: float = None
+
+
+@dataclass
+class StageResult:
+    status: str  # "ok", "timeout", "error" or "skipped"
+    value: object = None
+    error: BaseException = None
+    seconds: float = 0.0
+
+    @property
+    def ok(self):
+        return self.status == "ok"
+
+
+@dataclass
+class PipelineResult:
+    stages: dict = field(default_factory=dict)
+
+    def value(self, name, default=None):
+        result = self.stages.get(name)
+        return result.value if result is not None and result.ok else default
+
+    def ok(self, name):
+        result = self.stages.get(name)
+        return result is not None and result.ok
+
+
+async def _call(func, inputs):
+    if inspect.iscoroutinefunction(func):
+        return await func(inputs)
+    # Copy the context so spans recorded in the thread land in the caller's trace
+    context = contextvars.copy_context()
+    return await asyncio.get_running_loop().run_in_executor(_executor, context.run, func, inputs)
+
+
+async def run_stages(stages):
+    """
+    Runs every stage as soon as all of its dependencies succeeded, independent stages
+    concurrently. A stage that fails or times out only skips the stages depending on it;
+    everything else still completes, so callers can always post a partial answer.
+    """
+    by_name = {stage.name: stage for stage in stages}
+    results = {}
+    events = {stage.name: asyncio.Event() for stage in stages}
+
+    async def run(stage):
+        try:
+            for dep in stage.deps:
+                await events[dep].wait()
+            if not all(results[dep].ok for dep in stage.deps):
+                results[stage.name] = StageResult("skipped")
+                return
+            inputs = {dep: results[dep].value for dep in stage.deps}
+            started = time.perf_counter()
+            try:
+                value = await asyncio.wait_for(_call(stage.func, inputs), stage.timeout)
+                results[stage.name] = StageResult("ok", value, seconds=time.perf_counter() - started)
+            except asyncio.TimeoutError as e:
+                print(f"Stage {stage.name} timed out after {stage.timeout}s")
+                results[stage.name] = StageResult("timeout", error=e, seconds=time.perf_counter() - started)
+            except Exception as e:
+                print(f"Stage {stage.name} failed:", repr(e))
+                results[stage.name] = StageResult("error", error=e, seconds=time.perf_counter() - started)
+            record(stage.name, results[stage.name].seconds, results[stage.name].status)
+        finally:
+            events[stage.name].set()
+
+    for stage in stages:
+        for dep in stage.deps:
+            if dep not in by_name:
+                raise ValueError(f"Stage {stage.name} depends on unknown stage {dep}")
+    await asyncio.gather(*(run(stage) for stage in stages))
+    return PipelineResult(results)
+
+
+def run_stages_sync(stages):
+    """
+    Blocking entry point for callers without an event loop (Streamlit).
+    """
+    return asyncio.run(run_stages(stages))
+
+
+def submit_stages(stages):
+    """
+    Starts run_stages_sync in the background and returns a concurrent.futures.Future, for
+    blocking callers that stream another part of the answer in the meantime.
+    """
+    return _driver_executor.submit(contextvars.copy_context().run, run_stages_sync, stages)
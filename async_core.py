@@ -0,0 +1,111 @@
+import asyncio
+import os
+import time
+
+import async_db
+from analyse_data import build_analysis_prompt
+from chart_agent import build_chart_prompt, recommend_without_llm, parse_chart_response, chart_messages
+from god_eye_core import serve_cache, sql_answer_steps
+from llm_gateway import get_llm_gateway
+from schema_cache import get_schema_entry
+from sql_runner import SQL_ROW_BUDGET
+from telemetry import span
+
+
+# Minimum seconds between edits of a streamed message; Slack and Telegram rate-limit edits
+STREAM_UPDATE_INTERVAL = float(os.getenv("STREAM_UPDATE_INTERVAL", "1.0"))
+
+async def adrive_steps(steps, serve):
+    """
+    asyncio counterpart of god_eye_core.drive_steps for an awaitable `serve(kind, payload)`.
+    The SQLite-backed cache steps run in a thread, off the event loop.
+    """
+    value, error = None, None
+    while True:
+        try:
+            kind, payload = steps.throw(error) if error is not None else steps.send(value)
+        except StopIteration as stop:
+            return stop.value
+        try:
+            if kind == "cache":
+                value, error = await asyncio.to_thread(serve_cache, *payload), None
+            else:
+                value, error = await serve(kind, payload), None
+        except Exception as e:
+            value, error = None, e
+
+
+async def agenerate_sql_and_results(user_input, openai_api_key, db_params=None, row_budget=SQL_ROW_BUDGET):
+    """
+    asyncio counterpart of god_eye_core.generate_sql_and_results: LLM calls go through
+    the gateway's async clients and queries through asyncpg, so one slow question never
+    blocks the loop.
+    """
+    # A warm schema cache answers from memory; the first load per target runs in a thread
+    with span("schema_fetch"):
+        schema = await asyncio.to_thread(get_schema_entry, db_params)
+    if schema is None:
+        return None, None, "Could not read the database schema. Please check the database connection."
+
+    async def serve(kind, payload):
+        if kind == "llm":
+            return await get_llm_gateway().acomplete("sql", payload, openai_api_key)
+        with span("sql_execute") as attrs:
+            result = await async_db.cached_fetch_result(payload, db_params, row_budget, fetch=async_db.guarded_fetch_result)
+            attrs["rows"] = result.row_count
+        return result
+
+    return await adrive_steps(sql_answer_steps(user_input, schema), serve)
+
+
+async def aanalyse_and_format(user_request, sql_query, results, openai_api_key):
+    if not results:
+        return None, "No results found."
+
+    df, prompt = build_analysis_prompt(user_request, sql_query, results)
+    explanation = await get_llm_gateway().acomplete("analysis", [{"role": "user", "content": prompt}], openai_api_key)
+    return df, explanation.strip()
+
+
+async def astream_analysis(user_request, sql_query, results, openai_api_key):
+    """
+    asyncio counterpart of analyse_data.stream_analysis.
+    """
+    if not results:
+        yield "No results found."
+        return
+
+    _, prompt = build_analysis_prompt(user_request, sql_query, results)
+    async for text in get_llm_gateway().astream("analysis", [{"role": "user", "content": prompt}], openai_api_key):
+        yield text
+
+
+async def athrottled_text(chunks, interval=STREAM_UPDATE_INTERVAL):
+    """
+    Accumulates streamed chunks and yields the text so far: right away for the first
+    chunk, then at most once per `interval` seconds, and once more when the stream ends.
+    """
+    text, sent, last = "", "", 0.0
+    async for chunk in chunks:
+        text += chunk
+        now = time.monotonic()
+        if now - last >= interval:
+            sent, last = text, now
+            yield text
+    if text != sent:
+        yield text
+
+
+async def arun_chart_agent(user_input, df, openai_api_key, use_groq=False):
+    """
+    asyncio counterpart of chart_agent.run_chart_agent.
+    """
+    chart_info = recommend_without_llm(user_input, df)
+    if chart_info is not None:
+        return chart_info
+
+    prompt, user_chart_type = build_chart_prompt(user_input, df)
+    content = await get_llm_gateway().acomplete(
+        "chart", chart_messages(prompt), openai_api_key, provider="groq" if use_groq else None
+    )
+    return parse_chart_response(content, df, user_chart_type)
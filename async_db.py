@@ -0,0 +1,157 @@
+import asyncio
+
+import asyncpg
+
+from db_config import resolve_db_params, target_key
+from db_pool import DB_POOL_MIN_SIZE, DB_POOL_MAX_SIZE, DB_POOL_IDLE_TIMEOUT
+from result_cache import (
+    DATA_VERSION_SQL, get_result_cache, _known_version, _remember_version, _versioned
+)
+from sql_runner import QueryResult, SQL_ROW_BUDGET, SQL_ITERSIZE
+from cost_guard import admission_steps, apply_admission, fetch_budget, session_settings
+
+
+_pools = {}
+_pools_lock = asyncio.Lock()
+
+
+def _connect_kwargs(db_params):
+    # asyncpg calls the libpq "dbname" parameter "database"
+    kwargs = dict(db_params)
+    if "dbname" in kwargs:
+        kwargs["database"] = kwargs.pop("dbname")
+    if kwargs.get("port"):
+        kwargs["port"] = int(kwargs["port"])
+    return kwargs
+
+
+async def get_async_pool(db_params=None):
+    """
+    asyncio counterpart of db_pool.get_pool: one asyncpg pool per connection target.
+    asyncpg resets connections on release and closes ones idle past DB_POOL_IDLE_TIMEOUT.
+    """
+    db_params = resolve_db_params(db_params)
+    key = target_key(db_params)
+    pool = _pools.get(key)
+    if pool is None:
+        async with _pools_lock:
+            pool = _pools.get(key)
+            if pool is None:
+                pool = await asyncpg.create_pool(
+                    min_size=DB_POOL_MIN_SIZE,
+                    max_size=DB_POOL_MAX_SIZE,
+                    max_inactive_connection_lifetime=DB_POOL_IDLE_TIMEOUT,
+                    **_connect_kwargs(db_params)
+                )
+                _pools[key] = pool
+    return pool
+
+
+async def close_async_pools():
+    pools = list(_pools.values())
+    _pools.clear()
+    for pool in pools:
+        await pool.close()
+
+
+# FETCH/MOVE counts are 32-bit signed integers in the Postgres grammar
+_MAX_MOVE = 2 ** 31 - 1
+
+
+async def _remaining_rows(cursor):
+    # Skip the rest on the server just to count it, one MOVE per 2**31 - 1 rows
+    remaining = 0
+    while True:
+        moved = await cursor.forward(_MAX_MOVE)
+        remaining += moved
+        if moved < _MAX_MOVE:
+            return remaining
+
+
+async def fetch_result(sql, db_params=None, row_budget=SQL_ROW_BUDGET, itersize=SQL_ITERSIZE, settings=(),
+                       read_only=False):
+    """
+    asyncio counterpart of sql_runner.fetch_result.
+    """
+    pool = await get_async_pool(db_params)
+    async with pool.acquire() as conn:
+        async with conn.transaction(readonly=read_only):
+            for statement in settings:
+                await conn.execute(statement)
+            cursor = await conn.cursor(sql)
+            columns = [attribute.name for attribute in cursor.get_attributes()]
+            arrays = [[] for _ in columns]
+            fetched = 0
+            while row_budget is None or fetched < row_budget:
+                size = itersize if row_budget is None else min(itersize, row_budget - fetched)
+                batch = await cursor.fetch(size)
+                if not batch:
+                    break
+                for array, values in zip(arrays, zip(*batch)):
+                    array.extend(values)
+                fetched += len(batch)
+                if len(batch) < size:
+                    break
+            total_rows = fetched
+            if row_budget is not None and fetched >= row_budget:
+                total_rows += await _remaining_rows(cursor)
+    return QueryResult(columns, arrays, total_rows, total_rows > fetched)
+
+
+async def data_version(db_params=None):
+    key = target_key(db_params)
+    token = _known_version(key)
+    if token is None:
+        try:
+            pool = await get_async_pool(db_params)
+            row = await pool.fetchrow(DATA_VERSION_SQL)
+        except (asyncpg.PostgresError, OSError) as e:
+            print("Result cache: could not read data version:", e)
+            return None
+        token = _remember_version(key, row[0], row[1])
+    return _versioned(key, token)
+
+
+async def admit(sql, db_params=None, row_budget=SQL_ROW_BUDGET):
+    """
+    asyncio counterpart of cost_guard.admit.
+    """
+    steps = admission_steps(sql, row_budget)
+    pool = await get_async_pool(db_params)
+    async with pool.acquire() as conn:
+        async with conn.transaction(readonly=True):
+            for statement in session_settings():
+                await conn.execute(statement)
+            plan = None
+            try:
+                while True:
+                    plan = await conn.fetchval(steps.send(plan))
+            except StopIteration as stop:
+                return stop.value
+
+
+async def guarded_fetch_result(sql, db_params=None, row_budget=SQL_ROW_BUDGET, itersize=SQL_ITERSIZE):
+    """
+    asyncio counterpart of cost_guard.guarded_fetch_result.
+    """
+    admission = await admit(sql, db_params, row_budget)
+    result = await fetch_result(admission.sql, db_params, fetch_budget(admission, row_budget), itersize,
+                                settings=session_settings(), read_only=True)
+    return apply_admission(result, admission)
+
+
+async def cached_fetch_result(sql, db_params=None, row_budget=SQL_ROW_BUDGET, fetch=fetch_result):
+    """
+    asyncio counterpart of result_cache.cached_fetch_result, sharing the same cache.
+    get and put may read or write Parquet spill files, so they run in a thread.
+    """
+    version = await data_version(db_params)
+    if version is None:
+        return await fetch(sql, db_params, row_budget)
+    cache = get_result_cache()
+    key = cache.make_key(sql, db_params, version, row_budget)
+    result = await asyncio.to_thread(cache.get, key)
+    if result is None:
+        result = await fetch(sql, db_params, row_budget)
+        await asyncio.to_thread(cache.put, key, result)
+    return result
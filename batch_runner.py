@@ -0,0 +1,233 @@
+"""
+Answers a batch of questions without a front end, for nightly reports and for checking
+prompt changes against a fixed question set.
+
+    python batch_runner.py questions.txt --output answers.jsonl --concurrency 8
+    cat questions.jsonl | python batch_runner.py - --llm-rpm 300 --no-analysis
+
+Input lines are plain questions or JSON objects with "question" and an optional "id"
+(the line number otherwise). Each answer is written as one JSON line as soon as it is
+ready. Rerunning with the same --output skips the questions already answered there, so
+an interrupted run picks up where it stopped (--retry-failed also redoes the errors).
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import db_pool
+from analyse_data import analyse_and_format
+from god_eye_core import drive_steps, sql_answer_steps, sql_serve
+from schema_cache import get_schema_entry
+from sql_runner import SQL_ROW_BUDGET
+from telemetry import trace
+
+
+OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
+# Retries of an LLM call rejected with HTTP 429 before the question is given up
+BATCH_RATE_LIMIT_RETRIES = int(os.getenv("BATCH_RATE_LIMIT_RETRIES", "5"))
+
+
+class Pacer:
+    """
+    Spaces LLM requests to at most `per_minute` across all workers, and pauses every
+    worker after a rate-limit response until the provider's retry-after has passed.
+    """
+
+    def __init__(self, per_minute=None):
+        self.interval = 60.0 / per_minute if per_minute else 0.0
+        self._next = 0.0
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next, self._paused_until)
+            self._next = start + self.interval
+        if start > now:
+            time.sleep(start - now)
+
+    def pause(self, seconds):
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+
+def rate_limit_delay(exc, attempt):
+    """
+    Seconds to back off for a 429 from the LLM provider, or None for any other error.
+    """
+    response = getattr(exc, "response", None)
+    if getattr(exc, "status_code", None) != 429 and getattr(response, "status_code", None) != 429:
+        return None
+    retry_after = getattr(response, "headers", {}).get("retry-after")
+    try:
+        return float(retry_after)
+    except (TypeError, ValueError):
+        return min(60.0, 2.0 ** attempt)
+
+
+class BatchRunner:
+    """
+    Shared resources for one batch: the schema is fetched once, every question uses the
+    same connection pool, and separate limits bound the LLM calls and the queries in flight.
+    """
+
+    def __init__(self, db_params, openai_api_key, llm_concurrency, sql_concurrency, llm_rpm=None,
+                 analyse=True, row_budget=SQL_ROW_BUDGET, sample_rows=0):
+        self.db_params = db_params
+        self.openai_api_key = openai_api_key
+        self.analyse = analyse
+        self.row_budget = row_budget
+        self.sample_rows = sample_rows
+        self.pacer = Pacer(llm_rpm)
+        self._llm_slots = threading.BoundedSemaphore(llm_concurrency)
+        self._sql_slots = threading.BoundedSemaphore(sql_concurrency)
+        self._serve_sql = sql_serve(openai_api_key, db_params, row_budget)
+        db_pool.get_pool(db_params, max_size=max(sql_concurrency, 1)).warm()
+        self.schema = get_schema_entry(db_params)
+        if self.schema is None:
+            raise RuntimeError("Could not read the database schema. Please check the database connection.")
+
+    def call_llm(self, func, *args):
+        attempt = 0
+        while True:
+            self.pacer.wait()
+            try:
+                with self._llm_slots:
+                    return func(*args)
+            except Exception as e:
+                delay = rate_limit_delay(e, attempt)
+                if delay is None or attempt >= BATCH_RATE_LIMIT_RETRIES:
+                    raise
+                attempt += 1
+                print(f"Rate limited, pausing LLM calls for {delay:.1f}s", file=sys.stderr)
+                self.pacer.pause(delay)
+
+    def serve(self, kind, payload):
+        if kind == "llm":
+            return self.call_llm(self._serve_sql, kind, payload)
+        with self._sql_slots:
+            return self._serve_sql(kind, payload)
+
+    def answer(self, item):
+        record = {"id": item["id"], "question": item["question"]}
+        started = time.perf_counter()
+        with trace("answer") as answer_trace:
+            try:
+                sql_query, results, error = drive_steps(sql_answer_steps(item["question"], self.schema), self.serve)
+                record.update(sql=sql_query, error=error)
+                if results is not None:
+                    record.update(rows=results.row_count, total_rows=results.total_rows, truncated=results.truncated)
+                    if self.sample_rows:
+                        record["sample"] = results.records(self.sample_rows)
+                    if self.analyse:
+                        _, record["analysis"] = self.call_llm(
+                            analyse_and_format, item["question"], sql_query, results, self.openai_api_key
+                        )
+            except Exception as e:
+                record["error"] = f"{type(e).__name__}: {e}"
+        record["seconds"] = round(time.perf_counter() - started, 3)
+        record["stages"] = {row["stage"]: row["seconds"] for row in answer_trace.rows() if row["stage"] != "answer"}
+        return record
+
+
+def read_questions(stream):
+    items = []
+    for number, line in enumerate(stream, 1):
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        if line.startswith("{"):
+            data = json.loads(line)
+            items.append({"id": str(data.get("id", number)), "question": data["question"]})
+        else:
+            items.append({"id": str(number), "question": line})
+    return items
+
+
+def answered_ids(path, retry_failed):
+    """
+    Ids already in an earlier run's output (only the successful ones with retry_failed).
+    """
+    done = set()
+    if not path or not os.path.exists(path):
+        return done
+    with open(path) as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue  # a line cut short when the run was interrupted
+            if not (retry_failed and record.get("error")):
+                done.add(str(record["id"]))
+    return done
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Answer a batch of questions as JSONL")
+    parser.add_argument("input", help="question file, or - for stdin")
+    parser.add_argument("--output", help="JSONL file to append answers to (stdout if omitted); enables resuming")
+    parser.add_argument("--concurrency", type=int, default=8, help="questions worked on at once")
+    parser.add_argument("--llm-concurrency", type=int, default=4, help="LLM calls in flight at once")
+    parser.add_argument("--sql-concurrency", type=int, default=4, help="queries in flight at once")
+    parser.add_argument("--llm-rpm", type=float, help="cap on LLM requests per minute")
+    parser.add_argument("--no-analysis", action="store_true", help="only generate and run the SQL")
+    parser.add_argument("--sample-rows", type=int, default=0, help="include this many result rows per answer")
+    parser.add_argument("--row-budget", type=int, default=SQL_ROW_BUDGET)
+    parser.add_argument("--dsn", help="libpq connection string (default: the .env database)")
+    parser.add_argument("--retry-failed", action="store_true", help="when resuming, redo answers that had an error")
+    args = parser.parse_args()
+
+    db_params = None
+    if args.dsn:
+        from psycopg2.extensions import parse_dsn
+        db_params = parse_dsn(args.dsn)
+
+    if args.input == "-":
+        items = read_questions(sys.stdin)
+    else:
+        with open(args.input) as f:
+            items = read_questions(f)
+    done = answered_ids(args.output, args.retry_failed)
+    todo = [item for item in items if item["id"] not in done]
+    print(f"{len(todo)} questions to answer ({len(items) - len(todo)} already in {args.output})", file=sys.stderr)
+    if not todo:
+        return
+
+    runner = BatchRunner(db_params, OPENAI_API_KEY, args.llm_concurrency, args.sql_concurrency, args.llm_rpm,
+                         analyse=not args.no_analysis, row_budget=args.row_budget, sample_rows=args.sample_rows)
+    out = open(args.output, "a+") if args.output else sys.stdout
+    if out is not sys.stdout and out.tell():
+        out.seek(out.tell() - 1)
+        if out.read(1) != "\n":
+            out.write("\n")  # end the line cut short by the interruption
+    executor = ThreadPoolExecutor(max_workers=args.concurrency, thread_name_prefix="batch")
+    failed = 0
+    started = time.perf_counter()
+    try:
+        futures = [executor.submit(runner.answer, item) for item in todo]
+        for future in as_completed(futures):
+            record = future.result()
+            failed += bool(record.get("error"))
+            # One complete line per answer, flushed, so an interrupted run can be resumed
+            out.write(json.dumps(record, default=str) + "\n")
+            out.flush()
+    except KeyboardInterrupt:
+        print("Interrupted; rerun with the same --output to resume", file=sys.stderr)
+        executor.shutdown(wait=False, cancel_futures=True)
+        raise SystemExit(130)
+    finally:
+        executor.shutdown(wait=False)
+        if out is not sys.stdout:
+            out.close()
+        db_pool.close_all()
+    print(f"Answered {len(todo)} questions in {time.perf_counter() - started:.1f}s, {failed} with errors",
+          file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,439 @@
+"""
+Offline end-to-end benchmark: replays Northwind questions through the SQL loop, the
+analysis prompt and the chart path with a deterministic LLM stand-in and a local
+Postgres, and reports per-stage latency percentiles, throughput and memory peaks.
+
+    python benchmark.py --scale 10 --concurrency 1,4,16 --repeat 3
+    BENCH_DSN="dbname=bench user=me" python benchmark.py --cold
+
+Without BENCH_DSN a throwaway cluster is created with initdb/pg_ctl (PostgreSQL
+binaries must be on PATH or under /usr/lib/postgresql/*/bin) and removed afterwards.
+
+    python benchmark.py --startup slack_bot,telegram_bot
+
+measures cold import time of the given modules in fresh interpreters instead.
+"""
+import argparse
+import glob
+import json
+import os
+import random
+import resource
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+
+
+# (question, canned SQL the stand-in LLM answers with)
+CORPUS = [
+    ("Show me the top 10 customers by sales",
+     "SELECT c.company_name, SUM(od.unit_price * od.quantity * (1 - od.discount)) AS total_sales "
+     "FROM customers c JOIN orders o ON o.customer_id = c.customer_id "
+     "JOIN order_details od ON od.order_id = o.order_id "
+     "GROUP BY c.company_name ORDER BY total_sales DESC LIMIT 10"),
+    ("Plot monthly revenue in 1997 as a line chart",
+     "SELECT date_trunc('month', o.order_date)::date AS month, SUM(od.unit_price * od.quantity * (1 - od.discount)) AS revenue "
+     "FROM orders o JOIN order_details od ON od.order_id = o.order_id "
+     "WHERE o.order_date >= DATE '1997-01-01' AND o.order_date < DATE '1998-01-01' GROUP BY 1 ORDER BY 1"),
+    ("How many orders were shipped to each country?",
+     "SELECT o.ship_country, COUNT(*) AS orders FROM orders o GROUP BY o.ship_country ORDER BY orders DESC"),
+    ("Which products cost more than 50?",
+     "SELECT p.product_name, p.unit_price FROM products p WHERE p.unit_price > 50 ORDER BY p.unit_price DESC"),
+    ("Show a bar chart of average freight by shipping country",
+     "SELECT o.ship_country, AVG(o.freight) AS avg_freight FROM orders o GROUP BY o.ship_country ORDER BY avg_freight DESC"),
+    ("Visualize sales by product category",
+     "SELECT cat.category_name, SUM(od.unit_price * od.quantity * (1 - od.discount)) AS sales "
+     "FROM categories cat JOIN products p ON p.category_id = cat.category_id "
+     "JOIN order_details od ON od.product_id = p.product_id GROUP BY cat.category_name ORDER BY sales DESC"),
+    ("Rank employees by number of orders handled",
+     "SELECT e.first_name, e.last_name, COUNT(o.order_id) AS orders FROM employees e "
+     "LEFT JOIN orders o ON o.employee_id = e.employee_id GROUP BY e.employee_id, e.first_name, e.last_name ORDER BY orders DESC"),
+    ("Plot the daily number of orders",
+     "SELECT o.order_date, COUNT(*) AS orders FROM orders o GROUP BY o.order_date ORDER BY o.order_date"),
+    ("Show revenue per product per month",
+     "SELECT p.product_name, date_trunc('month', o.order_date)::date AS month, "
+     "SUM(od.unit_price * od.quantity) AS revenue FROM order_details od "
+     "JOIN orders o ON o.order_id = od.order_id JOIN products p ON p.product_id = od.product_id GROUP BY 1, 2 ORDER BY 2, 1"),
+    ("List discontinued products and their suppliers",
+     "SELECT p.product_name, s.company_name FROM products p JOIN suppliers s ON s.supplier_id = p.supplier_id "
+     "WHERE p.discontinued ORDER BY p.product_name"),
+    ("Which customers placed no orders in 1998?",
+     "SELECT c.company_name, c.country FROM customers c WHERE NOT EXISTS ("
+     "SELECT 1 FROM orders o WHERE o.customer_id = c.customer_id AND o.order_date >= DATE '1998-01-01') ORDER BY c.company_name"),
+    ("Show all order lines with their quantities",
+     "SELECT od.order_id, od.product_id, od.quantity, od.unit_price FROM order_details od ORDER BY od.order_id"),
+]
+
+SCHEMA_SQL = """
+DROP TABLE IF EXISTS order_details, orders, products, suppliers, categories, employees, customers;
+SELECT setseed(0.42);
+CREATE TABLE customers (customer_id text PRIMARY KEY, company_name text, contact_name text, city text, country text);
+CREATE TABLE employees (employee_id int PRIMARY KEY, first_name text, last_name text, title text,
+                        birth_date date, hire_date date, city text, country text);
+CREATE TABLE categories (category_id int PRIMARY KEY, category_name text, description text);
+CREATE TABLE suppliers (supplier_id int PRIMARY KEY, company_name text, country text);
+CREATE TABLE products (product_id int PRIMARY KEY, product_name text, supplier_id int REFERENCES suppliers,
+                       category_id int REFERENCES categories, unit_price numeric(10, 2), units_in_stock int,
+                       discontinued boolean);
+CREATE TABLE orders (order_id int PRIMARY KEY, customer_id text REFERENCES customers, employee_id int REFERENCES employees,
+                     order_date date, required_date date, shipped_date date, ship_country text, freight numeric(10, 2));
+CREATE TABLE order_details (order_id int REFERENCES orders, product_id int REFERENCES products, unit_price numeric(10, 2),
+                            quantity int, discount real, PRIMARY KEY (order_id, product_id));
+
+INSERT INTO customers
+SELECT 'C' || lpad(i::text, 5, '0'), 'Customer ' || i, 'Contact ' || i, 'City ' || (i % 70),
+       (ARRAY['USA','Germany','France','UK','Brazil','Spain','Italy','Mexico','Canada','Sweden'])[1 + i % 10]
+FROM generate_series(1, 91 * {scale}) AS i;
+INSERT INTO employees
+SELECT i, 'First' || i, 'Last' || i, 'Sales Representative', DATE '1937-09-19' + (i * 997) % 10000,
+       DATE '1992-04-01' + i * 40, 'Seattle', 'USA'
+FROM generate_series(1, 9) AS i;
+INSERT INTO categories SELECT i, 'Category ' || i, 'Description ' || i FROM generate_series(1, 8) AS i;
+INSERT INTO suppliers SELECT i, 'Supplier ' || i, 'Country ' || (i % 16) FROM generate_series(1, 29) AS i;
+INSERT INTO products
+SELECT i, 'Product ' || i, 1 + i % 29, 1 + i % 8, round((2 + random() * 260)::numeric, 2), (random() * 120)::int, i % 9 = 0
+FROM generate_series(1, 77) AS i;
+INSERT INTO orders
+SELECT i, 'C' || lpad((1 + (random() * (91 * {scale} - 1))::int)::text, 5, '0'), 1 + i % 9,
+       DATE '1996-07-04' + (random() * 671)::int, NULL, NULL,
+       (ARRAY['USA','Germany','France','UK','Brazil','Spain','Italy','Mexico','Canada','Sweden'])[1 + (random() * 9)::int],
+       round((random() * 1000)::numeric, 2)
+FROM generate_series(1, 830 * {scale}) AS i;
+UPDATE orders SET required_date = order_date + 28, shipped_date = order_date + (random() * 30)::int;
+INSERT INTO order_details
+SELECT o.order_id, p.product_id, p.unit_price, 1 + (random() * 60)::int, (ARRAY[0, 0, 0, 0.05, 0.1, 0.2])[1 + (random() * 5)::int]
+FROM orders o
+CROSS JOIN LATERAL (
+    SELECT DISTINCT 1 + ((o.order_id * 31 + k * 17) % 77) AS product_id FROM generate_series(1, 1 + o.order_id % 5) AS k
+) AS picked
+JOIN products p ON p.product_id = picked.product_id;
+ANALYZE;
+"""
+
+
+class StubLLM:
+    """
+    Deterministic stand-in for the chat completions API: canned SQL for corpus questions,
+    a fixed analysis paragraph and a chart spec, each after a configurable latency.
+    """
+
+    def __init__(self, corpus, latency_ms=300.0, jitter_ms=50.0, seed=7):
+        self.corpus = sorted(corpus, key=lambda item: -len(item[0]))
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self._random = random.Random(seed)
+
+    def _sleep(self):
+        delay = max(0.0, self.latency_ms + self._random.uniform(-self.jitter_ms, self.jitter_ms))
+        time.sleep(delay / 1000.0)
+
+    def complete(self, messages):
+        self._sleep()
+        prompt = messages[-1]["content"] if messages[-1]["role"] == "user" else messages[0]["content"]
+        full = "\n".join(message["content"] for message in messages)
+        if "Respond as JSON" in prompt:
+            return '{"chart_type": "bar", "x": "", "y": ""}'
+        if prompt.lstrip().startswith("The user asked:"):
+            return ("The results answer the question directly: the leading rows account for most of the total, "
+                    "calculated by summing the matching rows. The latest financial data is from 1998.")
+        for question, sql in self.corpus:
+            if question in full:
+                return sql
+        return "SELECT 1"
+
+    @staticmethod
+    def usage(messages, completion):
+        return {"prompt_tokens": sum(len(m["content"]) for m in messages) // 4, "completion_tokens": len(completion) // 4}
+
+
+def _postgres_bin(name):
+    found = shutil.which(name)
+    if found:
+        return found
+    candidates = sorted(glob.glob(f"/usr/lib/postgresql/*/bin/{name}"))
+    return candidates[-1] if candidates else None
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+class LocalPostgres:
+    """
+    Throwaway cluster in a temporary directory, reachable on 127.0.0.1 with trust auth.
+    """
+
+    def __init__(self):
+        self.directory = tempfile.mkdtemp(prefix="godeye-bench-")
+        self.port = _free_port()
+
+    def start(self):
+        initdb, pg_ctl = _postgres_bin("initdb"), _postgres_bin("pg_ctl")
+        if not initdb or not pg_ctl:
+            raise SystemExit("PostgreSQL binaries (initdb, pg_ctl) not found; install them or set BENCH_DSN")
+        data = os.path.join(self.directory, "data")
+        subprocess.run([initdb, "-D", data, "-U", "bench", "--auth=trust", "-E", "UTF8"],
+                       check=True, stdout=subprocess.DEVNULL)
+        subprocess.run([pg_ctl, "-D", data, "-l", os.path.join(self.directory, "postgres.log"), "-w",
+                        "-o", f"-p {self.port} -k {self.directory} -c listen_addresses=127.0.0.1", "start"],
+                       check=True, stdout=subprocess.DEVNULL)
+        return {"dbname": "postgres", "user": "bench", "password": "", "host": "127.0.0.1", "port": str(self.port)}
+
+    def stop(self):
+        pg_ctl = _postgres_bin("pg_ctl")
+        data = os.path.join(self.directory, "data")
+        if pg_ctl and os.path.isdir(data):
+            subprocess.run([pg_ctl, "-D", data, "-m", "fast", "-w", "stop"], stdout=subprocess.DEVNULL)
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+
+def load_dataset(db_params, scale):
+    import psycopg2
+
+    conn = psycopg2.connect(**db_params)
+    try:
+        conn.autocommit = True
+        cursor = conn.cursor()
+        started = time.perf_counter()
+        cursor.execute(SCHEMA_SQL.format(scale=int(scale)))
+        cursor.execute("SELECT (SELECT count(*) FROM orders), (SELECT count(*) FROM order_details)")
+        orders, lines = cursor.fetchone()
+        print(f"Loaded scale {scale}: {orders:,} orders, {lines:,} order lines in {time.perf_counter() - started:.1f}s")
+    finally:
+        conn.close()
+
+
+def answer(question, db_params, llm):
+    """
+    One question end to end, with the same stages as the front ends: SQL loop, analysis
+    prompt and LLM call, chart spec, chart data reduction and PNG render.
+    """
+    from god_eye_core import drive_steps, sql_answer_steps
+    from schema_cache import get_schema_entry
+    from result_cache import cached_fetch_result
+    from cost_guard import guarded_fetch_result
+    from analyse_data import build_analysis_prompt
+    from chart_agent import recommend_without_llm, parse_chart_response, build_chart_prompt, wants_chart
+    from chart_data import chart_data
+    from chart_renderer import render_chart_png
+    from telemetry import span, record_usage
+
+    class Usage:
+        def __init__(self, prompt_tokens, completion_tokens):
+            self.prompt_tokens, self.completion_tokens = prompt_tokens, completion_tokens
+
+    def complete(messages, purpose):
+        with span("llm", purpose=purpose) as attrs:
+            content = llm.complete(messages)
+            record_usage(attrs, "stub", Usage(**llm.usage(messages, content)))
+        return content
+
+    def fetch(query):
+        with span("sql_execute") as attrs:
+            result = cached_fetch_result(query, db_params, fetch=guarded_fetch_result)
+            attrs["rows"] = result.row_count
+        return result
+
+    def serve(kind, payload):
+        return complete(payload, "sql") if kind == "llm" else fetch(payload)
+
+    with span("schema_fetch"):
+        schema = get_schema_entry(db_params)
+    sql_query, results, error = drive_steps(sql_answer_steps(question, schema), serve)
+    if error or not results:
+        return error or "no results"
+
+    with span("analysis"):
+        _, prompt = build_analysis_prompt(question, sql_query, results)
+        complete([{"role": "user", "content": prompt}], "analysis")
+
+    df = results.to_frame()
+    if len(df.columns) and wants_chart(question):
+        with span("chart_spec"):
+            chart_info = recommend_without_llm(question, df)
+            if chart_info is None:
+                prompt, user_chart_type = build_chart_prompt(question, df)
+                chart_info = parse_chart_response(complete([{"role": "user", "content": prompt}], "chart"), df, user_chart_type)
+        with span("chart_data"):
+            chart_df, chart_info = chart_data(results, sql_query, chart_info, fetch)
+        with span("chart_render"):
+            render_chart_png(chart_df, chart_info.get("chart_type", "bar"), chart_info.get("x"), chart_info.get("y"))
+    return None
+
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = (len(ordered) - 1) * q / 100.0
+    low, high = int(rank), min(int(rank) + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (rank - low)
+
+
+def run_level(questions, db_params, llm, concurrency, cold):
+    from telemetry import trace
+    from nl_cache import get_nl_cache
+    from result_cache import get_result_cache
+
+    spans, errors = [], []
+
+    def one(question):
+        if cold:
+            # Clearing is process-wide, so cold runs measure first-time answers only approximately at concurrency > 1
+            get_nl_cache().clear()
+            get_result_cache().clear()
+        with trace("answer") as answer_trace:
+            error = answer(question, db_params, llm)
+        if error:
+            errors.append((question, error))
+        spans.extend(answer_trace.spans)
+
+    tracemalloc.reset_peak()
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(one, questions))
+    elapsed = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+
+    stages = {}
+    for span in spans:
+        name = span.stage if span.stage != "llm" else f"llm:{span.attrs.get('purpose')}"
+        stages.setdefault(name, []).append(span.seconds)
+    return {
+        "concurrency": concurrency,
+        "answers": len(questions),
+        "errors": len(errors),
+        "seconds": round(elapsed, 3),
+        "throughput_per_s": round(len(questions) / elapsed, 3) if elapsed else 0.0,
+        "python_heap_peak_mb": round(peak / 2 ** 20, 1),
+        "stages": {
+            name: {
+                "count": len(values),
+                "p50_ms": round(percentile(values, 50) * 1000, 1),
+                "p95_ms": round(percentile(values, 95) * 1000, 1),
+                "p99_ms": round(percentile(values, 99) * 1000, 1),
+            }
+            for name, values in sorted(stages.items())
+        },
+        "failed": errors[:5],
+    }
+
+
+def print_report(report):
+    print(f"\nconcurrency {report['concurrency']}: {report['answers']} answers in {report['seconds']}s "
+          f"({report['throughput_per_s']}/s), {report['errors']} errors, "
+          f"python heap peak {report['python_heap_peak_mb']} MB")
+    print(f"  {'stage':<18}{'count':>7}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for name, stats in report["stages"].items():
+        print(f"  {name:<18}{stats['count']:>7}{stats['p50_ms']:>10}{stats['p95_ms']:>10}{stats['p99_ms']:>10}")
+    for question, error in report["failed"]:
+        print(f"  failed: {question!r}: {error}")
+
+
+def measure_startup(module, repeat):
+    """
+    Import time of `module` in fresh interpreters (median of `repeat` runs, from
+    -X importtime) and the slowest top-level packages it pulls in.
+    """
+    root = os.path.dirname(os.path.abspath(__file__))
+    totals, packages = [], {}
+    for _ in range(repeat):
+        proc = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                              cwd=root, capture_output=True, text=True)
+        if proc.returncode != 0:
+            return {"module": module, "error": proc.stderr.strip().splitlines()[-1]}
+        total = 0
+        for line in proc.stderr.splitlines():
+            if not line.startswith("import time:") or "cumulative" in line:
+                continue
+            _, cumulative, name = (part.strip() for part in line[len("import time:"):].split("|"))
+            if name == module:
+                total = int(cumulative)
+            elif "." not in name:
+                packages[name] = max(packages.get(name, 0), int(cumulative))
+        totals.append(total / 1000)
+    slowest = sorted(packages.items(), key=lambda item: item[1], reverse=True)[:8]
+    return {
+        "module": module,
+        "import_ms": round(percentile(totals, 50), 1),
+        "slowest": [(name, round(us / 1000, 1)) for name, us in slowest],
+    }
+
+
+def print_startup(report):
+    if "error" in report:
+        print(f"{report['module']}: import failed: {report['error']}")
+        return
+    print(f"{report['module']}: {report['import_ms']} ms")
+    for name, ms in report["slowest"]:
+        print(f"  {name:<28}{ms:>10}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline GodEye benchmark")
+    parser.add_argument("--scale", type=int, default=10, help="dataset size as a multiple of Northwind (830 orders)")
+    parser.add_argument("--concurrency", default="1,4,16", help="comma-separated worker counts")
+    parser.add_argument("--repeat", type=int, default=3, help="passes over the question corpus per level")
+    parser.add_argument("--llm-latency-ms", type=float, default=300.0)
+    parser.add_argument("--llm-jitter-ms", type=float, default=50.0)
+    parser.add_argument("--cold", action="store_true", help="clear the NL->SQL and result caches before every answer")
+    parser.add_argument("--skip-load", action="store_true", help="reuse the dataset already in BENCH_DSN")
+    parser.add_argument("--json", help="also write the report to this file")
+    parser.add_argument("--startup", help="comma-separated modules to time the cold import of, instead of answering")
+    args = parser.parse_args()
+
+    if args.startup:
+        reports = [measure_startup(module, args.repeat) for module in args.startup.split(",")]
+        for report in reports:
+            print_startup(report)
+        if args.json:
+            with open(args.json, "w") as f:
+                json.dump({"startup": reports}, f, indent=2)
+        return
+
+    # Keep the benchmark's cache out of the app's .godeye_cache
+    cache_dir = tempfile.mkdtemp(prefix="godeye-bench-cache-")
+    os.environ.setdefault("NL_CACHE_PATH", os.path.join(cache_dir, "nl_sql.sqlite3"))
+
+    server = None
+    dsn = os.getenv("BENCH_DSN")
+    if dsn:
+        from psycopg2.extensions import parse_dsn
+        db_params = parse_dsn(dsn)
+    else:
+        server = LocalPostgres()
+        db_params = server.start()
+    try:
+        if not (dsn and args.skip_load):
+            load_dataset(db_params, args.scale)
+        llm = StubLLM(CORPUS, args.llm_latency_ms, args.llm_jitter_ms)
+        questions = [question for question, _ in CORPUS] * args.repeat
+        tracemalloc.start()
+        reports = []
+        for concurrency in (int(level) for level in args.concurrency.split(",")):
+            report = run_level(questions, db_params, llm, concurrency, args.cold)
+            print_report(report)
+            reports.append(report)
+        max_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+        print(f"\nprocess max RSS {max_rss_mb:.0f} MB")
+        if args.json:
+            with open(args.json, "w") as f:
+                json.dump({"scale": args.scale, "cold": args.cold, "llm_latency_ms": args.llm_latency_ms,
+                           "max_rss_mb": round(max_rss_mb, 1), "levels": reports}, f, indent=2)
+    finally:
+        from db_pool import close_all
+        close_all()
+        if server is not None:
+            server.stop()
+        shutil.rmtree(cache_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,19 +1,6 @@
-import streamlit as st
-import pandas as pd
-from groq import Groq
-import openai
-import matplotlib.pyplot as plt
-import os
-from dotenv import load_dotenv
+from llm_gateway import get_llm_gateway
 
 
-
-load_dotenv()
-GROQ_API_KEY = os.getenv("GROQ_API_KEY")
-
-
-client = Groq(api_key=GROQ_API_KEY)
-
 def wants_chart(user_input: str) -> bool:
     """
     Detects if the user input contains keywords indicating a request for a chart/visualization.
@@ -27,14 +14,32 @@ def wants_chart(user_input: str) -> bool:
 
 
 
-def run_chart_agent(user_input, df, openai_api_key, use_groq=False, groq_client=None):
+def requested_chart_type(user_input):
     # Detect if user specified a chart type in their input
     chart_types = ["bar", "line", "pie", "scatter", "area", "histogram"]
-    user_chart_type = None
     for ct in chart_types:
         if ct in user_input.lower():
-            user_chart_type = ct
-            break
+            return ct
+    return None
+
+
+def recommend_without_llm(user_input, df):
+    """
+    Chart spec straight from the data when the rule-based recommender is confident,
+    otherwise None and the caller asks the LLM.
+    """
+    from chart_recommender import recommend_chart, CHART_MIN_CONFIDENCE
+
+    recommendation = recommend_chart(df, requested_chart_type(user_input))
+    if recommendation is None or recommendation.confidence < CHART_MIN_CONFIDENCE:
+        return None
+    print(f"Chart recommended without LLM: {recommendation.chart_type} "
+          f"({recommendation.reason}, confidence {recommendation.confidence:.2f})")
+    return {"chart_type": recommendation.chart_type, "x": recommendation.x, "y": recommendation.y}
+
+
+def build_chart_prompt(user_input, df):
+    user_chart_type = requested_chart_type(user_input)
 
     prompt = f"""
     The user asked: "{user_input}"
@@ -46,24 +51,21 @@ def run_chart_agent(user_input, df, openai_api_key, use_groq=False, groq_client=
     Suggest the most suitable chart type (bar, line, pie, scatter, etc.) and which columns to use for x and y axes (or values/labels for pie).
     Respond as JSON: {{"chart_type": "...", "x": "...", "y": "..."}}
     """
-    import json
+    return prompt, user_chart_type
 
-    if use_groq and groq_client is not None:
-        chat_completion = groq_client.chat.completions.create(
-            messages=[
-                {"role": "system", "content": "You are a helpful assistant specialized in chart generation."},
-                {"role": "user", "content": prompt}
-            ],
-            model='llama-3.1-8b-instant',
-        )
-        content = chat_completion.choices[0].message.content
-    else:
-        client = openai.OpenAI(api_key=openai_api_key)
-        chat_completion = client.chat.completions.create(
-            model="gpt-3.5-turbo",
-            messages=[{"role": "user", "content": prompt}]
-        )
-        content = chat_completion.choices[0].message.content
+
+CHART_SYSTEM_PROMPT = "You are a helpful assistant specialized in chart generation."
+
+
+def chart_messages(prompt):
+    return [
+        {"role": "system", "content": CHART_SYSTEM_PROMPT},
+        {"role": "user", "content": prompt}
+    ]
+
+
+def parse_chart_response(content, df, user_chart_type):
+    import json
 
     try:
         chart_info = json.loads(content)
@@ -84,4 +86,17 @@ def run_chart_agent(user_input, df, openai_api_key, use_groq=False, groq_client=
     except Exception:
         columns = list(df.columns)
         fallback_chart = user_chart_type if user_chart_type else "bar"
-        return {"chart_type": fallback_chart, "x": columns[0], "y": columns[1] if len(columns) > 1 else columns[0]}
\ No newline at end of file
+        return {"chart_type": fallback_chart, "x": columns[0], "y": columns[1] if len(columns) > 1 else columns[0]}
+
+
+def run_chart_agent(user_input, df, openai_api_key, use_groq=False):
+    chart_info = recommend_without_llm(user_input, df)
+    if chart_info is not None:
+        return chart_info
+
+    prompt, user_chart_type = build_chart_prompt(user_input, df)
+    # use_groq pins the call to Groq; otherwise the gateway routes (and hedges) the chart task
+    content = get_llm_gateway().complete(
+        "chart", chart_messages(prompt), openai_api_key, provider="groq" if use_groq else None
+    )
+    return parse_chart_response(content, df, user_chart_type)
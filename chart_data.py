@@ -0,0 +1,235 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+
+# Points drawn at most for line and scatter charts
+CHART_MAX_POINTS = int(os.getenv("CHART_MAX_POINTS", "1000"))
+# Bars (or pie slices) shown before the rest is folded into "Other"
+CHART_TOP_N = int(os.getenv("CHART_TOP_N", "15"))
+CHART_PIE_TOP_N = int(os.getenv("CHART_PIE_TOP_N", "8"))
+CHART_HISTOGRAM_BINS = int(os.getenv("CHART_HISTOGRAM_BINS", "30"))
+# Results estimated above this many rows are aggregated in Postgres for the chart
+CHART_PUSHDOWN_ROWS = int(os.getenv("CHART_PUSHDOWN_ROWS", "50000"))
+
+OTHER_LABEL = "Other"
+
+
+def lttb_indices(x, y, threshold):
+    """
+    Largest-Triangle-Three-Buckets: indices of `threshold` points that keep the visual
+    shape of the series (peaks and dips survive, unlike every-nth sampling). `x` must be sorted.
+    """
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    edges = np.linspace(1, n - 1, threshold - 1).astype(int)
+    indices = np.empty(threshold, dtype=int)
+    indices[0], indices[-1] = 0, n - 1
+    a = 0
+    for i in range(threshold - 2):
+        start, end = edges[i], edges[i + 1]
+        next_start, next_end = (edges[i + 1], edges[i + 2]) if i + 2 < len(edges) else (n - 1, n)
+        avg_x, avg_y = x[next_start:next_end].mean(), y[next_start:next_end].mean()
+        area = np.abs((x[a] - avg_x) * (y[start:end] - y[a]) - (x[a] - x[start:end]) * (avg_y - y[a]))
+        a = start + int(area.argmax())
+        indices[i + 1] = a
+    return indices
+
+
+def _axis_values(series):
+    # Positions on the x axis as floats: timestamps, numbers, or row order for anything else
+    if pd.api.types.is_numeric_dtype(series):
+        return series.to_numpy(dtype=float)
+    dates = pd.to_datetime(series, errors="coerce")
+    if dates.notna().all():
+        return dates.astype("int64").to_numpy(dtype=float)
+    numbers = pd.to_numeric(series, errors="coerce")
+    if numbers.notna().all():
+        return numbers.to_numpy(dtype=float)
+    return np.arange(len(series), dtype=float)
+
+
+def histogram_spec(y):
+    return {"chart_type": "bar", "x": f"{y} range", "y": "count"}
+
+
+def _histogram_frame(y, lows, highs, counts):
+    spec = histogram_spec(y)
+    labels = [f"{low:,.4g} – {high:,.4g}" for low, high in zip(lows, highs)]
+    return pd.DataFrame({spec["x"]: labels, spec["y"]: counts})
+
+
+def _top_n(df, x, y, top_n):
+    values = pd.to_numeric(df[y], errors="coerce")
+    totals = values.groupby(df[x].astype(str), sort=False).sum().sort_values(ascending=False)
+    if len(totals) > top_n:
+        totals = pd.concat([totals.iloc[:top_n - 1], pd.Series({OTHER_LABEL: totals.iloc[top_n - 1:].sum()})])
+    return pd.DataFrame({x: totals.index, y: totals.to_numpy()})
+
+
+def _sum_by_label(df, x, y):
+    # Repeated labels drawn once, in the order the query returned them
+    values = pd.to_numeric(df[y], errors="coerce")
+    totals = values.groupby(df[x], sort=False, dropna=False).sum()
+    return pd.DataFrame({x: totals.index, y: totals.to_numpy()})
+
+
+def reduce_for_chart(df, chart_info, large=None):
+    """
+    Shrinks a large result frame to what the chart can show: LTTB for line and scatter
+    charts, top-N plus "Other" for bar and pie charts, binned counts for histograms.
+    Returns (frame, chart_info); a binned histogram comes back as a bar chart of the bins.
+    `large` (default: more than CHART_MAX_POINTS rows) says whether to reduce at all;
+    smaller results are drawn as the query returned them, in its row order.
+    """
+    chart_type, x, y = chart_info.get("chart_type"), chart_info.get("x"), chart_info.get("y")
+    if df is None or df.empty or x not in df.columns or y not in df.columns or df.columns.duplicated().any():
+        return df, chart_info
+    if large is None:
+        large = len(df) > CHART_MAX_POINTS
+
+    if chart_type in ("line", "area", "scatter") and len(df) > CHART_MAX_POINTS:
+        frame = df[[x, y] if x != y else [x]].copy()
+        frame = frame[pd.to_numeric(frame[y], errors="coerce").notna()]
+        positions = _axis_values(frame[x])
+        order = np.argsort(positions, kind="stable")
+        positions = positions[order]
+        values = pd.to_numeric(frame[y], errors="coerce").to_numpy(dtype=float)[order]
+        keep = lttb_indices(positions, values, CHART_MAX_POINTS)
+        return frame.iloc[order[keep]].reset_index(drop=True), chart_info
+
+    if chart_type in ("bar", "pie"):
+        top_n = CHART_PIE_TOP_N if chart_type == "pie" else CHART_TOP_N
+        if large and df[x].nunique(dropna=False) > top_n:
+            return _top_n(df, x, y, top_n), chart_info
+        if df[x].duplicated().any():
+            return _sum_by_label(df, x, y), chart_info
+        return df, chart_info
+
+    if chart_type == "histogram" and len(df) > CHART_MAX_POINTS:
+        values = pd.to_numeric(df[y], errors="coerce").dropna().to_numpy(dtype=float)
+        if not len(values):
+            return df, chart_info
+        counts, edges = np.histogram(values, bins=CHART_HISTOGRAM_BINS)
+        return _histogram_frame(y, edges[:-1], edges[1:], counts), {**chart_info, **histogram_spec(y)}
+
+    return df, chart_info
+
+
+def _quote(name):
+    return '"' + str(name).replace('"', '""') + '"'
+
+
+def pushdown_sql(sql, chart_info):
+    """
+    Query that aggregates the original result in Postgres to what the chart needs, so a
+    large result never has to be fetched in full. Returns None for unsupported charts.
+    """
+    chart_type, x, y = chart_info.get("chart_type"), chart_info.get("x"), chart_info.get("y")
+    if not x or not y:
+        return None
+    source = sql.strip().rstrip(";")
+    qx, qy = _quote(x), _quote(y)
+    if chart_type in ("bar", "pie"):
+        top_n = CHART_PIE_TOP_N if chart_type == "pie" else CHART_TOP_N
+        return (
+            f"WITH source AS (\n{source}\n),\n"
+            f"grouped AS (SELECT {qx}::text AS label, sum({qy}) AS value FROM source GROUP BY 1),\n"
+            f"ranked AS (SELECT label, value, row_number() OVER (ORDER BY value DESC NULLS LAST) AS rank FROM grouped)\n"
+            f"SELECT CASE WHEN rank < {top_n} THEN label ELSE '{OTHER_LABEL}' END AS {qx}, sum(value) AS {qy}\n"
+            f"FROM ranked GROUP BY 1 ORDER BY 2 DESC NULLS LAST"
+        )
+    if chart_type in ("line", "area"):
+        # Equal-count buckets along x, each drawn at its first x with the mean y
+        return (
+            f"WITH source AS (\n{source}\n)\n"
+            f"SELECT min({qx}) AS {qx}, avg({qy}) AS {qy} FROM (\n"
+            f"  SELECT {qx}, {qy}, ntile({CHART_MAX_POINTS}) OVER (ORDER BY {qx}) AS bucket FROM source WHERE {qy} IS NOT NULL\n"
+            f") AS bucketed GROUP BY bucket ORDER BY 1"
+        )
+    if chart_type == "scatter":
+        return f"WITH source AS (\n{source}\n)\nSELECT {qx}, {qy} FROM source ORDER BY random() LIMIT {CHART_MAX_POINTS}"
+    if chart_type == "histogram":
+        bins = CHART_HISTOGRAM_BINS
+        return (
+            f"WITH source AS (\n{source}\n),\n"
+            f"bounds AS (SELECT min({qy})::float8 AS low, max({qy})::float8 AS high FROM source)\n"
+            f"SELECT bucket, min(low) AS low, min(high) AS high, count(*) AS count FROM (\n"
+            f"  SELECT CASE WHEN high = low THEN 1 ELSE least(width_bucket({qy}::float8, low, high, {bins}), {bins}) END AS bucket,\n"
+            f"         low, high\n"
+            f"  FROM source, bounds WHERE {qy} IS NOT NULL\n"
+            f") AS binned GROUP BY bucket ORDER BY bucket"
+        )
+    return None
+
+
+def _histogram_from_pushdown(frame, y):
+    if frame.empty:
+        return _histogram_frame(y, [], [], [])
+    low, high = float(frame["low"].iloc[0]), float(frame["high"].iloc[0])
+    width = (high - low) / CHART_HISTOGRAM_BINS if high > low else 1.0
+    counts = np.zeros(CHART_HISTOGRAM_BINS if high > low else 1, dtype=int)
+    counts[frame["bucket"].astype(int).to_numpy() - 1] = frame["count"].astype(int).to_numpy()
+    lows = low + width * np.arange(len(counts))
+    return _histogram_frame(y, lows, lows + width, counts)
+
+
+def needs_pushdown(results):
+    """
+    True when the fetched rows are not the whole result (or the plan expects a large one),
+    so a chart drawn from them would be wrong or slow.
+    """
+    if results.truncated:
+        return True
+    estimated_rows = (results.admission or {}).get("estimated_rows") or 0
+    return estimated_rows > CHART_PUSHDOWN_ROWS
+
+
+def _is_large(results):
+    # Only large or cut-off results are reduced; a "top 20" keeps its 20 rows and their order
+    return results.row_count > CHART_MAX_POINTS or needs_pushdown(results)
+
+
+def _plan(results, sql, chart_info):
+    if sql and len(results.columns) == len(set(results.columns)) and needs_pushdown(results):
+        return pushdown_sql(sql, chart_info)
+    return None
+
+
+def _from_pushdown(reduced, chart_info):
+    frame = reduced.to_frame()
+    if chart_info.get("chart_type") == "histogram":
+        y = chart_info.get("y")
+        return _histogram_from_pushdown(frame, y), {**chart_info, **histogram_spec(y)}
+    return reduce_for_chart(frame, chart_info)
+
+
+def chart_data(results, sql, chart_info, fetch):
+    """
+    Frame and spec to draw for a QueryResult. Large results are aggregated in SQL through
+    the blocking `fetch(sql)`; otherwise (or if that fails) the fetched rows are reduced.
+    """
+    query = _plan(results, sql, chart_info)
+    if query is not None:
+        try:
+            return _from_pushdown(fetch(query), chart_info)
+        except Exception as e:
+            print("Chart aggregation query failed, reducing fetched rows:", repr(e))
+    return reduce_for_chart(results.to_frame(), chart_info, _is_large(results))
+
+
+async def achart_data(results, sql, chart_info, fetch):
+    """
+    asyncio counterpart of chart_data for an awaitable `fetch(sql)`.
+    """
+    query = _plan(results, sql, chart_info)
+    if query is not None:
+        try:
+            return _from_pushdown(await fetch(query), chart_info)
+        except Exception as e:
+            print("Chart aggregation query failed, reducing fetched rows:", repr(e))
+    return reduce_for_chart(results.to_frame(), chart_info, _is_large(results))
@@ -0,0 +1,124 @@
+import os
+import re
+from dataclasses import dataclass, asdict
+
+import pandas as pd
+
+
+# Recommendations scoring below this go to the LLM instead
+CHART_MIN_CONFIDENCE = float(os.getenv("CHART_MIN_CONFIDENCE", "0.7"))
+# More distinct categories than this make an unreadable bar or pie chart
+CHART_MAX_CATEGORIES = int(os.getenv("CHART_MAX_CATEGORIES", "30"))
+
+_ID_COLUMN = re.compile(r"(^id$|_id$|^id_)", re.IGNORECASE)
+_TIME_NAME = re.compile(r"(year|month|quarter|week|day|date|time)", re.IGNORECASE)
+_TEMPORAL_TYPES = {"datetime64", "datetime", "date"}
+_NUMERIC_TYPES = {"integer", "floating", "decimal", "mixed-integer-float"}
+
+
+@dataclass
+class ChartRecommendation:
+    chart_type: str
+    x: str
+    y: str
+    confidence: float
+    reason: str
+
+    def as_dict(self):
+        return asdict(self)
+
+
+def profile_columns(df):
+    """
+    One row per column: inferred kind ("temporal", "numeric", "category" or "other"),
+    distinct count and whether the values are all non-negative. Query results keep
+    Postgres dates and numerics as Python objects, so kinds come from infer_dtype.
+    """
+    frame = df.reset_index(drop=True)
+    frame.columns = range(frame.shape[1])  # result columns may repeat a name
+    inferred = frame.apply(lambda column: pd.api.types.infer_dtype(column, skipna=True))
+    names = [str(name) for name in df.columns]
+    kinds = []
+    for name, dtype, kind in zip(names, frame.dtypes, inferred):
+        if kind in _TEMPORAL_TYPES or pd.api.types.is_datetime64_any_dtype(dtype):
+            kinds.append("temporal")
+        elif kind in _NUMERIC_TYPES and not pd.api.types.is_bool_dtype(dtype):
+            kinds.append("numeric")
+        elif kind in ("string", "categorical", "boolean", "mixed"):
+            kinds.append("category")
+        else:
+            kinds.append("other")
+    numeric = frame.apply(pd.to_numeric, errors="coerce")
+    return pd.DataFrame({
+        "name": names,
+        "kind": kinds,
+        "distinct": frame.nunique(dropna=True).to_numpy(),
+        "nonnegative": (numeric.fillna(0) >= 0).all().to_numpy(),
+        "id_like": [bool(_ID_COLUMN.search(name)) for name in names],
+        "time_name": [bool(_TIME_NAME.search(name)) for name in names],
+    })
+
+
+def _measure(profile, exclude=None):
+    # Prefer measures over identifiers and time fields, and later columns (SELECT key, value) over earlier ones
+    numeric = profile[(profile["kind"] == "numeric") & (profile["name"] != exclude)]
+    measures = numeric[~numeric["id_like"] & ~numeric["time_name"]]
+    picked = measures if len(measures) else numeric
+    return picked["name"].iloc[-1] if len(picked) else None
+
+
+def recommend_chart(df, user_chart_type=None):
+    """
+    Scores the usual chart shapes from column kinds, cardinality and row count and returns
+    the best ChartRecommendation, or None when the frame has nothing to plot.
+    """
+    if df is None or df.empty or not len(df.columns):
+        return None
+    profile = profile_columns(df)
+    rows = len(df)
+    candidates = []
+
+    temporal = profile[(profile["kind"] == "temporal")
+                       | ((profile["kind"] == "numeric") & profile["time_name"] & ~profile["id_like"])]
+    categories = profile[profile["kind"] == "category"]
+    numeric_count = int((profile["kind"] == "numeric").sum())
+
+    for x in temporal["name"]:
+        y = _measure(profile, exclude=x)
+        if y is not None:
+            candidates.append(ChartRecommendation(
+                "line", x, y, 0.9 if rows >= 3 else 0.6, "time column with a numeric measure"))
+
+    for x, distinct in zip(categories["name"], categories["distinct"]):
+        y = _measure(profile)
+        if y is None:
+            continue
+        if distinct <= CHART_MAX_CATEGORIES:
+            candidates.append(ChartRecommendation("bar", x, y, 0.85, "few categories with a numeric measure"))
+        else:
+            candidates.append(ChartRecommendation("bar", x, y, 0.5, "many categories with a numeric measure"))
+        if distinct <= 6 and bool(profile.loc[profile["name"] == y, "nonnegative"].all()):
+            candidates.append(ChartRecommendation("pie", x, y, 0.6, "a handful of non-negative parts"))
+
+    if numeric_count >= 2 and categories.empty and temporal.empty:
+        x = profile[profile["kind"] == "numeric"]["name"].iloc[0]
+        y = _measure(profile, exclude=x)
+        candidates.append(ChartRecommendation(
+            "scatter", x, y, 0.75 if rows >= 10 else 0.5, "two numeric columns"))
+
+    if numeric_count >= 1 and rows >= 10:
+        y = _measure(profile)
+        confidence = 0.75 if len(profile) == 1 else 0.4
+        candidates.append(ChartRecommendation("histogram", y, y, confidence, "distribution of one numeric column"))
+
+    if user_chart_type:
+        # The user's chart type wins; keep the best axes found for it, or for any shape
+        matching = [c for c in candidates if c.chart_type == user_chart_type]
+        if matching:
+            return max(matching, key=lambda c: c.confidence)
+        if candidates:
+            best = max(candidates, key=lambda c: c.confidence)
+            return ChartRecommendation(user_chart_type, best.x, best.y, best.confidence * 0.8,
+                                       f"{user_chart_type} requested; axes from {best.chart_type}")
+        return None
+    return max(candidates, key=lambda c: c.confidence) if candidates else None
@@ -0,0 +1,140 @@
+import asyncio
+import hashlib
+import io
+import json
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+
+CHART_RENDER_WORKERS = int(os.getenv("CHART_RENDER_WORKERS", "2"))
+# Rendered PNGs kept in memory, most recently used first
+CHART_CACHE_MAX_BYTES = int(os.getenv("CHART_CACHE_MAX_BYTES", str(32 * 1024 * 1024)))
+CHART_DPI = int(os.getenv("CHART_DPI", "100"))
+
+
+def chart_key(df, chart_type, x, y):
+    """
+    Hash of the plotted data and the chart spec; the same answer asked twice renders once.
+    """
+    import pandas as pd
+
+    digest = hashlib.sha256()
+    digest.update(json.dumps([chart_type, x, y, [str(c) for c in df.columns]], default=str).encode("utf-8"))
+    digest.update(pd.util.hash_pandas_object(df, index=False).values.tobytes())
+    return digest.hexdigest()
+
+
+def render_chart_png(df, chart_type, x, y, dpi=CHART_DPI):
+    """
+    Draws the chart on its own Figure with an Agg canvas and returns PNG bytes. Nothing
+    touches pyplot's global state, so this is safe to call from several threads at once.
+    """
+    # matplotlib loads with the first chart, not when the bot starts
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+    fig = Figure()
+    FigureCanvasAgg(fig)
+    ax = fig.add_subplot()
+    if chart_type == "line":
+        df.plot.line(x=x, y=y, ax=ax)
+    elif chart_type == "pie":
+        df.set_index(x)[y].plot.pie(autopct='%1.1f%%', ax=ax)
+    elif chart_type == "scatter":
+        df.plot.scatter(x=x, y=y, ax=ax)
+    elif chart_type == "histogram":
+        df[y].plot.hist(ax=ax)
+    else:
+        df.plot.bar(x=x, y=y, ax=ax)
+
+    ax.set_title(f"{chart_type.title()} Chart of {y} vs {x}")
+    fig.tight_layout()
+    buffer = io.BytesIO()
+    fig.savefig(buffer, format="png", dpi=dpi)
+    return buffer.getvalue()
+
+
+class ChartRenderer:
+    """
+    Renders charts to PNG bytes on a small dedicated thread pool, with an LRU of recent
+    renders so repeated questions skip drawing entirely.
+    """
+
+    def __init__(self, workers=CHART_RENDER_WORKERS, max_bytes=CHART_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="chart-render")
+        self._entries = OrderedDict()  # key -> png bytes
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "evictions": 0}
+
+    def _cached(self, key):
+        with self._lock:
+            png = self._entries.get(key)
+            if png is not None:
+                self._entries.move_to_end(key)
+                self._stats["hits"] += 1
+            else:
+                self._stats["misses"] += 1
+            return png
+
+    def _store(self, key, png):
+        if len(png) > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= len(old)
+            self._entries[key] = png
+            self._bytes += len(png)
+            while self._bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= len(evicted)
+                self._stats["evictions"] += 1
+
+    def _render(self, key, df, chart_type, x, y):
+        png = render_chart_png(df, chart_type, x, y)
+        self._store(key, png)
+        return png
+
+    def render(self, df, chart_type, x, y):
+        """
+        Blocking render (cached); the drawing itself happens on the renderer's pool.
+        """
+        key = chart_key(df, chart_type, x, y)
+        png = self._cached(key)
+        if png is None:
+            png = self._executor.submit(self._render, key, df, chart_type, x, y).result()
+        return png
+
+    async def arender(self, df, chart_type, x, y):
+        key = chart_key(df, chart_type, x, y)
+        png = self._cached(key)
+        if png is None:
+            loop = asyncio.get_running_loop()
+            png = await loop.run_in_executor(self._executor, self._render, key, df, chart_type, x, y)
+        return png
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats.update({"entries": len(self._entries), "bytes": self._bytes, "max_bytes": self.max_bytes})
+        return stats
+
+    def close(self):
+        self._executor.shutdown(wait=False)
+
+
+_renderer = None
+_renderer_lock = threading.Lock()
+
+
+def get_chart_renderer():
+    global _renderer
+    if _renderer is None:
+        with _renderer_lock:
+            if _renderer is None:
+                _renderer = ChartRenderer()
+    return _renderer
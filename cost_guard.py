@@ -0,0 +1,172 @@
+import json
+import os
+import re
+from dataclasses import dataclass, asdict
+
+from db_pool import connection
+from sql_runner import fetch_result, SQL_ROW_BUDGET, SQL_ITERSIZE
+from sql_validator import single_statement
+
+
+# Plans estimated above this cost are rejected (unless a LIMIT brings them under it)
+COST_GUARD_MAX_COST = float(os.getenv("COST_GUARD_MAX_COST", "5000000"))
+# Plans estimated to return more rows than this get a LIMIT injected
+COST_GUARD_MAX_ROWS = int(os.getenv("COST_GUARD_MAX_ROWS", "100000"))
+# Per-statement execution limit in milliseconds
+STATEMENT_TIMEOUT_MS = int(os.getenv("STATEMENT_TIMEOUT_MS", "15000"))
+
+_TRAILING_LIMIT = re.compile(r"\blimit\s+(\d+)(\s+offset\s+\d+)?\s*;?\s*$", re.IGNORECASE)
+
+
+@dataclass
+class Admission:
+    decision: str  # "accepted", "limited" or "rejected"
+    estimated_cost: float
+    estimated_rows: float
+    limit: int = None
+    sql: str = None
+    # Row estimate of the query before a LIMIT was injected
+    plan_rows: float = None
+
+    def as_dict(self):
+        return asdict(self)
+
+    def describe(self):
+        text = f"Plan check: {self.decision} (estimated cost {self.estimated_cost:,.0f}, ~{self.estimated_rows:,.0f} rows)"
+        if self.decision == "limited":
+            text += f"; results limited to {self.limit:,} rows"
+        return text
+
+
+def describe_admission(admission):
+    """
+    One-line summary of an admission dict (QueryResult.admission) for the front ends.
+    """
+    return Admission(**admission).describe() if admission else None
+
+
+class AdmissionRejected(Exception):
+    def __init__(self, admission):
+        self.admission = admission
+        super().__init__(
+            f"This query is too expensive to run (estimated cost {admission.estimated_cost:,.0f}, "
+            f"limit {COST_GUARD_MAX_COST:,.0f}). Please narrow it down, e.g. with a date range or fewer joins."
+        )
+
+
+def session_settings(read_only=True, statement_timeout_ms=STATEMENT_TIMEOUT_MS):
+    """
+    Statements that must open every guarded transaction, before any query.
+    """
+    statements = []
+    if read_only:
+        statements.append("SET TRANSACTION READ ONLY")
+    if statement_timeout_ms:
+        statements.append(f"SET LOCAL statement_timeout = {int(statement_timeout_ms)}")
+    return statements
+
+
+def explain_sql(sql):
+    # Raises MultipleStatements: a second statement could COMMIT the read-only transaction
+    return "EXPLAIN (FORMAT JSON) " + single_statement(sql)
+
+
+def plan_estimates(plan_json):
+    if isinstance(plan_json, str):
+        plan_json = json.loads(plan_json)
+    plan = plan_json[0]["Plan"]
+    return float(plan["Total Cost"]), float(plan["Plan Rows"])
+
+
+def existing_limit(sql):
+    match = _TRAILING_LIMIT.search(sql.strip())
+    return int(match.group(1)) if match else None
+
+
+def limited_sql(sql, limit):
+    return f"SELECT * FROM (\n{single_statement(sql)}\n) AS guarded LIMIT {int(limit)}"
+
+
+def decide(cost, rows, max_cost=COST_GUARD_MAX_COST, max_rows=COST_GUARD_MAX_ROWS):
+    """
+    Returns "accepted", "limit" (try again with a LIMIT) or "rejected" for plan estimates.
+    """
+    if cost <= max_cost and rows <= max_rows:
+        return "accepted"
+    if rows > max_rows:
+        return "limit"
+    return "rejected"
+
+
+def admission_steps(sql, row_budget=SQL_ROW_BUDGET):
+    """
+    Admission decision as a step generator: yields EXPLAIN statements, receives their JSON
+    plans and returns an Admission. Drivers for psycopg2 and asyncpg serve the same logic.
+    """
+    cost, rows = plan_estimates((yield explain_sql(sql)))
+    verdict = decide(cost, rows)
+    if verdict == "accepted":
+        return Admission("accepted", cost, rows, sql=sql)
+    if verdict == "limit":
+        limit = min(COST_GUARD_MAX_ROWS, row_budget) if row_budget else COST_GUARD_MAX_ROWS
+        if existing_limit(sql) is not None and existing_limit(sql) <= limit:
+            # The query's own LIMIT already bounds it; nothing is cut off
+            limit = probe = existing_limit(sql)
+        else:
+            # One row past the limit lets the fetch tell whether the LIMIT cut anything off
+            probe = limit + 1
+        candidate = limited_sql(sql, probe)
+        limited_cost, limited_rows = plan_estimates((yield explain_sql(candidate)))
+        if limited_cost <= COST_GUARD_MAX_COST:
+            return Admission("limited", limited_cost, limited_rows, limit=limit, sql=candidate, plan_rows=rows)
+        cost, rows = limited_cost, limited_rows
+    raise AdmissionRejected(Admission("rejected", cost, rows))
+
+
+def admit(sql, db_params=None, row_budget=SQL_ROW_BUDGET):
+    steps = admission_steps(sql, row_budget)
+    with connection(db_params, read_only=True) as conn:
+        cursor = conn.cursor()
+        for statement in session_settings():
+            cursor.execute(statement)
+        plan = None
+        try:
+            while True:
+                statement = steps.send(plan)
+                cursor.execute(statement)
+                plan = cursor.fetchone()[0]
+        except StopIteration as stop:
+            return stop.value
+        finally:
+            cursor.close()
+            conn.rollback()
+
+
+def guarded_fetch_result(sql, db_params=None, row_budget=SQL_ROW_BUDGET, itersize=SQL_ITERSIZE):
+    """
+    fetch_result behind admission control: EXPLAIN first, reject or LIMIT expensive plans,
+    then execute read-only under STATEMENT_TIMEOUT_MS. Raises AdmissionRejected, and
+    MultipleStatements for SQL with more than one statement.
+    """
+    admission = admit(sql, db_params, row_budget)
+    result = fetch_result(admission.sql, db_params, fetch_budget(admission, row_budget), itersize,
+                          settings=session_settings(), read_only=True)
+    return apply_admission(result, admission)
+
+
+def fetch_budget(admission, row_budget):
+    # A limited query is fetched up to its limit, leaving the probe row for the count
+    if admission.limit is None:
+        return row_budget
+    return admission.limit if row_budget is None else min(row_budget, admission.limit)
+
+
+def apply_admission(result, admission):
+    """
+    Attaches the admission to `result`. When the injected LIMIT cut the result off, the
+    fetched count says nothing about the real size, so the plan estimate is reported.
+    """
+    if admission.decision == "limited" and result.truncated and admission.plan_rows:
+        result.total_rows = max(result.total_rows, int(admission.plan_rows))
+    result.admission = admission.as_dict()
+    return result
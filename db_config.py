@@ -0,0 +1,85 @@
+import hashlib
+import json
+import os
+import threading
+from dotenv import load_dotenv
+
+
+load_dotenv()
+
+HOST_DB = os.getenv("HOST_DB")
+PASSWORD_DB = os.getenv("PASSWORD_DB")
+USER_DB = os.getenv("USER_DB")
+DB_NAME = os.getenv("DB_NAME")
+PORT_DB = os.getenv("PORT_DB", "5432")
+
+
+def default_db_params():
+    return {
+        "dbname": DB_NAME,
+        "user": USER_DB,
+        "password": PASSWORD_DB,
+        "host": HOST_DB,
+        "port": PORT_DB
+    }
+
+
+# Parameters (with the password) of registered targets by target_key, so callers can
+# pass the key around instead of the credentials
+_targets = {}
+_targets_lock = threading.Lock()
+
+
+class UnknownTarget(KeyError):
+    pass
+
+
+def register_target(db_params):
+    """
+    Keeps the parameters here and returns the target_key that stands for them.
+    """
+    params = resolve_db_params(db_params)
+    key = target_key(params)
+    with _targets_lock:
+        _targets[key] = params
+    return key
+
+
+def forget_target(key):
+    with _targets_lock:
+        _targets.pop(key, None)
+
+
+def resolve_db_params(db_params=None):
+    """
+    Returns the connection parameters to use, falling back to the .env database.
+    An empty dict (the Streamlit sidebar default) also means the .env database, and a
+    string is the key of a target registered with register_target.
+    """
+    if isinstance(db_params, str):
+        with _targets_lock:
+            params = _targets.get(db_params)
+        if params is None:
+            raise UnknownTarget(f"Connection target {db_params} is not registered (or was closed)")
+        return dict(params)
+    return dict(db_params) if db_params else default_db_params()
+
+
+def describe_target(db_params=None):
+    """
+    user@host:port/dbname for logs; never includes the password.
+    """
+    params = resolve_db_params(db_params)
+    return f"{params.get('user')}@{params.get('host')}:{params.get('port')}/{params.get('dbname')}"
+
+
+def target_key(db_params=None):
+    """
+    Stable hash identifying a connection target. The password is part of the hash
+    so two users with different credentials never share cached connections.
+    """
+    if isinstance(db_params, str):
+        return db_params  # already a registered target's key
+    params = resolve_db_params(db_params)
+    raw = json.dumps({k: str(v) for k, v in params.items()}, sort_keys=True)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()[:16]
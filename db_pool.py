@@ -0,0 +1,258 @@
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+import psycopg2
+import psycopg2.extensions
+
+from db_config import resolve_db_params, target_key
+
+
+DB_POOL_MIN_SIZE = int(os.getenv("DB_POOL_MIN_SIZE", "1"))
+DB_POOL_MAX_SIZE = int(os.getenv("DB_POOL_MAX_SIZE", "10"))
+# Idle connections above min size are closed after this many seconds
+DB_POOL_IDLE_TIMEOUT = float(os.getenv("DB_POOL_IDLE_TIMEOUT", "300"))
+# Connections idle for longer than this are pinged before being handed out
+DB_POOL_HEALTH_CHECK_AFTER = float(os.getenv("DB_POOL_HEALTH_CHECK_AFTER", "30"))
+# How long acquire() waits for a free connection when the pool is at max size
+DB_POOL_ACQUIRE_TIMEOUT = float(os.getenv("DB_POOL_ACQUIRE_TIMEOUT", "30"))
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+class ConnectionPool:
+    def __init__(self, db_params, min_size=DB_POOL_MIN_SIZE, max_size=DB_POOL_MAX_SIZE,
+                 idle_timeout=DB_POOL_IDLE_TIMEOUT, health_check_after=DB_POOL_HEALTH_CHECK_AFTER,
+                 acquire_timeout=DB_POOL_ACQUIRE_TIMEOUT):
+        self.db_params = db_params
+        self.min_size = min_size
+        self.max_size = max(max_size, 1)
+        self.idle_timeout = idle_timeout
+        self.health_check_after = health_check_after
+        self.acquire_timeout = acquire_timeout
+        # (connection, returned_at); the right end holds the most recently returned connection
+        self._idle = deque()
+        self._in_use = 0
+        self._closed = False
+        self._cond = threading.Condition()
+        self._stats = {
+            "created": 0,
+            "closed": 0,
+            "acquired": 0,
+            "waits": 0,
+            "timeouts": 0,
+            "health_check_failures": 0,
+            "idle_evictions": 0,
+            "wait_seconds_total": 0.0,
+        }
+
+    def _connect(self):
+        conn = psycopg2.connect(**self.db_params)
+        with self._cond:
+            self._stats["created"] += 1
+        return conn
+
+    def _close_conn(self, conn):
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
+        self._stats["closed"] += 1
+
+    def _evict_idle_locked(self):
+        now = time.time()
+        # Oldest idle connections sit on the left
+        while self._idle and len(self._idle) + self._in_use > self.min_size:
+            conn, returned_at = self._idle[0]
+            if now - returned_at < self.idle_timeout:
+                break
+            self._idle.popleft()
+            self._close_conn(conn)
+            self._stats["idle_evictions"] += 1
+
+    def _is_healthy(self, conn):
+        if conn.closed:
+            return False
+        try:
+            cursor = conn.cursor()
+            cursor.execute("SELECT 1")
+            cursor.close()
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def acquire(self, timeout=None):
+        timeout = self.acquire_timeout if timeout is None else timeout
+        started = time.time()
+        deadline = started + timeout
+        conn = None
+        returned_at = None
+        with self._cond:
+            waited = False
+            while True:
+                if self._closed:
+                    raise PoolTimeout("Connection pool is closed")
+                self._evict_idle_locked()
+                if self._idle:
+                    # LIFO keeps a small set of hot connections and lets the rest age out
+                    conn, returned_at = self._idle.pop()
+                    break
+                if self._in_use < self.max_size:
+                    break
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    self._stats["timeouts"] += 1
+                    raise PoolTimeout(f"No database connection available after {timeout:.1f}s (max_size={self.max_size})")
+                if not waited:
+                    self._stats["waits"] += 1
+                    waited = True
+                self._cond.wait(remaining)
+            self._in_use += 1
+            self._stats["acquired"] += 1
+            self._stats["wait_seconds_total"] += time.time() - started
+
+        try:
+            if conn is not None and time.time() - returned_at > self.health_check_after and not self._is_healthy(conn):
+                with self._cond:
+                    self._stats["health_check_failures"] += 1
+                    self._close_conn(conn)
+                conn = None
+            if conn is None:
+                conn = self._connect()
+        except Exception:
+            with self._cond:
+                self._in_use -= 1
+                self._cond.notify()
+            raise
+        return conn
+
+    def release(self, conn, discard=False):
+        if not discard and not conn.closed:
+            try:
+                # Never hand out a connection in the middle of someone else's transaction
+                if conn.info.transaction_status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+                if conn.autocommit:
+                    conn.autocommit = False
+                if conn.readonly:
+                    conn.readonly = None
+            except psycopg2.Error:
+                discard = True
+        with self._cond:
+            self._in_use -= 1
+            if discard or conn.closed or self._closed:
+                self._close_conn(conn)
+            else:
+                self._idle.append((conn, time.time()))
+            self._cond.notify()
+
+    @contextmanager
+    def connection(self, timeout=None, read_only=False):
+        conn = self.acquire(timeout)
+        try:
+            if read_only:
+                # Transactions on it begin READ ONLY; reset when the connection is released
+                conn.set_session(readonly=True)
+            yield conn
+        except psycopg2.OperationalError:
+            # The server or network went away; do not put the connection back
+            self.release(conn, discard=True)
+            raise
+        except BaseException:
+            self.release(conn)
+            raise
+        else:
+            self.release(conn)
+
+    def warm(self):
+        """
+        Opens connections up to min_size. Failures are reported, not raised.
+        """
+        opened = []
+        try:
+            with self._cond:
+                missing = self.min_size - len(self._idle) - self._in_use
+            for _ in range(max(missing, 0)):
+                opened.append(self._connect())
+        except psycopg2.Error as e:
+            print("Connection pool warm-up failed:", e)
+        with self._cond:
+            now = time.time()
+            for conn in opened:
+                self._idle.append((conn, now))
+            self._cond.notify_all()
+        return len(opened)
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            while self._idle:
+                conn, _ = self._idle.popleft()
+                self._close_conn(conn)
+            self._cond.notify_all()
+
+    def stats(self):
+        with self._cond:
+            self._evict_idle_locked()
+            stats = dict(self._stats)
+            stats.update({
+                "idle": len(self._idle),
+                "in_use": self._in_use,
+                "size": len(self._idle) + self._in_use,
+                "min_size": self.min_size,
+                "max_size": self.max_size,
+            })
+        return stats
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(db_params=None, **pool_options):
+    """
+    Returns the process-wide pool for the connection target, creating it on first use.
+    """
+    db_params = resolve_db_params(db_params)
+    key = target_key(db_params)
+    pool = _pools.get(key)
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.get(key)
+            if pool is None:
+                pool = ConnectionPool(db_params, **pool_options)
+                _pools[key] = pool
+    return pool
+
+
+def connection(db_params=None, timeout=None, read_only=False):
+    """
+    Shortcut for get_pool(db_params).connection(): a context manager yielding a pooled connection.
+    """
+    return get_pool(db_params).connection(timeout, read_only)
+
+
+def pool_stats():
+    with _pools_lock:
+        pools = dict(_pools)
+    return {key: pool.stats() for key, pool in pools.items()}
+
+
+def close_pool(db_params=None):
+    with _pools_lock:
+        pool = _pools.pop(target_key(db_params), None)
+    if pool is not None:
+        pool.close()
+
+
+def close_all():
+    with _pools_lock:
+        pools = list(_pools.values())
+        _pools.clear()
+    for pool in pools:
+        pool.close()
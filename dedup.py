@@ -0,0 +1,169 @@
+import asyncio
+import importlib
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+# "memory" (one process), "sqlite" (workers on one host share DEDUP_PATH) or "module:factory"
+DEDUP_BACKEND = os.getenv("DEDUP_BACKEND", "memory")
+# Slack retries a delivery for about five minutes; ids are remembered a while longer
+DEDUP_TTL = float(os.getenv("DEDUP_TTL", "900"))
+DEDUP_MAX_ENTRIES = int(os.getenv("DEDUP_MAX_ENTRIES", "100000"))
+DEDUP_PATH = os.getenv("DEDUP_PATH", os.path.join(".godeye_cache", "dedup.sqlite3"))
+# The SQLite store sweeps expired ids once every this many inserts, a bounded batch at a time
+DEDUP_SWEEP_EVERY = int(os.getenv("DEDUP_SWEEP_EVERY", "256"))
+
+
+class MemoryDedupStore:
+    """
+    Ids seen in the last `ttl` seconds, in one process. Every id gets the same TTL, so
+    insertion order is expiry order: expired ids are popped from the front of an
+    OrderedDict as new ones arrive, and the oldest go first past `max_entries`.
+    Insert and expiry are amortized O(1).
+    """
+
+    def __init__(self, ttl=DEDUP_TTL, max_entries=DEDUP_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._expires = OrderedDict()  # key -> expires_at, oldest first
+        self._lock = threading.Lock()
+        self._stats = {"new": 0, "duplicates": 0, "expired": 0, "evicted": 0}
+
+    def _evict_locked(self, now):
+        while self._expires:
+            key, expires_at = next(iter(self._expires.items()))
+            if expires_at > now:
+                break
+            del self._expires[key]
+            self._stats["expired"] += 1
+        while len(self._expires) > self.max_entries:
+            self._expires.popitem(last=False)
+            self._stats["evicted"] += 1
+
+    def first_seen(self, key):
+        """
+        Records `key` and returns True the first time within the TTL, False for a repeat.
+        """
+        now = time.time()
+        with self._lock:
+            self._evict_locked(now)
+            if key in self._expires:
+                self._stats["duplicates"] += 1
+                return False
+            self._expires[key] = now + self.ttl
+            self._stats["new"] += 1
+            self._evict_locked(now)
+        return True
+
+    def stats(self):
+        with self._lock:
+            self._evict_locked(time.time())
+            return dict(self._stats, backend="memory", entries=len(self._expires))
+
+
+class SQLiteDedupStore:
+    """
+    Ids seen in the last `ttl` seconds, shared by every worker process that opens the same
+    file. The check-and-set is a single upsert, so two workers receiving the same retry
+    cannot both claim it. Expired ids are deleted in bounded batches every
+    DEDUP_SWEEP_EVERY inserts, and the oldest past `max_entries`.
+    """
+
+    def __init__(self, path=DEDUP_PATH, ttl=DEDUP_TTL, max_entries=DEDUP_MAX_ENTRIES):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._inserts = 0
+        self._stats = {"new": 0, "duplicates": 0, "expired": 0, "evicted": 0}
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # Autocommit, and wait on other workers' writes instead of failing
+        self._db = sqlite3.connect(path, timeout=5, isolation_level=None, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("CREATE TABLE IF NOT EXISTS seen_ids (key TEXT PRIMARY KEY, expires_at REAL NOT NULL)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS seen_ids_expires ON seen_ids (expires_at)")
+
+    def _sweep_locked(self, now):
+        cursor = self._db.execute(
+            "DELETE FROM seen_ids WHERE key IN (SELECT key FROM seen_ids WHERE expires_at <= ? LIMIT ?)",
+            (now, DEDUP_SWEEP_EVERY * 2)
+        )
+        self._stats["expired"] += max(cursor.rowcount, 0)
+        cursor = self._db.execute(
+            "DELETE FROM seen_ids WHERE expires_at < "
+            "(SELECT expires_at FROM seen_ids ORDER BY expires_at DESC LIMIT 1 OFFSET ?)",
+            (self.max_entries,)
+        )
+        self._stats["evicted"] += max(cursor.rowcount, 0)
+
+    def first_seen(self, key):
+        now = time.time()
+        with self._lock:
+            # Inserts a new id, or takes over one whose earlier sighting has expired
+            cursor = self._db.execute(
+                "INSERT INTO seen_ids (key, expires_at) VALUES (?, ?) "
+                "ON CONFLICT (key) DO UPDATE SET expires_at = excluded.expires_at WHERE seen_ids.expires_at <= ?",
+                (key, now + self.ttl, now)
+            )
+            if cursor.rowcount != 1:
+                self._stats["duplicates"] += 1
+                return False
+            self._stats["new"] += 1
+            self._inserts += 1
+            if self._inserts % DEDUP_SWEEP_EVERY == 0:
+                self._sweep_locked(now)
+        return True
+
+    def stats(self):
+        with self._lock:
+            entries = self._db.execute("SELECT count(*) FROM seen_ids").fetchone()[0]
+            return dict(self._stats, backend="sqlite", entries=entries)
+
+
+def make_store(backend=DEDUP_BACKEND):
+    """
+    The configured store. "module:factory" plugs in a shared store (e.g. Redis-backed)
+    providing first_seen(key) and stats().
+    """
+    if backend == "memory":
+        return MemoryDedupStore()
+    if backend == "sqlite":
+        return SQLiteDedupStore()
+    module, _, factory = backend.partition(":")
+    return getattr(importlib.import_module(module), factory)()
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_dedup_store():
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = make_store()
+    return _store
+
+
+def first_seen(namespace, event_id):
+    """
+    True the first time `event_id` arrives in `namespace` ("slack", "telegram") within
+    DEDUP_TTL. Deliveries without an id cannot be matched and always count as new.
+    """
+    if event_id is None:
+        return True
+    return get_dedup_store().first_seen(f"{namespace}:{event_id}")
+
+
+async def afirst_seen(namespace, event_id):
+    """
+    first_seen for the webhook handlers. The SQLite (or a plugged-in) store can block on
+    another worker's lock, so the check runs in a thread instead of on the event loop.
+    """
+    return await asyncio.to_thread(first_seen, namespace, event_id)
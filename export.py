@@ -0,0 +1,232 @@
+import gzip
+import os
+import re
+import tempfile
+import threading
+import time
+from dataclasses import dataclass
+
+from db_pool import connection
+from cost_guard import session_settings, explain_sql, plan_estimates
+from sql_validator import MultipleStatements, single_statement
+
+
+# Exports may run far longer than an answer query, but not forever
+EXPORT_STATEMENT_TIMEOUT_MS = int(os.getenv("EXPORT_STATEMENT_TIMEOUT_MS", "300000"))
+# Plans above this estimated cost are not exported at all
+EXPORT_MAX_COST = float(os.getenv("EXPORT_MAX_COST", "50000000"))
+# Upper bound on the written (compressed) file; front ends pass their own upload limit
+EXPORT_MAX_BYTES = int(os.getenv("EXPORT_MAX_BYTES", str(1024 * 1024 * 1024)))
+EXPORT_DIR = os.getenv("EXPORT_DIR") or None
+EXPORT_FORMATS = ("csv", "parquet")
+
+_EXPORT_WORDS = re.compile(r"\b(export|download|full list|all rows|entire (?:list|result|table)|csv|parquet|spreadsheet)\b",
+                           re.IGNORECASE)
+
+# Postgres type OIDs -> pyarrow type names for Parquet columns; anything else stays text.
+# numeric (1700) stays text too: its precision and scale vary per value, and a float would round it
+_ARROW_TYPES = {
+    16: "bool_", 20: "int64", 21: "int16", 23: "int32", 26: "int64",
+    700: "float32", 701: "float64",
+    1082: "date32", 1114: "timestamp", 1184: "timestamp_tz",
+}
+
+
+class ExportTooLarge(Exception):
+    def __init__(self, max_bytes):
+        super().__init__(f"The export is larger than {max_bytes / (1024 * 1024):,.0f} MB. "
+                         "Please narrow the question down, e.g. with a date range or fewer columns.")
+
+
+class ExportRejected(Exception):
+    pass
+
+
+@dataclass
+class ExportFile:
+    path: str
+    filename: str
+    format: str
+    rows: int
+    size: int
+    seconds: float
+
+    @property
+    def mime_type(self):
+        return "application/gzip" if self.format == "csv" else "application/vnd.apache.parquet"
+
+    def describe(self):
+        return f"{self.rows:,} rows, {self.size / (1024 * 1024):,.1f} MB {self.format.upper()}"
+
+    def remove(self):
+        try:
+            os.unlink(self.path)
+        except OSError:
+            pass
+
+
+def wants_export(user_input):
+    """
+    The export format ("csv" or "parquet") when the question asks for the full data, else None.
+    """
+    match = _EXPORT_WORDS.search(user_input or "")
+    if not match:
+        return None
+    return "parquet" if "parquet" in user_input.lower() else "csv"
+
+
+def copy_sql(sql):
+    return f"COPY (\n{single_statement(sql)}\n) TO STDOUT WITH (FORMAT csv, HEADER true)"
+
+
+class _CappedFile:
+    """
+    File wrapper that counts what is written and stops the COPY once `max_bytes` is passed.
+    """
+
+    def __init__(self, raw, max_bytes):
+        self.raw = raw
+        self.max_bytes = max_bytes
+        self.size = 0
+
+    def write(self, data):
+        self.size += len(data)
+        if self.size > self.max_bytes:
+            raise ExportTooLarge(self.max_bytes)
+        return self.raw.write(data)
+
+    def flush(self):
+        self.raw.flush()
+
+
+def _copied_rows(cursor):
+    # COPY's status is "COPY <rows>"
+    try:
+        return int(cursor.statusmessage.split()[-1])
+    except (AttributeError, ValueError, IndexError):
+        return cursor.rowcount
+
+
+def _begin(conn):
+    cursor = conn.cursor()
+    for statement in session_settings(statement_timeout_ms=EXPORT_STATEMENT_TIMEOUT_MS):
+        cursor.execute(statement)
+    return cursor
+
+
+def _check_cost(cursor, sql):
+    try:
+        cursor.execute(explain_sql(sql))
+    except MultipleStatements as e:
+        raise ExportRejected(str(e))
+    cost, rows = plan_estimates(cursor.fetchone()[0])
+    if cost > EXPORT_MAX_COST:
+        raise ExportRejected(f"This export is too expensive to run (estimated cost {cost:,.0f}, "
+                             f"limit {EXPORT_MAX_COST:,.0f}). Please narrow it down.")
+    return rows
+
+
+def _export_csv(cursor, sql, path, max_bytes):
+    # COPY streams through psycopg2 in small buffers straight into gzip on disk
+    with open(path, "wb") as raw:
+        capped = _CappedFile(raw, max_bytes)
+        with gzip.GzipFile(filename="", mode="wb", fileobj=capped) as compressed:
+            cursor.copy_expert(copy_sql(sql), compressed)
+    return _copied_rows(cursor), capped.size
+
+
+def _arrow_schema(cursor, sql):
+    import pyarrow as pa
+
+    cursor.execute(f"SELECT * FROM (\n{single_statement(sql)}\n) AS export LIMIT 0")
+    fields = []
+    for column in cursor.description:
+        name = _ARROW_TYPES.get(column.type_code, "string")
+        if name == "timestamp":
+            kind = pa.timestamp("us")
+        elif name == "timestamp_tz":
+            kind = pa.timestamp("us", tz="UTC")
+        else:
+            kind = getattr(pa, name)()
+        fields.append(pa.field(column.name, kind))
+    return pa.schema(fields)
+
+
+def _export_parquet(cursor, sql, path, max_bytes):
+    """
+    COPY writes CSV into a pipe from a worker thread while pyarrow reads it block by block
+    and appends row groups to the Parquet file, so memory stays at one block.
+    """
+    import pyarrow as pa
+    import pyarrow.csv as pa_csv
+    import pyarrow.parquet as pq
+
+    schema = _arrow_schema(cursor, sql)
+    read_fd, write_fd = os.pipe()
+    copy_error = []
+
+    def run_copy():
+        with os.fdopen(write_fd, "wb") as pipe:
+            try:
+                cursor.copy_expert(copy_sql(sql), pipe)
+            except Exception as e:
+                copy_error.append(e)
+
+    worker = threading.Thread(target=run_copy, name="export-copy", daemon=True)
+    worker.start()
+    rows = 0
+    try:
+        with os.fdopen(read_fd, "rb") as pipe:
+            reader = pa_csv.open_csv(
+                pipe,
+                # Quoted text values may span lines
+                parse_options=pa_csv.ParseOptions(newlines_in_values=True),
+                # Postgres writes booleans as t / f, NULL unquoted and an empty string as ""
+                convert_options=pa_csv.ConvertOptions(
+                    column_types=schema, true_values=["t"], false_values=["f"],
+                    strings_can_be_null=True, quoted_strings_can_be_null=False,
+                ),
+            )
+            with pq.ParquetWriter(path, schema, compression="zstd") as writer:
+                for batch in reader:
+                    writer.write_table(pa.Table.from_batches([batch], schema=schema))
+                    rows += batch.num_rows
+                    if os.path.getsize(path) > max_bytes:
+                        raise ExportTooLarge(max_bytes)
+    finally:
+        # Closing the read end (above) makes a still-running COPY fail instead of blocking
+        worker.join()
+    if copy_error:
+        raise copy_error[0]
+    return rows, os.path.getsize(path)
+
+
+def export_result(sql, db_params=None, fmt="csv", max_bytes=EXPORT_MAX_BYTES, filename="result"):
+    """
+    Runs `sql` with COPY ... TO STDOUT (read-only, EXPORT_STATEMENT_TIMEOUT_MS) and streams
+    it into a gzip CSV or a Parquet file in EXPORT_DIR without building rows in Python.
+    Returns an ExportFile; the caller uploads it and then calls remove().
+    Raises ExportRejected for plans above EXPORT_MAX_COST and ExportTooLarge past max_bytes.
+    """
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"Unknown export format {fmt!r}")
+    suffix = ".csv.gz" if fmt == "csv" else ".parquet"
+    handle, path = tempfile.mkstemp(prefix="godeye-export-", suffix=suffix, dir=EXPORT_DIR)
+    os.close(handle)
+    started = time.perf_counter()
+    try:
+        with connection(db_params, read_only=True) as conn:
+            cursor = _begin(conn)
+            try:
+                _check_cost(cursor, sql)
+                if fmt == "csv":
+                    rows, size = _export_csv(cursor, sql, path, max_bytes)
+                else:
+                    rows, size = _export_parquet(cursor, sql, path, max_bytes)
+            finally:
+                cursor.close()
+                conn.rollback()
+    except BaseException:
+        os.unlink(path)
+        raise
+    return ExportFile(path, filename + suffix, fmt, rows, size, round(time.perf_counter() - started, 3))
@@ -1,14 +1,6 @@
 import psycopg2
-from dotenv import load_dotenv
-import os
-
-
-load_dotenv()
-
-HOST_DB = os.getenv("HOST_DB")
-PASSWORD_DB = os.getenv("PASSWORD_DB")
-USER_DB = os.getenv("USER_DB")
-DB_NAME = os.getenv("DB_NAME")
+from db_config import resolve_db_params, describe_target
+from db_pool import connection, PoolTimeout
 
 def fetch_tables_and_columns(conn):
     cursor = conn.cursor()
@@ -73,24 +65,16 @@ def fetch_foreign_keys(conn):
     return foreign_keys
 
 def fetch_schema_from_db(db_params=None):
-    if db_params is None:
-        db_params = {
-            "dbname": DB_NAME,
-            "user": USER_DB,
-            "password": PASSWORD_DB,
-            "host": HOST_DB,
-            "port": "5432"
-        }
-    print("Connecting to database with params:", db_params)
+    db_params = resolve_db_params(db_params)
+    print("Connecting to database:", describe_target(db_params))
     try:
-        conn = psycopg2.connect(**db_params)
-        print("Connected to database successfully")
-    except psycopg2.Error as e:
+        with connection(db_params) as conn:
+            print("Connected to database successfully")
+            all_tables, all_columns = fetch_tables_and_columns(conn)
+            print("All tables:", all_tables)
+            primary_keys = fetch_primary_keys(conn)
+            foreign_keys = fetch_foreign_keys(conn)
+    except (psycopg2.Error, PoolTimeout) as e:
         print("Failed to connect to database:", e)
         return None, None, None, None
-    all_tables, all_columns = fetch_tables_and_columns(conn)
-    print("All tables:", all_tables)
-    primary_keys = fetch_primary_keys(conn)
-    foreign_keys = fetch_foreign_keys(conn)
-    conn.close()
-    return all_tables, all_columns, primary_keys, foreign_keys
\ No newline at end of file
+    return all_tables, all_columns, primary_keys, foreign_keys
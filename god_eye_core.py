@@ -1,38 +1,71 @@
-from fetch_schema import fetch_schema_from_db
-from sql_runner import run_sql_query, check_sql_columns
-import openai
-import difflib
+from schema_cache import get_schema_entry
+from nl_cache import get_nl_cache
+from schema_index import get_schema_index
+from sql_runner import SQL_ROW_BUDGET
+from sql_validator import get_identifier_index, validate_sql, apply_fixes
+from result_cache import cached_fetch_result
+from cost_guard import guarded_fetch_result, AdmissionRejected
+from telemetry import span
+from llm_gateway import get_llm_gateway
+from repair import (
+    classify_error, repair_locally, delta_prompt, referenced_tables, repair_stats, MAX_LOCAL_REPAIRS
+)
 import re
 
 MAX_ATTEMPTS = 3
 
-def find_closest(name, options):
-    matches = difflib.get_close_matches(name, options, n=1)
-    return matches[0] if matches else None
-
-
 def clean_sql(sql):
     # Remove code fences and leading/trailing whitespace
     return re.sub(r"^```(?:sql)?|```$", "", sql, flags=re.IGNORECASE | re.MULTILINE).strip()
 
-def generate_sql_and_results(user_input, openai_api_key, db_params=None):
-    openai.api_key = openai_api_key
-
-    # Fetch schema for the correct database
-    all_tables, all_columns, primary_keys, foreign_keys = fetch_schema_from_db(db_params)
-    print('DB params:', db_params)
-    print('All tables:', all_tables)
-    def build_schema_summary():
-        summary = "Database schema:\n"
-        summary += "Tables:\n"
-        for table in all_tables:
-            summary += f"  - {table}\n"
-        summary += "Columns per table:\n"
-        for table, columns in all_columns.items():
-            summary += f"  {table}: {columns}\n"
-        return summary
-
-    schema_summary = build_schema_summary()
+def serve_cache(method, *args):
+    # ("cache", (method, *args)) steps: calls on the question-to-SQL cache, which does SQLite I/O
+    return getattr(get_nl_cache(), method)(*args)
+
+
+def drive_steps(steps, serve):
+    """
+    Runs a step generator such as sql_answer_steps with a blocking `serve(kind, payload)`.
+    Cache steps are served here, so `serve` only handles "llm" and "sql".
+    """
+    value, error = None, None
+    while True:
+        try:
+            kind, payload = steps.throw(error) if error is not None else steps.send(value)
+        except StopIteration as stop:
+            return stop.value
+        try:
+            value, error = (serve_cache(*payload) if kind == "cache" else serve(kind, payload)), None
+        except Exception as e:
+            value, error = None, e
+
+
+def sql_answer_steps(user_input, schema):
+    """
+    The question-to-results loop, written once for the blocking and the asyncio front ends.
+    It yields ("llm", messages), ("sql", query) and ("cache", (method, *args)) requests; the
+    driver sends back the completion text, the query result or the cache's return value, or
+    throws in the exception raised while serving it.
+    Returns (sql_query, results, error).
+    """
+    # Questions answered before (or paraphrases of them) skip the LLM entirely
+    cached_sql = yield "cache", ("lookup", user_input, schema.fingerprint)
+    if cached_sql:
+        try:
+            results = yield "sql", cached_sql
+            return cached_sql, results, None
+        except AdmissionRejected as e:
+            return cached_sql, None, str(e)
+        except Exception as e:
+            print("Cached SQL failed, regenerating:", e)
+            yield "cache", ("forget", schema.fingerprint, cached_sql)
+
+    # Only the tables relevant to the question (plus their join paths) go into the prompt
+    with span("prompt_build") as attrs:
+        schema_summary, schema_stats = get_schema_index(schema).prompt_schema(user_input)
+        attrs.update(tables=schema_stats["tables"], tokens_saved=schema_stats["tokens_saved"])
+    print(f"Schema prompt: {schema_stats['tables']}/{schema_stats['tables_total']} tables, "
+          f"~{schema_stats['tokens_saved']} tokens saved")
     prompt = (
         f"{schema_summary}\n"
         "# Example: SELECT products.product_name, products.price FROM products ORDER BY products.price DESC LIMIT 5;\n"
@@ -44,33 +77,93 @@ def generate_sql_and_results(user_input, openai_api_key, db_params=None):
         "based on this adjust the SQL query to match the user's request: "
         f"{user_input}"
     )
-    attempts = 0
-    while attempts < MAX_ATTEMPTS:
-        response = openai.chat.completions.create(
-            model="gpt-3.5-turbo",
-            messages=[{"role": "user", "content": prompt}]
-        )
-        sql_query = response.choices[0].message.content.strip()
-        sql_query = clean_sql(sql_query)  # <-- Clean code fences
-        table, bad_col = check_sql_columns(sql_query, all_columns)
-        if bad_col:
-            # Try to find the closest column name
-            closest = find_closest(bad_col, all_columns.get(table, []))
-            if closest:
-                # Replace the bad column with the closest match and try again
-                sql_query = sql_query.replace(bad_col, closest)
-                attempts += 1
+    index = get_identifier_index(schema)
+    # Messages for the next LLM call; None while a locally repaired query is re-run
+    messages = [{"role": "user", "content": prompt}]
+    sql_query = None
+    problems = []
+    llm_calls = local_repairs = delta_prompts = 0
+    errors = []
+
+    def finish(succeeded):
+        repair_stats.record_answer(succeeded, llm_calls, local_repairs, delta_prompts, errors)
+
+    while messages is None or llm_calls < MAX_ATTEMPTS:
+        if messages is not None:
+            content = yield "llm", messages
+            llm_calls += 1
+            sql_query = clean_sql(content.strip())  # <-- Clean code fences
+            messages = None
+            with span("sql_validate") as attrs:
+                problems = validate_sql(sql_query, index)
+                if problems and all(problem.suggestion for problem in problems):
+                    # Every problem has a local fix (closest name or qualification); no LLM call needed
+                    sql_query = apply_fixes(sql_query, problems)
+                    problems = validate_sql(sql_query, index)
+                attrs["problems"] = len(problems)
+            if problems:
+                # Ask once for all remaining problems instead of one retry per problem
+                listed = "\n".join(f"- {problem.describe()}" for problem in problems)
+                messages = [{"role": "user", "content": prompt}] + [
+                    {"role": "assistant", "content": sql_query},
+                    {"role": "user", "content": f"This SQL has these problems:\n{listed}\nFix all of them and return only the corrected SQL."},
+                ]
                 continue
-            else:
-                return sql_query, None, f"The column '{bad_col}' does not exist in '{table}'. Available columns: {all_columns[table]}"
-        else:
-            print("Final SQL query:", sql_query)
-            try:
-                results = run_sql_query(sql_query, db_params)
-                return sql_query, results, None
-            except Exception as e:
-                # If error is due to syntax, try again
-                print("SQL execution error:", e)
-                attempts += 1
+        print("Final SQL query:", sql_query)
+        try:
+            results = yield "sql", sql_query
+            yield "cache", ("store", user_input, schema.fingerprint, sql_query)
+            finish(True)
+            return sql_query, results, None
+        except AdmissionRejected as e:
+            finish(False)
+            return sql_query, None, str(e)
+        except Exception as e:
+            failure = classify_error(e)
+            errors.append(failure.kind)
+            print(f"SQL execution error ({failure.kind}):", failure.message)
+            if not failure.retryable:
+                finish(False)
+                return sql_query, None, failure.user_message()
+            repaired = repair_locally(sql_query, failure, index) if local_repairs < MAX_LOCAL_REPAIRS else None
+            if repaired:
+                # The error named the bad identifier; rewrite it and re-run without the LLM
+                local_repairs += 1
+                sql_query = repaired
                 continue
-    return sql_query, None, f"Failed to generate a valid SQL query after {MAX_ATTEMPTS} attempts."
\ No newline at end of file
+            # Feed the error back with only the tables the query touches
+            delta_prompts += 1
+            tables = referenced_tables(sql_query, index)
+            summary = get_schema_index(schema).summary(tables) if tables else schema_summary
+            messages = [{"role": "user", "content": delta_prompt(user_input, sql_query, failure, summary)}]
+    finish(False)
+    if problems:
+        listed = "; ".join(problem.describe() for problem in problems)
+        return sql_query, None, f"The generated SQL is not valid for this database: {listed}"
+    return sql_query, None, f"Failed to generate a valid SQL query after {MAX_ATTEMPTS} attempts."
+
+
+def sql_serve(openai_api_key, db_params=None, row_budget=SQL_ROW_BUDGET):
+    """
+    The blocking `serve(kind, payload)` for sql_answer_steps: LLM requests through the
+    gateway, queries through the result cache and the cost guard.
+    """
+    def serve(kind, payload):
+        if kind == "llm":
+            return get_llm_gateway().complete("sql", payload, openai_api_key)
+        with span("sql_execute") as attrs:
+            result = cached_fetch_result(payload, db_params, row_budget, fetch=guarded_fetch_result)
+            attrs["rows"] = result.row_count
+        return result
+
+    return serve
+
+
+def generate_sql_and_results(user_input, openai_api_key, db_params=None, row_budget=SQL_ROW_BUDGET):
+    # Schema for the correct database, served from the process-wide cache
+    with span("schema_fetch"):
+        schema = get_schema_entry(db_params)
+    if schema is None:
+        return None, None, "Could not read the database schema. Please check the database connection."
+
+    return drive_steps(sql_answer_steps(user_input, schema), sql_serve(openai_api_key, db_params, row_budget))
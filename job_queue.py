@@ -0,0 +1,121 @@
+import asyncio
+import os
+import time
+from collections import OrderedDict, deque
+
+
+# Global cap on answers being worked on at once (each one holds LLM and database resources)
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "4"))
+# Jobs waiting beyond this are shed with a "busy" reply
+JOB_QUEUE_MAX = int(os.getenv("JOB_QUEUE_MAX", "50"))
+# One user cannot fill the queue on their own
+JOB_QUEUE_MAX_PER_USER = int(os.getenv("JOB_QUEUE_MAX_PER_USER", "3"))
+
+
+class JobScheduler:
+    """
+    Bounded asyncio job queue drained by a fixed set of workers.
+    Jobs are grouped by channel and then by user and served round-robin at both levels,
+    so one busy channel (or one chatty user inside it) cannot starve the others.
+    """
+
+    def __init__(self, workers=JOB_WORKERS, max_queue=JOB_QUEUE_MAX, max_per_user=JOB_QUEUE_MAX_PER_USER):
+        self.workers = workers
+        self.max_queue = max_queue
+        self.max_per_user = max_per_user
+        # channel -> user -> deque of (enqueued_at, job factory)
+        self._queues = OrderedDict()
+        self._queued_per_user = {}
+        self._depth = 0
+        self._available = None
+        self._tasks = []
+        self._running = 0
+        self._wait_times = deque(maxlen=1000)
+        self._stats = {"submitted": 0, "shed": 0, "completed": 0, "failed": 0, "wait_seconds_total": 0.0}
+
+    async def start(self):
+        if self._tasks:
+            return
+        self._available = asyncio.Semaphore(0)
+        self._tasks = [asyncio.create_task(self._worker(i)) for i in range(self.workers)]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def submit(self, job, channel=None, user=None):
+        """
+        Queues `job` (a zero-argument callable returning a coroutine).
+        Returns False without queueing when the queue or the user's share of it is full.
+        """
+        if self._available is None:
+            raise RuntimeError("JobScheduler.start() has not been called")
+        if self._depth >= self.max_queue or self._queued_per_user.get(user, 0) >= self.max_per_user:
+            self._stats["shed"] += 1
+            return False
+        users = self._queues.setdefault(channel, OrderedDict())
+        users.setdefault(user, deque()).append((time.monotonic(), job))
+        self._queued_per_user[user] = self._queued_per_user.get(user, 0) + 1
+        self._depth += 1
+        self._stats["submitted"] += 1
+        self._available.release()
+        return True
+
+    def _next_job(self):
+        # Take from the channel and user that were served least recently, then rotate them to the back
+        channel, users = next(iter(self._queues.items()))
+        user, jobs = next(iter(users.items()))
+        enqueued_at, job = jobs.popleft()
+        if jobs:
+            users.move_to_end(user)
+        else:
+            del users[user]
+        if users:
+            self._queues.move_to_end(channel)
+        else:
+            del self._queues[channel]
+        self._queued_per_user[user] -= 1
+        if not self._queued_per_user[user]:
+            del self._queued_per_user[user]
+        self._depth -= 1
+        return enqueued_at, job
+
+    async def _worker(self, number):
+        while True:
+            await self._available.acquire()
+            enqueued_at, job = self._next_job()
+            waited = time.monotonic() - enqueued_at
+            self._wait_times.append(waited)
+            self._stats["wait_seconds_total"] += waited
+            self._running += 1
+            try:
+                await job()
+                self._stats["completed"] += 1
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self._stats["failed"] += 1
+                print(f"Job failed in worker {number}:", repr(e))
+            finally:
+                self._running -= 1
+
+    def stats(self):
+        waits = sorted(self._wait_times)
+
+        def percentile(p):
+            return waits[min(int(p * len(waits)), len(waits) - 1)] if waits else 0.0
+
+        stats = dict(self._stats)
+        stats.update({
+            "queue_depth": self._depth,
+            "queue_max": self.max_queue,
+            "running": self._running,
+            "workers": self.workers,
+            "channels_waiting": len(self._queues),
+            "wait_p50_seconds": percentile(0.5),
+            "wait_p95_seconds": percentile(0.95),
+            "wait_max_seconds": waits[-1] if waits else 0.0,
+        })
+        return stats
@@ -0,0 +1,401 @@
+import asyncio
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from dotenv import load_dotenv
+from answer_pipeline import ANALYSIS_TIMEOUT, CHART_SPEC_TIMEOUT
+from telemetry import span, record_usage, llm_requests
+
+
+load_dotenv()
+OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
+GROQ_API_KEY = os.getenv("GROQ_API_KEY")
+# Default model per provider; a route may name another ("openai:gpt-4o-mini")
+PROVIDER_MODELS = {
+    "openai": os.getenv("OPENAI_MODEL", "gpt-3.5-turbo"),
+    "groq": os.getenv("GROQ_MODEL", "llama-3.1-8b-instant"),
+}
+TASKS = ("sql", "analysis", "chart")
+# Primary provider per task (LLM_ROUTE_SQL etc.); the other provider is the hedge backup
+LLM_ROUTES = {task: os.getenv(f"LLM_ROUTE_{task.upper()}", "openai") for task in TASKS}
+LLM_HEDGE = os.getenv("LLM_HEDGE", "1") == "1"
+# A backup request fires once the primary is slower than this percentile of its recent calls
+LLM_HEDGE_PERCENTILE = float(os.getenv("LLM_HEDGE_PERCENTILE", "90"))
+# Hedge delay used until a provider has LLM_HEDGE_MIN_SAMPLES latencies for the task
+LLM_HEDGE_DEFAULT_DELAY = float(os.getenv("LLM_HEDGE_DEFAULT_DELAY", "5"))
+LLM_HEDGE_MIN_SAMPLES = int(os.getenv("LLM_HEDGE_MIN_SAMPLES", "20"))
+LLM_LATENCY_WINDOW = int(os.getenv("LLM_LATENCY_WINDOW", "200"))
+LLM_SQL_TIMEOUT = float(os.getenv("LLM_SQL_TIMEOUT", "20"))
+# Hard limit per call, hedge included; for streams it bounds the wait for the first token
+TASK_TIMEOUTS = {"sql": LLM_SQL_TIMEOUT, "analysis": ANALYSIS_TIMEOUT, "chart": CHART_SPEC_TIMEOUT}
+LLM_WORKERS = int(os.getenv("LLM_WORKERS", "16"))
+
+
+class LLMTimeout(Exception):
+    pass
+
+
+def parse_route(value):
+    provider, _, model = value.partition(":")
+    return provider, model or PROVIDER_MODELS[provider]
+
+
+class LatencyTracker:
+    """
+    Rolling window of recent latencies per (provider, task).
+    """
+
+    def __init__(self, window=LLM_LATENCY_WINDOW):
+        self.window = window
+        self._samples = {}
+        self._lock = threading.Lock()
+
+    def observe(self, provider, task, seconds):
+        with self._lock:
+            samples = self._samples.get((provider, task))
+            if samples is None:
+                samples = self._samples[(provider, task)] = deque(maxlen=self.window)
+            samples.append(seconds)
+
+    def percentile(self, provider, task, q, min_samples=LLM_HEDGE_MIN_SAMPLES):
+        with self._lock:
+            samples = sorted(self._samples.get((provider, task), ()))
+        if len(samples) < min_samples:
+            return None
+        return samples[min(len(samples) - 1, int(len(samples) * q / 100.0))]
+
+    def stats(self):
+        with self._lock:
+            keys = list(self._samples)
+        return {
+            f"{provider}/{task}": {
+                "samples": len(self._samples[(provider, task)]),
+                "p50": self.percentile(provider, task, 50, 1),
+                "p90": self.percentile(provider, task, 90, 1),
+            }
+            for provider, task in keys
+        }
+
+
+def _close_quietly(stream):
+    try:
+        stream.close()
+    except Exception:
+        pass
+
+
+class LLMGateway:
+    """
+    The one way the app calls an LLM. Each task type (sql, analysis, chart) is routed to
+    its configured provider and model. When the call is slower than that provider's
+    recent p90 for the task, the same request also goes to the other provider; the
+    first answer wins. A provider error fails over to the other provider, and nothing
+    waits past the task's hard timeout (LLMTimeout).
+    """
+
+    def __init__(self):
+        self.latency = LatencyTracker()
+        self._clients = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=LLM_WORKERS, thread_name_prefix="llm")
+        self._stats = {"calls": 0, "hedged": 0, "backup_wins": 0, "failovers": 0, "timeouts": 0, "errors": 0}
+
+    def _count(self, name):
+        with self._lock:
+            self._stats[name] += 1
+
+    def _client(self, provider, api_key, asynchronous):
+        key = (provider, api_key, asynchronous)
+        client = self._clients.get(key)
+        if client is None:
+            with self._lock:
+                client = self._clients.get(key)
+                if client is None:
+                    # SDKs load on the first call, not when a bot imports this module
+                    if provider == "groq":
+                        import groq
+                        client = (groq.AsyncGroq if asynchronous else groq.Groq)(api_key=api_key)
+                    else:
+                        import openai
+                        client = (openai.AsyncOpenAI if asynchronous else openai.OpenAI)(api_key=api_key)
+                    self._clients[key] = client
+        return client
+
+    def candidates(self, task, openai_api_key=None, provider=None):
+        """
+        [(provider, model, api_key)] to try for the task: the routed one first, then the
+        hedge backup when hedging is on and the other provider has a key.
+        """
+        keys = {"openai": openai_api_key or OPENAI_API_KEY, "groq": GROQ_API_KEY}
+        primary, model = parse_route(provider or LLM_ROUTES.get(task, "openai"))
+        candidates = [(primary, model, keys[primary])]
+        if LLM_HEDGE:
+            for backup in PROVIDER_MODELS:
+                if backup != primary and keys[backup]:
+                    candidates.append((backup, PROVIDER_MODELS[backup], keys[backup]))
+        return candidates
+
+    def hedge_delay(self, provider, task, timeout):
+        delay = self.latency.percentile(provider, task, LLM_HEDGE_PERCENTILE)
+        return min(timeout, delay if delay is not None else LLM_HEDGE_DEFAULT_DELAY)
+
+    def _settle(self, task, timeout, winner, candidates, pending, errors):
+        # Shared bookkeeping once the race is over: counters for each outcome
+        primary = candidates[0][0]
+        if winner is not None:
+            llm_requests.inc(provider=winner[0], task=task, outcome="ok")
+            if winner[0] != primary:
+                self._count("backup_wins")
+        for candidate in pending:
+            llm_requests.inc(provider=candidate[0], task=task, outcome="lost" if winner else "timeout")
+        for provider, _ in errors:
+            llm_requests.inc(provider=provider, task=task, outcome="error")
+        if winner is not None:
+            return
+        if pending or not errors:
+            self._count("timeouts")
+            raise LLMTimeout(f"No LLM answered the {task} request within {timeout:.0f}s")
+        self._count("errors")
+        raise errors[-1][1]
+
+    def _race(self, task, candidates, call, timeout, discard=None, latency_key=None):
+        """
+        Runs `call(provider, model, api_key)` in worker threads with hedging and failover.
+        Returns ((provider, model, api_key), value). `discard(value)` releases the value of
+        a call that lost the race (an open stream). Latencies are tracked under
+        `latency_key` (default: the task).
+        """
+        self._count("calls")
+        latency_key = latency_key or task
+        deadline = time.monotonic() + timeout
+        hedge_at = time.monotonic() + self.hedge_delay(candidates[0][0], latency_key, timeout)
+        backups = list(candidates[1:])
+        pending, errors = {}, []
+
+        def launch(candidate):
+            started = time.monotonic()
+            future = self._executor.submit(call, *candidate)
+
+            def observe(done):
+                # Losers that finish still tell us how fast their provider is
+                if not done.cancelled() and done.exception() is None:
+                    self.latency.observe(candidate[0], latency_key, time.monotonic() - started)
+            future.add_done_callback(observe)
+            pending[future] = candidate
+
+        launch(candidates[0])
+        winner = None
+        while pending and winner is None:
+            now = time.monotonic()
+            if now >= deadline:
+                break
+            wake = min(deadline, hedge_at) if backups else deadline
+            done, _ = wait(pending, timeout=max(0.0, wake - now), return_when=FIRST_COMPLETED)
+            for future in done:
+                candidate = pending.pop(future)
+                try:
+                    winner = candidate, future.result()
+                    break
+                except Exception as e:
+                    print(f"LLM {candidate[0]} failed for {task}:", repr(e))
+                    errors.append((candidate[0], e))
+            if winner is None and backups and (not pending or time.monotonic() >= hedge_at):
+                self._count("hedged" if pending else "failovers")
+                launch(backups.pop(0))
+        def release(done):
+            if not done.cancelled() and done.exception() is None:
+                discard(done.result())
+
+        for future in pending:
+            if not future.cancel() and discard is not None:
+                future.add_done_callback(release)
+        self._settle(task, timeout, winner and winner[0], candidates, list(pending.values()), errors)
+        return winner
+
+    async def _arace(self, task, candidates, call, timeout, discard=None, latency_key=None):
+        """
+        asyncio counterpart of _race for a coroutine `call`; losing calls are cancelled.
+        """
+        self._count("calls")
+        latency_key = latency_key or task
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        hedge_at = loop.time() + self.hedge_delay(candidates[0][0], latency_key, timeout)
+        backups = list(candidates[1:])
+        pending, errors = {}, []
+
+        async def timed(candidate):
+            started = loop.time()
+            value = await call(*candidate)
+            self.latency.observe(candidate[0], latency_key, loop.time() - started)
+            return value
+
+        def launch(candidate):
+            pending[asyncio.ensure_future(timed(candidate))] = candidate
+
+        launch(candidates[0])
+        winner = None
+        try:
+            while pending and winner is None:
+                now = loop.time()
+                if now >= deadline:
+                    break
+                wake = min(deadline, hedge_at) if backups else deadline
+                done, _ = await asyncio.wait(pending, timeout=max(0.0, wake - now), return_when=asyncio.FIRST_COMPLETED)
+                for job in done:
+                    candidate = pending.pop(job)
+                    try:
+                        winner = candidate, job.result()
+                        break
+                    except Exception as e:
+                        print(f"LLM {candidate[0]} failed for {task}:", repr(e))
+                        errors.append((candidate[0], e))
+                if winner is None and backups and (not pending or loop.time() >= hedge_at):
+                    self._count("hedged" if pending else "failovers")
+                    launch(backups.pop(0))
+        finally:
+            # Also runs when the caller is cancelled (a stage timeout), so no request outlives it
+            for job in pending:
+                if not job.done():
+                    job.cancel()
+                elif not job.cancelled() and job.exception() is None and discard is not None:
+                    await discard(job.result())
+        self._settle(task, timeout, winner and winner[0], candidates, list(pending.values()), errors)
+        return winner
+
+    def complete(self, task, messages, openai_api_key=None, provider=None):
+        """
+        Completion text for `messages`, inside an "llm" span tagged with the task.
+        """
+        timeout = TASK_TIMEOUTS.get(task, LLM_SQL_TIMEOUT)
+
+        def call(provider, model, api_key):
+            return self._client(provider, api_key, False).chat.completions.create(
+                model=model, messages=messages, timeout=timeout
+            )
+
+        with span("llm", purpose=task) as attrs:
+            candidate, response = self._race(task, self.candidates(task, openai_api_key, provider), call, timeout)
+            attrs["provider"] = candidate[0]
+            record_usage(attrs, candidate[1], response.usage)
+        return response.choices[0].message.content
+
+    async def acomplete(self, task, messages, openai_api_key=None, provider=None):
+        timeout = TASK_TIMEOUTS.get(task, LLM_SQL_TIMEOUT)
+
+        async def call(provider, model, api_key):
+            return await self._client(provider, api_key, True).chat.completions.create(
+                model=model, messages=messages, timeout=timeout
+            )
+
+        with span("llm", purpose=task) as attrs:
+            candidate, response = await self._arace(task, self.candidates(task, openai_api_key, provider), call, timeout)
+            attrs["provider"] = candidate[0]
+            record_usage(attrs, candidate[1], response.usage)
+        return response.choices[0].message.content
+
+    @staticmethod
+    def _stream_options(provider):
+        # Only OpenAI reports usage on the last chunk when asked
+        return {"stream_options": {"include_usage": True}} if provider == "openai" else {}
+
+    def stream(self, task, messages, openai_api_key=None, provider=None):
+        """
+        Yields the completion text in chunks. The race (and the hedge) is on the first
+        token; the winning stream is then read to the end.
+        """
+        timeout = TASK_TIMEOUTS.get(task, LLM_SQL_TIMEOUT)
+
+        def call(provider, model, api_key):
+            stream = self._client(provider, api_key, False).chat.completions.create(
+                model=model, messages=messages, stream=True, timeout=timeout, **self._stream_options(provider)
+            )
+            chunks, first = iter(stream), []
+            for chunk in chunks:
+                first.append(chunk)
+                if chunk.choices and chunk.choices[0].delta.content:
+                    break
+            return stream, first, chunks
+
+        with span("llm", purpose=task, streamed=True) as attrs:
+            started = time.perf_counter()
+            candidate, (stream, first, chunks) = self._race(
+                task, self.candidates(task, openai_api_key, provider), call, timeout,
+                discard=lambda value: _close_quietly(value[0]), latency_key=f"{task}_first_token"
+            )
+            attrs["provider"] = candidate[0]
+            attrs["first_token_seconds"] = round(time.perf_counter() - started, 3)
+            try:
+                for chunk in first:
+                    record_usage(attrs, candidate[1], getattr(chunk, "usage", None))
+                    if chunk.choices and chunk.choices[0].delta.content:
+                        yield chunk.choices[0].delta.content
+                for chunk in chunks:
+                    record_usage(attrs, candidate[1], getattr(chunk, "usage", None))
+                    if chunk.choices and chunk.choices[0].delta.content:
+                        yield chunk.choices[0].delta.content
+            finally:
+                _close_quietly(stream)
+
+    async def astream(self, task, messages, openai_api_key=None, provider=None):
+        timeout = TASK_TIMEOUTS.get(task, LLM_SQL_TIMEOUT)
+
+        async def call(provider, model, api_key):
+            stream = await self._client(provider, api_key, True).chat.completions.create(
+                model=model, messages=messages, stream=True, timeout=timeout, **self._stream_options(provider)
+            )
+            chunks, first = stream.__aiter__(), []
+            async for chunk in chunks:
+                first.append(chunk)
+                if chunk.choices and chunk.choices[0].delta.content:
+                    break
+            return stream, first, chunks
+
+        async def discard(value):
+            try:
+                await value[0].close()
+            except Exception:
+                pass
+
+        with span("llm", purpose=task, streamed=True) as attrs:
+            started = time.perf_counter()
+            candidate, (stream, first, chunks) = await self._arace(
+                task, self.candidates(task, openai_api_key, provider), call, timeout,
+                discard=discard, latency_key=f"{task}_first_token"
+            )
+            attrs["provider"] = candidate[0]
+            attrs["first_token_seconds"] = round(time.perf_counter() - started, 3)
+            try:
+                for chunk in first:
+                    record_usage(attrs, candidate[1], getattr(chunk, "usage", None))
+                    if chunk.choices and chunk.choices[0].delta.content:
+                        yield chunk.choices[0].delta.content
+                async for chunk in chunks:
+                    record_usage(attrs, candidate[1], getattr(chunk, "usage", None))
+                    if chunk.choices and chunk.choices[0].delta.content:
+                        yield chunk.choices[0].delta.content
+            finally:
+                await discard((stream,))
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        stats["routes"] = {task: "{}:{}".format(*parse_route(LLM_ROUTES[task])) for task in TASKS}
+        stats["latency"] = self.latency.stats()
+        return stats
+
+
+_gateway = None
+_gateway_lock = threading.Lock()
+
+
+def get_llm_gateway():
+    global _gateway
+    if _gateway is None:
+        with _gateway_lock:
+            if _gateway is None:
+                _gateway = LLMGateway()
+    return _gateway
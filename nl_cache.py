@@ -0,0 +1,267 @@
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+
+
+NL_CACHE_PATH = os.getenv("NL_CACHE_PATH", os.path.join(".godeye_cache", "nl_sql.sqlite3"))
+NL_CACHE_MAX_ENTRIES = int(os.getenv("NL_CACHE_MAX_ENTRIES", "5000"))
+NL_CACHE_TTL = float(os.getenv("NL_CACHE_TTL", str(7 * 24 * 3600)))
+# Minimum weighted token overlap for a paraphrase to reuse cached SQL
+NL_CACHE_SIMILARITY = float(os.getenv("NL_CACHE_SIMILARITY", "0.8"))
+
+# Words that do not change which SQL answers a question
+STOPWORDS = {
+    "a", "an", "the", "me", "my", "our", "us", "we", "i", "you", "please", "show", "give", "list",
+    "display", "get", "find", "tell", "what", "which", "who", "is", "are", "was", "were", "be",
+    "of", "for", "in", "on", "at", "by", "to", "from", "with", "and", "all", "can", "could",
+    "would", "do", "does", "did", "there", "that", "this", "these", "those", "it", "its", "about",
+    "how", "many", "much", "some", "any", "data", "info", "information", "kindly", "let", "see",
+}
+
+# Words and phrases that change what is asked about the rows; two questions only share SQL
+# when they ask the same (count vs list, top vs bottom, with vs without, ...)
+INTENT_WORDS = {
+    "count": "count", "number": "count",
+    "sum": "sum", "total": "sum", "totals": "sum",
+    "average": "avg", "avg": "avg", "mean": "avg",
+    "top": "top", "highest": "top", "most": "top", "max": "top", "maximum": "top", "largest": "top",
+    "biggest": "top", "best": "top",
+    "bottom": "bottom", "lowest": "bottom", "least": "bottom", "fewest": "bottom", "min": "bottom",
+    "minimum": "bottom", "smallest": "bottom", "cheapest": "bottom", "worst": "bottom",
+    "not": "not", "no": "not", "without": "not", "never": "not", "except": "not", "excluding": "not",
+    "sort": "order", "sorted": "order", "order": "order", "ordered": "order", "ascending": "order",
+    "descending": "order", "latest": "order", "earliest": "order", "newest": "order", "oldest": "order",
+    "recent": "order", "first": "order", "last": "order",
+    "distinct": "distinct", "unique": "distinct",
+    "per": "group", "each": "group", "by": "group", "breakdown": "group", "grouped": "group",
+}
+INTENT_PHRASES = {"how many": "count", "how much": "sum", "number of": "count"}
+
+
+def normalize_question(question):
+    return " ".join(re.findall(r"[a-z0-9]+", question.lower()))
+
+
+def question_intents(normalized):
+    padded = f" {normalized} "
+    intents = {INTENT_WORDS[word] for word in normalized.split() if word in INTENT_WORDS}
+    intents.update(intent for phrase, intent in INTENT_PHRASES.items() if f" {phrase} " in padded)
+    return intents
+
+
+def question_tokens(normalized):
+    # Intents become "#count"-style tokens, so "sum" and "total" match each other
+    tokens = {f"#{intent}" for intent in question_intents(normalized)}
+    for word in normalized.split():
+        if word in STOPWORDS or word in INTENT_WORDS:
+            continue
+        # Cheap plural folding so "customer" and "customers" match
+        if len(word) > 3 and word.endswith("s") and not word.endswith("ss"):
+            word = word[:-1]
+        tokens.add(word)
+    return tokens
+
+
+def _numbers(tokens):
+    return {t for t in tokens if t.isdigit()}
+
+
+def _intents(tokens):
+    return {t for t in tokens if t.startswith("#")}
+
+
+class NLSQLCache:
+    """
+    Persistent map from (normalized question, schema fingerprint) to SQL that ran successfully.
+    Exact keys are looked up in SQLite; paraphrases go through an in-memory inverted token
+    index per schema fingerprint, scored by Jaccard overlap of content words among entries
+    with the same numbers and the same intent (count, sum, top, without, ...).
+    """
+
+    def __init__(self, path=NL_CACHE_PATH, max_entries=NL_CACHE_MAX_ENTRIES, ttl=NL_CACHE_TTL,
+                 similarity=NL_CACHE_SIMILARITY):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.similarity = similarity
+        self._lock = threading.Lock()
+        # schema_fp -> {"docs": {key: token set}, "postings": {token: set of keys}}
+        self._indexes = {}
+        self._stats = {"exact_hits": 0, "similar_hits": 0, "misses": 0, "stores": 0, "evictions": 0}
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS nl_sql (
+                key TEXT PRIMARY KEY,
+                schema_fp TEXT NOT NULL,
+                question TEXT NOT NULL,
+                sql TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                last_used REAL NOT NULL,
+                hits INTEGER NOT NULL DEFAULT 0
+            )
+        """)
+        self._db.execute("CREATE INDEX IF NOT EXISTS nl_sql_schema ON nl_sql (schema_fp)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS nl_sql_last_used ON nl_sql (last_used)")
+        self._db.commit()
+
+    @staticmethod
+    def make_key(normalized, schema_fp):
+        return hashlib.sha1(f"{schema_fp}\0{normalized}".encode("utf-8")).hexdigest()
+
+    def _index(self, schema_fp):
+        index = self._indexes.get(schema_fp)
+        if index is None:
+            index = {"docs": {}, "postings": {}}
+            rows = self._db.execute(
+                "SELECT key, question FROM nl_sql WHERE schema_fp = ? AND created_at >= ?",
+                (schema_fp, time.time() - self.ttl)
+            ).fetchall()
+            for key, question in rows:
+                self._index_add(index, key, question_tokens(question))
+            self._indexes[schema_fp] = index
+        return index
+
+    @staticmethod
+    def _index_add(index, key, tokens):
+        index["docs"][key] = tokens
+        for token in tokens:
+            index["postings"].setdefault(token, set()).add(key)
+
+    def _index_remove(self, key):
+        for index in self._indexes.values():
+            tokens = index["docs"].pop(key, None)
+            if tokens is None:
+                continue
+            for token in tokens:
+                keys = index["postings"].get(token)
+                if keys is not None:
+                    keys.discard(key)
+                    if not keys:
+                        del index["postings"][token]
+
+    def _best_paraphrase(self, index, tokens):
+        if not tokens:
+            return None
+        numbers, intents = _numbers(tokens), _intents(tokens)
+        overlap = {}
+        for token in tokens:
+            for key in index["postings"].get(token, ()):
+                overlap[key] = overlap.get(key, 0) + 1
+        best_key, best_score = None, 0.0
+        for key, shared in overlap.items():
+            candidate = index["docs"][key]
+            # "top 5" and "top 10" must never share SQL
+            if _numbers(candidate) != numbers:
+                continue
+            # Nor "how many customers" and "show all customers"
+            if _intents(candidate) != intents:
+                continue
+            score = shared / len(tokens | candidate)
+            if score > best_score:
+                best_key, best_score = key, score
+        return best_key if best_score >= self.similarity else None
+
+    def lookup(self, question, schema_fp):
+        """
+        Returns cached SQL for the question (or a close paraphrase of it), or None.
+        """
+        normalized = normalize_question(question)
+        key = self.make_key(normalized, schema_fp)
+        now = time.time()
+        with self._lock:
+            row = self._db.execute(
+                "SELECT sql FROM nl_sql WHERE key = ? AND created_at >= ?", (key, now - self.ttl)
+            ).fetchone()
+            kind = "exact_hits"
+            if row is None:
+                key = self._best_paraphrase(self._index(schema_fp), question_tokens(normalized))
+                if key is not None:
+                    row = self._db.execute(
+                        "SELECT sql FROM nl_sql WHERE key = ? AND created_at >= ?", (key, now - self.ttl)
+                    ).fetchone()
+                    kind = "similar_hits"
+            if row is None:
+                self._stats["misses"] += 1
+                return None
+            self._stats[kind] += 1
+            self._db.execute("UPDATE nl_sql SET last_used = ?, hits = hits + 1 WHERE key = ?", (now, key))
+            self._db.commit()
+            return row[0]
+
+    def store(self, question, schema_fp, sql):
+        normalized = normalize_question(question)
+        key = self.make_key(normalized, schema_fp)
+        now = time.time()
+        with self._lock:
+            self._db.execute("""
+                INSERT INTO nl_sql (key, schema_fp, question, sql, created_at, last_used)
+                VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT (key) DO UPDATE SET sql = excluded.sql, created_at = excluded.created_at,
+                                                last_used = excluded.last_used
+            """, (key, schema_fp, normalized, sql, now, now))
+            self._stats["stores"] += 1
+            self._index_remove(key)
+            if schema_fp in self._indexes:
+                self._index_add(self._indexes[schema_fp], key, question_tokens(normalized))
+            self._evict(now)
+            self._db.commit()
+
+    def forget(self, schema_fp, sql):
+        """
+        Drops every cached question that maps to `sql`, e.g. after it stopped running.
+        """
+        with self._lock:
+            keys = [k for (k,) in self._db.execute(
+                "SELECT key FROM nl_sql WHERE schema_fp = ? AND sql = ?", (schema_fp, sql)
+            )]
+            for key in keys:
+                self._index_remove(key)
+            self._db.execute("DELETE FROM nl_sql WHERE schema_fp = ? AND sql = ?", (schema_fp, sql))
+            self._db.commit()
+
+    def _evict(self, now):
+        expired = [k for (k,) in self._db.execute("SELECT key FROM nl_sql WHERE created_at < ?", (now - self.ttl,))]
+        (count,) = self._db.execute("SELECT count(*) FROM nl_sql").fetchone()
+        overflow = count - len(expired) - self.max_entries
+        if overflow > 0:
+            # Least recently used entries go first
+            expired += [k for (k,) in self._db.execute(
+                "SELECT key FROM nl_sql WHERE created_at >= ? ORDER BY last_used LIMIT ?", (now - self.ttl, overflow)
+            )]
+        for key in expired:
+            self._index_remove(key)
+        self._db.executemany("DELETE FROM nl_sql WHERE key = ?", [(k,) for k in expired])
+        self._stats["evictions"] += len(expired)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            (stats["entries"],) = self._db.execute("SELECT count(*) FROM nl_sql").fetchone()
+        lookups = stats["exact_hits"] + stats["similar_hits"] + stats["misses"]
+        stats["hit_rate"] = (stats["exact_hits"] + stats["similar_hits"]) / lookups if lookups else 0.0
+        return stats
+
+    def clear(self):
+        with self._lock:
+            self._db.execute("DELETE FROM nl_sql")
+            self._db.commit()
+            self._indexes.clear()
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_nl_cache():
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = NLSQLCache()
+    return _cache
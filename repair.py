@@ -0,0 +1,203 @@
+import re
+import threading
+from collections import Counter
+from dataclasses import dataclass
+
+from sql_validator import parse_sql, alias_for, quote_ident, Problem, apply_fixes
+
+
+# Local rewrites tried per answer before falling back to the LLM
+MAX_LOCAL_REPAIRS = 3
+
+# SQLSTATE -> error class
+ERROR_CLASSES = {
+    "42703": "unknown_column",
+    "42702": "ambiguous_column",
+    "42P01": "unknown_table",
+    "42804": "type_mismatch",
+    "42883": "type_mismatch",  # operator/function does not exist for these argument types
+    "22P02": "type_mismatch",  # invalid input syntax for type
+    "22007": "type_mismatch",  # invalid datetime format
+    "22008": "type_mismatch",  # datetime field overflow
+    "42803": "grouping",
+    "42601": "syntax",
+    "57014": "timeout",
+    "25006": "not_read_only",
+    "42501": "permission",
+}
+
+# Classes the LLM cannot fix by rewriting the query
+NOT_RETRYABLE = {"not_read_only", "permission", "connection"}
+
+HINTS = {
+    "unknown_column": "Use only columns that exist in the tables below.",
+    "ambiguous_column": "Qualify every column with its table name or alias.",
+    "unknown_table": "Use only the tables below.",
+    "type_mismatch": "Cast values so both sides of each comparison or function argument have compatible types "
+                     "(e.g. ROUND(x::numeric, 2), compare dates with DATE 'YYYY-MM-DD').",
+    "grouping": "Every selected column must be aggregated or listed in GROUP BY.",
+    "syntax": "Fix the PostgreSQL syntax error.",
+    "timeout": "The query timed out; make it cheaper (filter earlier, avoid cross joins, aggregate before joining).",
+}
+
+_UNKNOWN_COLUMN = re.compile(r'column "?(?:(\w+)\.)?(\w+)"? does not exist')
+_AMBIGUOUS_COLUMN = re.compile(r'column reference "(\w+)" is ambiguous')
+_UNKNOWN_TABLE = re.compile(r'relation "(?:\w+\.)?(\w+)" does not exist')
+_HINT_COLUMN = re.compile(r'reference the column "(?:(\w+)\.)?(\w+)"')
+
+
+@dataclass
+class SqlFailure:
+    kind: str
+    message: str
+    sqlstate: str = None
+    hint: str = None
+
+    @property
+    def retryable(self):
+        return self.kind not in NOT_RETRYABLE
+
+    def user_message(self):
+        if self.kind == "not_read_only":
+            return "Only read-only questions are supported; the generated query tried to modify data."
+        if self.kind == "permission":
+            return "The database user is not allowed to read the data this question needs."
+        if self.kind == "connection":
+            return "The database is not reachable right now. Please try again later."
+        return f"The query failed: {self.message}"
+
+
+def classify_error(exc):
+    """
+    Maps a psycopg2 or asyncpg exception to a SqlFailure using its SQLSTATE.
+    """
+    sqlstate = getattr(exc, "pgcode", None) or getattr(exc, "sqlstate", None)
+    diag = getattr(exc, "diag", None)
+    hint = getattr(diag, "message_hint", None) if diag is not None else getattr(exc, "hint", None)
+    message = (getattr(exc, "pgerror", None) or str(exc)).strip().splitlines()[0] if str(exc) else repr(exc)
+    if message.startswith("ERROR:"):
+        message = message[len("ERROR:"):].strip()
+    if sqlstate is None:
+        kind = "connection" if isinstance(exc, (OSError, ConnectionError)) or "connection" in message.lower() else "unknown"
+    elif sqlstate.startswith("08"):
+        kind = "connection"
+    else:
+        kind = ERROR_CLASSES.get(sqlstate, "unknown")
+    return SqlFailure(kind, message, sqlstate, hint)
+
+
+def repair_locally(sql, failure, index):
+    """
+    Deterministic fix for errors that name the offending identifier. Returns the rewritten
+    SQL, or None when the error needs the LLM. Only exact token spans are rewritten.
+    """
+    _, scope = parse_sql(sql)
+    problems = []
+    if failure.kind == "unknown_column":
+        match = _UNKNOWN_COLUMN.search(failure.message)
+        if not match:
+            return None
+        # Postgres reports names as resolved: unquoted ones already folded, quoted ones exact
+        qualifier, name = match.group(1) or None, match.group(2)
+        hint = _HINT_COLUMN.search(failure.hint or "")
+        for ref_qualifier, column in scope.refs:
+            if column.name != name or (qualifier and (ref_qualifier is None or ref_qualifier.name != qualifier)):
+                continue
+            if hint:
+                suggestion = hint.group(2)
+            else:
+                table = scope.aliases.get(ref_qualifier.name) if ref_qualifier is not None else None
+                tables = [table] if table else [t for t in dict.fromkeys(scope.aliases.values()) if t]
+                suggestion = index.closest_column(name, tables)
+            if suggestion:
+                suggestion = quote_ident(suggestion, force=column.kind == "qident")
+                problems.append(Problem("unknown_column", name, start=column.start, end=column.end, suggestion=suggestion))
+    elif failure.kind == "ambiguous_column":
+        match = _AMBIGUOUS_COLUMN.search(failure.message)
+        if not match:
+            return None
+        name = match.group(1)
+        owners = [t for t in dict.fromkeys(scope.aliases.values()) if t in index.columns and name in index.columns[t]]
+        if not owners:
+            return None
+        qualified = f"{quote_ident(alias_for(scope, owners[0]))}.{quote_ident(name)}"
+        problems = [
+            Problem("ambiguous_column", name, start=column.start, end=column.end, suggestion=qualified)
+            for qualifier, column in scope.refs if qualifier is None and column.name == name
+        ]
+    elif failure.kind == "unknown_table":
+        match = _UNKNOWN_TABLE.search(failure.message)
+        if not match:
+            return None
+        name = match.group(1)
+        suggestion = index.closest_table(name)
+        if suggestion:
+            problems = [
+                Problem("unknown_table", name, start=token.start, end=token.end,
+                        suggestion=quote_ident(suggestion, force=token.kind == "qident"))
+                for token, source in scope.sources if source == name
+            ]
+    if not problems:
+        return None
+    fixed = apply_fixes(sql, problems)
+    return fixed if fixed != sql else None
+
+
+def delta_prompt(question, sql, failure, schema_summary):
+    """
+    Short follow-up prompt: only the failing SQL, the error and the tables it touches,
+    instead of re-sending the full generation prompt.
+    """
+    hint = HINTS.get(failure.kind, "")
+    return (
+        f"{schema_summary}\n"
+        f"Request: {question}\n"
+        f"This PostgreSQL query for the request failed:\n{sql}\n"
+        f"Error: {failure.message}\n"
+        + (f"Database hint: {failure.hint}\n" if failure.hint else "")
+        + (f"{hint}\n" if hint else "")
+        + "Return only the corrected SQL query, no explanation."
+    )
+
+
+def referenced_tables(sql, index):
+    """
+    Schema tables the query reads from, so a repair prompt only describes those.
+    """
+    _, scope = parse_sql(sql)
+    return [table for table in dict.fromkeys(scope.aliases.values()) if table in index.columns]
+
+
+class RepairStats:
+    """
+    Attempts-per-answer accounting, to show how many LLM round trips local repair saves.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._llm_calls = Counter()  # LLM calls per answer -> number of answers
+        self._stats = {"answers": 0, "succeeded": 0, "llm_calls": 0, "local_repairs": 0, "delta_prompts": 0}
+        self._errors = Counter()
+
+    def record_answer(self, succeeded, llm_calls, local_repairs, delta_prompts, errors=()):
+        with self._lock:
+            self._stats["answers"] += 1
+            self._stats["succeeded"] += bool(succeeded)
+            self._stats["llm_calls"] += llm_calls
+            self._stats["local_repairs"] += local_repairs
+            self._stats["delta_prompts"] += delta_prompts
+            self._llm_calls[llm_calls] += 1
+            self._errors.update(errors)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["llm_calls_per_answer"] = dict(sorted(self._llm_calls.items()))
+            stats["errors_by_kind"] = dict(self._errors)
+        stats["avg_llm_calls_per_answer"] = stats["llm_calls"] / stats["answers"] if stats["answers"] else 0.0
+        # Each local repair replaces one full re-prompt of the old retry loop
+        stats["llm_calls_avoided"] = stats["local_repairs"]
+        return stats
+
+
+repair_stats = RepairStats()
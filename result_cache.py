@@ -0,0 +1,261 @@
+import hashlib
+import json
+import os
+import re
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+import psycopg2
+
+from db_config import target_key
+from db_pool import connection, PoolTimeout
+from sql_runner import QueryResult, fetch_result, SQL_ROW_BUDGET
+
+
+RESULT_CACHE_MAX_BYTES = int(os.getenv("RESULT_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+# Evicted results are written here as Parquet when set (requires pyarrow)
+RESULT_CACHE_SPILL_DIR = os.getenv("RESULT_CACHE_SPILL_DIR", "")
+RESULT_CACHE_SPILL_MAX_BYTES = int(os.getenv("RESULT_CACHE_SPILL_MAX_BYTES", str(2 * 1024 * 1024 * 1024)))
+# How long a data-version token is trusted before pg_stat_user_tables is read again
+RESULT_CACHE_VERSION_TTL = float(os.getenv("RESULT_CACHE_VERSION_TTL", "5"))
+
+# Modification counters only move when rows are written, so they make a cheap data version.
+# They are flushed by backends asynchronously, hence the short RESULT_CACHE_VERSION_TTL on top.
+DATA_VERSION_SQL = """
+    SELECT coalesce(sum(n_tup_ins + n_tup_upd + n_tup_del), 0), count(*)
+    FROM pg_stat_user_tables
+"""
+
+_SQL_PARTS = re.compile(r"('(?:[^']|'')*'|\"(?:[^\"]|\"\")*\")|\s+")
+
+
+def normalize_sql(sql):
+    """
+    Collapses whitespace outside quoted literals and drops trailing semicolons.
+    """
+    def replace(match):
+        return match.group(1) if match.group(1) else " "
+    return _SQL_PARTS.sub(replace, sql).strip().rstrip(";").strip()
+
+
+def _estimate_bytes(result, sample=100):
+    size = 0
+    rows = result.row_count
+    for array in result.arrays:
+        head = array[:sample]
+        if head:
+            size += sum(sys.getsizeof(v) for v in head) * rows // len(head)
+        size += 8 * rows  # list slot
+    return size + 256
+
+
+_versions = {}
+_bumps = {}
+_versions_lock = threading.Lock()
+
+
+def bump(db_params=None):
+    """
+    Explicitly invalidates every cached result for the target, e.g. after a data load.
+    """
+    key = target_key(db_params)
+    with _versions_lock:
+        _bumps[key] = _bumps.get(key, 0) + 1
+        _versions.pop(key, None)
+
+
+def _known_version(key):
+    cached = _versions.get(key)
+    if cached is not None and time.time() - cached[1] < RESULT_CACHE_VERSION_TTL:
+        return cached[0]
+    return None
+
+
+def _remember_version(key, modifications, tables):
+    token = f"{modifications}:{tables}"
+    with _versions_lock:
+        _versions[key] = (token, time.time())
+    return token
+
+
+def _versioned(key, token):
+    return f"{token}:{_bumps.get(key, 0)}"
+
+
+def data_version(db_params=None):
+    key = target_key(db_params)
+    token = _known_version(key)
+    if token is None:
+        try:
+            with connection(db_params) as conn:
+                cursor = conn.cursor()
+                cursor.execute(DATA_VERSION_SQL)
+                token = _remember_version(key, *cursor.fetchone())
+                cursor.close()
+        except (psycopg2.Error, PoolTimeout) as e:
+            print("Result cache: could not read data version:", e)
+            return None
+    return _versioned(key, token)
+
+
+class ResultCache:
+    """
+    Memory-bounded LRU of QueryResults. With a spill directory, evicted results are kept
+    on disk as Parquet and promoted back into memory on the next hit.
+    """
+
+    def __init__(self, max_bytes=RESULT_CACHE_MAX_BYTES, spill_dir=RESULT_CACHE_SPILL_DIR,
+                 spill_max_bytes=RESULT_CACHE_SPILL_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.spill_dir = spill_dir or None
+        self.spill_max_bytes = spill_max_bytes
+        self._entries = OrderedDict()  # key -> (result, size)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "disk_hits": 0, "misses": 0, "evictions": 0, "spills": 0}
+        if self.spill_dir:
+            os.makedirs(self.spill_dir, exist_ok=True)
+
+    @staticmethod
+    def make_key(sql, db_params, version, row_budget):
+        raw = f"{target_key(db_params)}\0{version}\0{row_budget}\0{normalize_sql(sql)}"
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self._stats["hits"] += 1
+                return entry[0]
+        result = self._load_spilled(key)
+        with self._lock:
+            if result is None:
+                self._stats["misses"] += 1
+                return None
+            self._stats["disk_hits"] += 1
+        self.put(key, result)
+        return result
+
+    def put(self, key, result):
+        size = _estimate_bytes(result)
+        if size > self.max_bytes:
+            self._spill(key, result)
+            return
+        evicted = []
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old[1]
+            self._entries[key] = (result, size)
+            self._bytes += size
+            while self._bytes > self.max_bytes and self._entries:
+                old_key, (old_result, old_size) = self._entries.popitem(last=False)
+                self._bytes -= old_size
+                self._stats["evictions"] += 1
+                evicted.append((old_key, old_result))
+        for old_key, old_result in evicted:
+            self._spill(old_key, old_result)
+
+    def _spill_paths(self, key):
+        base = os.path.join(self.spill_dir, key)
+        return base + ".parquet", base + ".json"
+
+    def _spill(self, key, result):
+        if not self.spill_dir:
+            return
+        data_path, meta_path = self._spill_paths(key)
+        try:
+            frame = result.to_frame().copy()
+            # Parquet needs unique string column names; the real ones live in the sidecar
+            frame.columns = [f"c{i}" for i in range(len(frame.columns))]
+            frame.to_parquet(data_path, compression="zstd", index=False)
+        except Exception as e:
+            # pyarrow missing or a column type Parquet cannot store; the result is simply dropped
+            print("Result cache: spill skipped:", e)
+            return
+        with open(meta_path, "w") as f:
+            json.dump({"columns": result.columns, "total_rows": result.total_rows, "truncated": result.truncated,
+                       "admission": result.admission}, f)
+        with self._lock:
+            self._stats["spills"] += 1
+        self._prune_spill_dir()
+
+    def _load_spilled(self, key):
+        if not self.spill_dir:
+            return None
+        data_path, meta_path = self._spill_paths(key)
+        if not (os.path.exists(data_path) and os.path.exists(meta_path)):
+            return None
+        try:
+            import pandas as pd
+            frame = pd.read_parquet(data_path)
+            with open(meta_path) as f:
+                meta = json.load(f)
+        except Exception as e:
+            print("Result cache: could not read spilled result:", e)
+            return None
+        os.utime(data_path)
+        arrays = [frame[c].tolist() for c in frame.columns]
+        return QueryResult(meta["columns"], arrays, meta["total_rows"], meta["truncated"], meta.get("admission"))
+
+    def _prune_spill_dir(self):
+        files = []
+        for name in os.listdir(self.spill_dir):
+            if name.endswith(".parquet"):
+                path = os.path.join(self.spill_dir, name)
+                stat = os.stat(path)
+                files.append((stat.st_mtime, stat.st_size, path))
+        total = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total <= self.spill_max_bytes:
+                break
+            for victim in (path, path[:-len(".parquet")] + ".json"):
+                try:
+                    os.remove(victim)
+                except OSError:
+                    pass
+            total -= size
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats.update({"entries": len(self._entries), "bytes": self._bytes, "max_bytes": self.max_bytes})
+        return stats
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_result_cache():
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = ResultCache()
+    return _cache
+
+
+def cached_fetch_result(sql, db_params=None, row_budget=SQL_ROW_BUDGET, fetch=fetch_result):
+    """
+    `fetch` (fetch_result by default) that answers repeats of the same SQL from the cache
+    while the data is unchanged.
+    """
+    version = data_version(db_params)
+    if version is None:
+        return fetch(sql, db_params, row_budget)
+    cache = get_result_cache()
+    key = cache.make_key(sql, db_params, version, row_budget)
+    result = cache.get(key)
+    if result is None:
+        result = fetch(sql, db_params, row_budget)
+        cache.put(key, result)
+    return result
@@ -0,0 +1,159 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+from chart_recommender import profile_columns
+
+
+# Rough prompt budget for the digest (about 4 characters per token)
+DIGEST_MAX_TOKENS = int(os.getenv("DIGEST_MAX_TOKENS", "600"))
+DIGEST_TOP_K = int(os.getenv("DIGEST_TOP_K", "5"))
+DIGEST_SAMPLE_ROWS = int(os.getenv("DIGEST_SAMPLE_ROWS", "5"))
+# Results up to this many rows are listed in full, so "top 20" style answers can name every row
+DIGEST_ALL_ROWS = int(os.getenv("DIGEST_ALL_ROWS", "30"))
+
+
+def _fmt(value):
+    if isinstance(value, (float, np.floating)):
+        if not np.isfinite(value):
+            return str(value)
+        return f"{value:,.2f}" if abs(value) < 1e15 else f"{value:.3e}"
+    if isinstance(value, (int, np.integer)):
+        return f"{value:,}"
+    if isinstance(value, pd.Timestamp):
+        return value.date().isoformat() if value == value.normalize() else value.isoformat()
+    return str(value)
+
+
+def _numeric(frame, position):
+    return pd.to_numeric(frame.iloc[:, position], errors="coerce")
+
+
+def _temporal(frame, position):
+    return pd.to_datetime(frame.iloc[:, position], errors="coerce")
+
+
+def _column_lines(frame, profile):
+    lines = []
+    for position, column in enumerate(profile.itertuples(index=False)):
+        values = frame.iloc[:, position]
+        nulls = int(values.isna().sum())
+        null_text = f", {nulls:,} null" if nulls else ""
+        if column.kind == "numeric":
+            numbers = _numeric(frame, position)
+            lines.append(
+                f"- {column.name} (numeric{null_text}): min {_fmt(numbers.min())}, max {_fmt(numbers.max())}, "
+                f"mean {_fmt(numbers.mean())}, median {_fmt(numbers.median())}, sum {_fmt(numbers.sum())}"
+            )
+        elif column.kind == "temporal":
+            dates = _temporal(frame, position)
+            lines.append(f"- {column.name} (date{null_text}): {_fmt(dates.min())} to {_fmt(dates.max())}, "
+                         f"{int(column.distinct):,} distinct")
+        else:
+            counts = values.astype(str).value_counts().head(DIGEST_TOP_K)
+            top = ", ".join(f"{value} ({count:,})" for value, count in counts.items())
+            lines.append(f"- {column.name} (text{null_text}): {int(column.distinct):,} distinct; most frequent: {top}")
+    return lines
+
+
+def _measure_position(profile):
+    numeric = profile[(profile["kind"] == "numeric") & ~profile["id_like"] & ~profile["time_name"]]
+    return int(numeric.index[-1]) if len(numeric) else None
+
+
+def _group_lines(frame, profile, measure):
+    lines = []
+    measure_name = profile["name"].iloc[measure]
+    numbers = _numeric(frame, measure)
+    total = numbers.sum()
+    for position in profile.index[(profile["kind"] == "category") & (profile["distinct"] > 1)]:
+        sums = numbers.groupby(frame.iloc[:, position].astype(str)).sum().sort_values(ascending=False)
+        top = sums.head(DIGEST_TOP_K)
+        share = f" ({top.sum() / total:.0%} of total)" if total else ""
+        listed = ", ".join(f"{key}: {_fmt(value)}" for key, value in top.items())
+        lines.append(f"- Top {len(top)} {profile['name'].iloc[position]} by total {measure_name}{share}: {listed}")
+    return lines
+
+
+def _trend_lines(frame, profile, measure):
+    lines = []
+    measure_name = profile["name"].iloc[measure]
+    for position in profile.index[profile["kind"] == "temporal"]:
+        series = pd.DataFrame({"t": _temporal(frame, position), "v": _numeric(frame, measure)}).dropna()
+        if series["t"].nunique() < 3:
+            continue
+        by_time = series.groupby("t")["v"].sum().sort_index()
+        first, last = by_time.iloc[0], by_time.iloc[-1]
+        change = f" ({(last - first) / abs(first):+.0%})" if first else ""
+        slope = np.polyfit(np.arange(len(by_time)), by_time.to_numpy(dtype=float), 1)[0]
+        direction = "rising" if slope > 0 else "falling" if slope < 0 else "flat"
+        lines.append(
+            f"- {measure_name} over {profile['name'].iloc[position]}: {direction} overall, "
+            f"{_fmt(first)} at {_fmt(by_time.index[0])} to {_fmt(last)} at {_fmt(by_time.index[-1])}{change}; "
+            f"peak {_fmt(by_time.max())} at {_fmt(by_time.idxmax())}"
+        )
+    return lines
+
+
+def _rows_markdown(rows):
+    try:
+        return rows.to_markdown(index=False)
+    except ImportError:  # tabulate is optional
+        return rows.to_string(index=False)
+
+
+def digest_frame(df, total_rows=None, truncated=False, max_tokens=DIGEST_MAX_TOKENS):
+    """
+    Compact, token-budgeted description of a whole result for the LLM: row count, per-column
+    statistics, every row of a small result (up to DIGEST_ALL_ROWS), time trends, top groups,
+    and for larger results extremes and a few representative rows. Sections are added in
+    priority order until the budget is spent.
+    """
+    budget = max_tokens * 4
+    rows = len(df)
+    if not rows:
+        return "The query returned no rows."
+    frame = df.reset_index(drop=True)
+    profile = profile_columns(frame)
+    frame.columns = range(frame.shape[1])
+
+    header = f"Rows: {rows:,}"
+    if truncated and total_rows:
+        header += f" (the query matched {total_rows:,} rows; statistics cover the first {rows:,})"
+    sections = [[header], ["Columns:"] + _column_lines(frame, profile)]
+    all_rows = None
+    if rows <= DIGEST_ALL_ROWS:
+        all_rows = ["All rows:", _rows_markdown(df)]
+        sections.append(all_rows)
+
+    measure = _measure_position(profile)
+    if measure is not None:
+        sections.append(_trend_lines(frame, profile, measure))
+        sections.append(_group_lines(frame, profile, measure))
+        numbers = _numeric(frame, measure)
+        if numbers.notna().any() and all_rows is None:
+            extremes = df.iloc[[int(numbers.idxmax()), int(numbers.idxmin())]]
+            sections.append([f"Rows with the highest and lowest {profile['name'].iloc[measure]}:",
+                             _rows_markdown(extremes)])
+
+    # Also the fallback when the full listing does not fit the budget
+    sample = None
+    if rows > DIGEST_SAMPLE_ROWS:
+        positions = np.linspace(0, rows - 1, DIGEST_SAMPLE_ROWS).astype(int)
+        sample = [f"{DIGEST_SAMPLE_ROWS} representative rows (spread evenly through the result):",
+                  _rows_markdown(df.iloc[positions])]
+        sections.append(sample)
+
+    digest, used = [], 0
+    listed = False
+    for section in sections:
+        text = "\n".join(section)
+        if section is sample and listed:
+            continue
+        if not text or (digest and used + len(text) > budget):
+            continue
+        listed = listed or section is all_rows
+        digest.append(text)
+        used += len(text) + 1
+    return "\n".join(digest)
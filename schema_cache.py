@@ -0,0 +1,170 @@
+import os
+import threading
+import time
+from dataclasses import dataclass, field
+
+import psycopg2
+
+from db_config import UnknownTarget, target_key
+from db_pool import connection, PoolTimeout
+from fetch_schema import fetch_tables_and_columns, fetch_primary_keys, fetch_foreign_keys
+
+
+# Hard upper bound on how stale a cached schema may get if the background refresher is not running
+SCHEMA_CACHE_TTL = float(os.getenv("SCHEMA_CACHE_TTL", "600"))
+# How often the background refresher compares catalog fingerprints
+SCHEMA_REFRESH_INTERVAL = float(os.getenv("SCHEMA_REFRESH_INTERVAL", "30"))
+
+# Any DDL on the public schema rewrites the matching pg_class / pg_attribute / pg_constraint rows,
+# which gives them a new xmin. Hashing oid:xmin pairs is a cheap change signal that only reads
+# catalog rows already in shared buffers.
+FINGERPRINT_SQL = """
+    SELECT md5(
+        coalesce((
+            SELECT string_agg(c.oid::text || ':' || c.xmin::text, ',' ORDER BY c.oid)
+            FROM pg_class c
+            JOIN pg_namespace n ON n.oid = c.relnamespace
+            WHERE n.nspname = 'public'
+        ), '')
+        || '|' ||
+        coalesce((
+            SELECT string_agg(a.attrelid::text || '.' || a.attnum::text || ':' || a.xmin::text, ','
+                              ORDER BY a.attrelid, a.attnum)
+            FROM pg_attribute a
+            JOIN pg_class c ON c.oid = a.attrelid
+            JOIN pg_namespace n ON n.oid = c.relnamespace
+            WHERE n.nspname = 'public' AND a.attnum > 0
+        ), '')
+        || '|' ||
+        coalesce((
+            SELECT string_agg(con.oid::text || ':' || con.xmin::text, ',' ORDER BY con.oid)
+            FROM pg_constraint con
+            JOIN pg_namespace n ON n.oid = con.connamespace
+            WHERE n.nspname = 'public'
+        ), '')
+    )
+"""
+
+
+@dataclass
+class SchemaEntry:
+    tables: list
+    columns: dict
+    primary_keys: dict
+    foreign_keys: dict
+    fingerprint: str
+    loaded_at: float = field(default_factory=time.time)
+    checked_at: float = field(default_factory=time.time)
+
+    def as_tuple(self):
+        return self.tables, self.columns, self.primary_keys, self.foreign_keys
+
+
+_entries = {}
+_params = {}
+_key_locks = {}
+_lock = threading.Lock()
+_refresher = None
+
+
+def fetch_fingerprint(conn):
+    cursor = conn.cursor()
+    cursor.execute(FINGERPRINT_SQL)
+    fingerprint = cursor.fetchone()[0]
+    cursor.close()
+    return fingerprint
+
+
+def _key_lock(key):
+    with _lock:
+        return _key_locks.setdefault(key, threading.Lock())
+
+
+def _refresh(key, db_params, current=None):
+    """
+    Compares the catalog fingerprint with the cached one and reloads the schema only if it changed.
+    Returns the up-to-date entry, or the current one if the database cannot be reached.
+    """
+    try:
+        with connection(db_params) as conn:
+            fingerprint = fetch_fingerprint(conn)
+            if current is not None and current.fingerprint == fingerprint:
+                current.checked_at = time.time()
+                return current
+            all_tables, all_columns = fetch_tables_and_columns(conn)
+            entry = SchemaEntry(
+                tables=all_tables,
+                columns=all_columns,
+                primary_keys=fetch_primary_keys(conn),
+                foreign_keys=fetch_foreign_keys(conn),
+                fingerprint=fingerprint
+            )
+    except (psycopg2.Error, PoolTimeout, UnknownTarget) as e:
+        print("Schema cache: failed to read catalog:", e)
+        return current
+    with _lock:
+        _entries[key] = entry
+        _params[key] = db_params
+    return entry
+
+
+def get_schema_entry(db_params=None):
+    """
+    Returns the cached SchemaEntry for the connection target, or None if it cannot be loaded.
+    Only the first request for a target (or one arriving after SCHEMA_CACHE_TTL without a
+    background refresh) reads the catalog; every other request is served from memory.
+    """
+    # db_params is kept as given, so a registered target's password stays in db_config
+    key = target_key(db_params)
+    entry = _entries.get(key)
+    if entry is not None and time.time() - entry.checked_at < SCHEMA_CACHE_TTL:
+        return entry
+    with _key_lock(key):
+        # Another thread may have loaded it while we waited for the lock
+        entry = _entries.get(key)
+        if entry is None or time.time() - entry.checked_at >= SCHEMA_CACHE_TTL:
+            entry = _refresh(key, db_params, entry)
+    start_background_refresh()
+    return entry
+
+
+def get_schema(db_params=None):
+    """
+    Cached drop-in replacement for fetch_schema_from_db.
+    """
+    entry = get_schema_entry(db_params)
+    if entry is None:
+        return None, None, None, None
+    return entry.as_tuple()
+
+
+def invalidate(db_params=None):
+    key = target_key(db_params)
+    with _lock:
+        _entries.pop(key, None)
+        _params.pop(key, None)
+
+
+def _refresh_loop(interval):
+    while True:
+        time.sleep(interval)
+        with _lock:
+            targets = [(key, _params[key], entry) for key, entry in _entries.items()]
+        for key, db_params, entry in targets:
+            with _key_lock(key):
+                _refresh(key, db_params, entry)
+
+
+def start_background_refresh(interval=None):
+    """
+    Starts (once per process) the daemon thread that keeps every cached schema warm.
+    """
+    global _refresher
+    if _refresher is not None:
+        return
+    with _lock:
+        if _refresher is not None:
+            return
+        interval = SCHEMA_REFRESH_INTERVAL if interval is None else interval
+        _refresher = threading.Thread(target=_refresh_loop, args=(interval,), daemon=True, name="schema-cache-refresh")
+        _refresher.start()
@@ -0,0 +1,208 @@
+import math
+import os
+import re
+import threading
+from collections import Counter, OrderedDict, deque
+
+
+# Number of tables picked by relevance before join-path tables are added
+SCHEMA_TOP_K = int(os.getenv("SCHEMA_TOP_K", "8"))
+# Schemas with at most this many tables are sent in full; pruning only pays off on large ones
+SCHEMA_PRUNE_MIN_TABLES = int(os.getenv("SCHEMA_PRUNE_MIN_TABLES", "20"))
+
+# Business words that rarely appear verbatim in table or column names
+SYNONYMS = {
+    "sale": {"order", "price", "quantity", "amount", "total", "revenue"},
+    "revenue": {"order", "price", "quantity", "amount", "total"},
+    "sold": {"order", "quantity", "product"},
+    "bought": {"order", "quantity", "product"},
+    "client": {"customer"},
+    "buyer": {"customer"},
+    "staff": {"employee"},
+    "item": {"product"},
+    "vendor": {"supplier"},
+    "shipping": {"ship", "shipper", "freight"},
+    "spend": {"price", "amount", "total"},
+}
+
+
+def words(text):
+    """
+    Splits identifiers and questions alike: snake_case, camelCase and punctuation.
+    """
+    text = re.sub(r"([a-z0-9])([A-Z])", r"\1 \2", text)
+    result = []
+    for word in re.findall(r"[a-z0-9]+", text.lower()):
+        if len(word) > 3 and word.endswith("ies"):
+            word = word[:-3] + "y"
+        elif len(word) > 3 and word.endswith("s") and not word.endswith("ss"):
+            word = word[:-1]
+        result.append(word)
+    return result
+
+
+def estimate_tokens(text):
+    # Roughly four characters per token for English and identifiers
+    return (len(text) + 3) // 4
+
+
+class SchemaIndex:
+    """
+    Searchable view of one schema version: weighted tokens per table, an inverted index,
+    and the undirected foreign-key graph used to add join paths between picked tables.
+    """
+
+    def __init__(self, entry):
+        self.fingerprint = entry.fingerprint
+        self.tables = list(entry.tables)
+        self.columns = entry.columns
+        self.foreign_keys = entry.foreign_keys or {}
+        self.postings = {}
+        self.graph = {table: set() for table in self.tables}
+        self.joins = {}
+        self._stats = {"questions": 0, "pruned": 0, "tokens_full": 0, "tokens_sent": 0}
+        self._lock = threading.Lock()
+
+        for table in self.tables:
+            weights = Counter()
+            for word in words(table):
+                weights[word] += 3
+            for column in self.columns.get(table, []):
+                for word in words(column):
+                    weights[word] += 1
+            for word, weight in weights.items():
+                self.postings.setdefault(word, {})[table] = weight
+        count = max(len(self.tables), 1)
+        self.idf = {word: math.log(1 + count / len(tables)) for word, tables in self.postings.items()}
+
+        for table, fks in self.foreign_keys.items():
+            for fk in fks:
+                other = fk["references_table"]
+                if other == table or other not in self.graph or table not in self.graph:
+                    continue
+                self.graph[table].add(other)
+                self.graph[other].add(table)
+                condition = f"{table}.{fk['column']} = {other}.{fk['references_column']}"
+                self.joins.setdefault(frozenset((table, other)), []).append(condition)
+
+        self.full_summary = self.summary(self.tables)
+        self.full_tokens = estimate_tokens(self.full_summary)
+
+    def rank(self, question):
+        query = Counter()
+        for word in words(question):
+            query[word] += 1
+            for synonym in SYNONYMS.get(word, ()):
+                query[synonym] += 0.5
+        scores = Counter()
+        for word, weight in query.items():
+            for table, table_weight in self.postings.get(word, {}).items():
+                scores[table] += weight * table_weight * self.idf[word]
+        # A table next to a strongly matching one is a likely join partner
+        boosted = Counter(scores)
+        for table, score in scores.items():
+            for neighbour in self.graph[table]:
+                boosted[neighbour] += 0.25 * score
+        return boosted.most_common()
+
+    def join_path(self, start, goal):
+        previous = {start: None}
+        queue = deque([start])
+        while queue:
+            table = queue.popleft()
+            if table == goal:
+                path = []
+                while table is not None:
+                    path.append(table)
+                    table = previous[table]
+                return path[::-1]
+            for neighbour in self.graph[table]:
+                if neighbour not in previous:
+                    previous[neighbour] = table
+                    queue.append(neighbour)
+        return None
+
+    def select(self, question, top_k=SCHEMA_TOP_K):
+        ranked = [table for table, score in self.rank(question) if score > 0][:top_k]
+        if not ranked:
+            return list(self.tables)
+        selected = list(ranked)
+        anchor = ranked[0]
+        for table in ranked[1:]:
+            for hop in self.join_path(anchor, table) or []:
+                if hop not in selected:
+                    selected.append(hop)
+        return [table for table in self.tables if table in selected]
+
+    def summary(self, tables):
+        summary = "Database schema:\n"
+        summary += "Tables:\n"
+        for table in tables:
+            summary += f"  - {table}\n"
+        summary += "Columns per table:\n"
+        for table in tables:
+            summary += f"  {table}: {self.columns.get(table, [])}\n"
+        picked = set(tables)
+        conditions = [
+            condition
+            for pair, pair_conditions in self.joins.items() if pair <= picked
+            for condition in pair_conditions
+        ]
+        if conditions:
+            summary += "Foreign keys (join conditions):\n"
+            for condition in sorted(conditions):
+                summary += f"  {condition}\n"
+        return summary
+
+    def prompt_schema(self, question, top_k=SCHEMA_TOP_K, min_tables=SCHEMA_PRUNE_MIN_TABLES):
+        """
+        Returns (schema summary for the prompt, stats) where stats reports the estimated
+        prompt tokens saved compared to sending the whole schema.
+        """
+        if len(self.tables) <= min_tables:
+            tables = self.tables
+            summary = self.full_summary
+        else:
+            tables = self.select(question, top_k)
+            summary = self.summary(tables)
+        sent = estimate_tokens(summary)
+        with self._lock:
+            self._stats["questions"] += 1
+            self._stats["pruned"] += len(tables) < len(self.tables)
+            self._stats["tokens_full"] += self.full_tokens
+            self._stats["tokens_sent"] += sent
+        return summary, {
+            "tables": len(tables),
+            "tables_total": len(self.tables),
+            "tokens_full": self.full_tokens,
+            "tokens_sent": sent,
+            "tokens_saved": self.full_tokens - sent,
+        }
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        stats["tokens_saved"] = stats["tokens_full"] - stats["tokens_sent"]
+        return stats
+
+
+_indexes = OrderedDict()
+_indexes_lock = threading.Lock()
+_MAX_INDEXES = 32
+
+
+def get_schema_index(entry):
+    """
+    Returns the SchemaIndex for a schema cache entry, built once per schema fingerprint.
+    """
+    with _indexes_lock:
+        index = _indexes.get(entry.fingerprint)
+        if index is not None:
+            _indexes.move_to_end(entry.fingerprint)
+            return index
+    index = SchemaIndex(entry)
+    with _indexes_lock:
+        _indexes[entry.fingerprint] = index
+        while len(_indexes) > _MAX_INDEXES:
+            _indexes.popitem(last=False)
+    return index
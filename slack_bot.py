@@ -1,43 +1,114 @@
 import os
+import asyncio
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, Request
 from dotenv import load_dotenv
-from god_eye_core import generate_sql_and_results
-import slack
-from analyse_data import analyse_and_format  
-import time
-from fastapi.responses import JSONResponse
-from threading import Thread
-from chart_agent import wants_chart, run_chart_agent
-import matplotlib.pyplot as plt
-import tempfile
-import time
+from async_core import agenerate_sql_and_results, astream_analysis, athrottled_text, arun_chart_agent
+from slack_sdk.web.async_client import AsyncWebClient
+from fastapi.responses import JSONResponse, PlainTextResponse
+from chart_agent import wants_chart
+import async_db
+import db_pool
+from job_queue import JobScheduler
+from cost_guard import describe_admission
+from answer_pipeline import (
+    Stage, run_stages, ANALYSIS_TIMEOUT, CHART_SPEC_TIMEOUT, CHART_DATA_TIMEOUT, CHART_RENDER_TIMEOUT, CHART_UPLOAD_TIMEOUT,
+    EXPORT_TIMEOUT
+)
+from nl_cache import get_nl_cache
+from result_cache import get_result_cache
+from repair import repair_stats
+from llm_gateway import get_llm_gateway
+from telemetry import trace, span, metrics_text
+from chart_renderer import get_chart_renderer
+from warmup import start_prewarm, cancel_task
+from dedup import afirst_seen, get_dedup_store
+from export import export_result, wants_export, ExportTooLarge, ExportRejected, EXPORT_MAX_BYTES
 
 
 load_dotenv()
 SLACK_BOT_TOKEN = os.getenv("SLACK_TOKEN")
 SLACK_SIGNING_SECRET = os.getenv("SLACK_SIGNING_SECRET")
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
+# Slack accepts uploads up to 1 GB
+SLACK_MAX_UPLOAD_BYTES = min(EXPORT_MAX_BYTES, 1024 * 1024 * 1024)
 
-client = slack.WebClient(token=SLACK_BOT_TOKEN)
-app = FastAPI()
+client = AsyncWebClient(token=SLACK_BOT_TOKEN)
 # ...existing code...
 
 # Set this in your .env or fetch at startup
 BOT_USER_ID = os.getenv("BOT_USER_ID") # Set this in your .env or fetch at startup
 
+# Bounded worker pool that produces the answers, with load shedding when it is full
+scheduler = JobScheduler()
+BUSY_MESSAGE = ":hourglass_flowing_sand: I'm busy answering other questions right now. Please try again in a minute."
 
-bot_info = client.auth_test()
-print("Bot user ID:", bot_info["user_id"])
 
+async def resolve_bot_user_id():
+    global BOT_USER_ID
+    try:
+        bot_info = await client.auth_test()
+    except Exception as e:
+        print("Could not resolve the bot user ID:", repr(e))
+        return
+    print("Bot user ID:", bot_info["user_id"])
+    BOT_USER_ID = BOT_USER_ID or bot_info["user_id"]
 
-# Temporary in-memory store (use Redis or similar in production)
-recent_event_ids = {}
 
-def cleanup_old_event_ids(ttl=60):
-    now = time.time()
-    for eid in list(recent_event_ids):
-        if now - recent_event_ids[eid] > ttl:
-            del recent_event_ids[eid]
+@asynccontextmanager
+async def lifespan(app):
+    # Nothing above this runs at import; pools, clients and heavy modules warm up here
+    background = [start_prewarm()]
+    if not BOT_USER_ID:
+        # Messages from the bot also carry bot_id, so answering can start before this returns
+        background.append(asyncio.create_task(resolve_bot_user_id()))
+    await scheduler.start()
+    yield
+    for task in background:
+        await cancel_task(task)
+    await scheduler.stop()
+    await async_db.close_async_pools()
+    db_pool.close_all()
+    get_chart_renderer().close()
+
+
+app = FastAPI(lifespan=lifespan)
+
+
+@app.get("/stats/db")
+def db_stats():
+    return db_pool.pool_stats()
+
+
+@app.get("/stats/queue")
+def queue_stats():
+    return scheduler.stats()
+
+
+@app.get("/stats/cache")
+def cache_stats():
+    return {
+        "nl_sql": get_nl_cache().stats(),
+        "results": get_result_cache().stats(),
+        "charts": get_chart_renderer().stats(),
+        "dedup": get_dedup_store().stats(),
+    }
+
+
+@app.get("/metrics")
+def metrics():
+    return PlainTextResponse(metrics_text(), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/stats/answers")
+def answer_stats():
+    return repair_stats.stats()
+
+
+@app.get("/stats/llm")
+def llm_stats():
+    return get_llm_gateway().stats()
+
 
 @app.post("/slack/events")
 async def slack_events(request: Request):
@@ -50,29 +121,95 @@ async def slack_events(request: Request):
     event = data.get("event", {})
     event_id = data.get("event_id")
 
-    # Deduplicate event
-    if event_id in recent_event_ids:
+    # Slack retries unacknowledged deliveries, possibly to another worker (DEDUP_BACKEND)
+    if not await afirst_seen("slack", event_id):
         print(f"Ignoring duplicate event: {event_id}")
         return {"ok": True}
 
-    recent_event_ids[event_id] = time.time()
-    cleanup_old_event_ids()
+    if not is_user_message(event):
+        return {"ok": True}
 
-    # Acknowledge first to avoid Slack retries
-    Thread(target=handle_message_event, args=(event,)).start()
+    # Acknowledge first to avoid Slack retries; the answer is produced by the scheduler's workers
+    accepted = scheduler.submit(lambda: handle_message_event(event), channel=event.get("channel"), user=event.get("user"))
+    if not accepted:
+        print(f"Queue full, shedding event: {event_id}")
+        await client.chat_postMessage(channel=event["channel"], text=BUSY_MESSAGE)
     return JSONResponse(content={"ok": True}, status_code=200)
 
-def handle_message_event(event):
-    if event.get("type") == "message" and "subtype" not in event:
-        if event.get("user") == BOT_USER_ID or event.get("bot_id"):
-            print("Ignoring message from bot itself")
-            return
 
+def is_user_message(event):
+    if event.get("type") != "message" or "subtype" in event:
+        return False
+    if event.get("user") == BOT_USER_ID or event.get("bot_id"):
+        print("Ignoring message from bot itself")
+        return False
+    return bool(event.get("channel"))
+
+
+ANALYSIS_PLACEHOLDER = "_Analysing the results…_"
+ANALYSIS_UNAVAILABLE = "_The analysis is not available right now; the results and SQL are below._"
+ANSWER_FAILED = "Something went wrong while answering your request. Please try again with a different question."
+
+
+def answer_blocks(analysis, result_text, sql_query, admission=None):
+    blocks = [
+        {
+            "type": "section",
+            "text": {
+                "type": "mrkdwn",
+                "text": f"*Analysis:*\n{analysis}"
+            }
+        },
+        {
+            "type": "section",
+            "text": {
+                "type": "mrkdwn",
+                "text": f"\n```{result_text}```"
+            }
+        },
+        {
+            "type": "section",
+            "text": {
+                "type": "mrkdwn",
+                "text": "*SQL QUERY:*\n```{}```".format(sql_query)
+            }
+        },
+    ]
+    if admission:
+        blocks.append({
+            "type": "context",
+            "elements": [{"type": "mrkdwn", "text": describe_admission(admission)}]
+        })
+    return blocks
+
+
+async def fetch_chart_rows(query):
+    return await async_db.cached_fetch_result(query, fetch=async_db.guarded_fetch_result)
+
+
+async def traced_post(request):
+    with span("post"):
+        return await request
+
+
+async def handle_message_event(event):
+    with trace("answer") as answer_trace:
+        await answer_message_event(event)
+    print(f"Answer took {answer_trace.total_seconds():.2f}s:", answer_trace.rows())
+
+
+async def answer_message_event(event):
+    if is_user_message(event):
         channel = event["channel"]
         user_text = event.get("text", "")
 
         if user_text:
-            sql_query, results, error = generate_sql_and_results(user_text, OPENAI_API_KEY)
+            try:
+                sql_query, results, error = await agenerate_sql_and_results(user_text, OPENAI_API_KEY)
+            except Exception as e:
+                # LLMTimeout and anything else the gateway or database raised still gets a reply
+                print("Answer failed:", repr(e))
+                sql_query, results, error = None, None, ANSWER_FAILED
             blocks = [
 
             ]
@@ -85,64 +222,98 @@ def handle_message_event(event):
                     }
                 })
             elif results is not None:
-                df, analysis = analyse_and_format(user_text, sql_query, results, OPENAI_API_KEY)
-                result_text = df.head(20).to_markdown(index=False) if df is not None else str(results)
-
-                if df is not None and wants_chart(user_text):
-                    chart_info = run_chart_agent(user_text, df, OPENAI_API_KEY)
-                    chart_type = chart_info.get("chart_type", "bar")
-                    x = chart_info.get("x")
-                    y = chart_info.get("y")
-                    
-                    plt.figure()
-                    if chart_type == "bar":
-                        df.plot.bar(x=x, y=y)
-                    elif chart_type == "line":
-                        df.plot.line(x=x, y=y)
-                    elif chart_type == "pie":
-                        df.set_index(x)[y].plot.pie(autopct='%1.1f%%')
-                    elif chart_type == "scatter":
-                        df.plot.scatter(x=x, y=y)
-                    elif chart_type == "histogram":
-                        df[y].plot.hist()
-                    else:
-                        df.plot.bar(x=x, y=y)
-
-                    plt.title(f"{chart_type.title()} Chart of {y} vs {x}")
-                    with tempfile.NamedTemporaryFile(suffix=".png", delete=False) as tmpfile:
-                        plt.savefig(tmpfile.name)
-                        plt.close()
-                        client.files_upload_v2(
+                df = results.to_frame()
+                result_text = df.head(20).to_markdown(index=False)
+                export_format = wants_export(user_text)
+                if results.total_rows > 20:
+                    result_text += f"\n\n(first 20 of {results.total_rows} rows"
+                    result_text += "; the full result is attached below)" if export_format else "; ask to export it for every row)"
+
+                # The answer is posted right away and the analysis streamed into it, while the
+                # chart branch (an independent LLM round trip) runs alongside
+                posted = await traced_post(client.chat_postMessage(
+                    channel=channel,
+                    blocks=answer_blocks(ANALYSIS_PLACEHOLDER, result_text, sql_query, results.admission),
+                    text="SQL Query and Answer"
+                ))
+                streamed = {"text": ""}
+
+                async def analysis_stage(_):
+                    async for text in athrottled_text(astream_analysis(user_text, sql_query, results, OPENAI_API_KEY)):
+                        streamed["text"] = text
+                        await traced_post(client.chat_update(
                             channel=channel,
-                            file=tmpfile.name,
-                            title="Chart",
-                            initial_comment="\n*Visualization of the data based on your request:*"
-                        )
-                        time.sleep(1)  # Ensure file upload completes before continuing
+                            ts=posted["ts"],
+                            blocks=answer_blocks(text + " …", result_text, sql_query, results.admission),
+                            text="SQL Query and Answer"
+                        ))
+                    return streamed["text"].strip()
 
-                blocks.append({
-                    "type": "section",
-                    "text": {
-                        "type": "mrkdwn",
-                        "text": f"*Analysis:*\n{analysis}"
-                    }
-                })
+                async def chart_spec_stage(_):
+                    return await arun_chart_agent(user_text, df, OPENAI_API_KEY)
 
-                blocks.append({
-                    "type": "section",
-                    "text": {
-                        "type": "mrkdwn",
-                        "text": f"\n```{result_text}```"
-                    }
-                })
-                
-                blocks.append(                {
-                    "type": "section",
-                    "text": {
-                        "type": "mrkdwn",
-                        "text": "*SQL QUERY:*\n```{}```".format(sql_query)
-                    }
-                })
+                async def chart_data_stage(inputs):
+                    from chart_data import achart_data
+                    # Large results are aggregated (in SQL when they were truncated) down to what the chart can show
+                    return await achart_data(results, sql_query, inputs["chart_spec"], fetch_chart_rows)
+
+                async def chart_render_stage(inputs):
+                    chart_df, chart_info = inputs["chart_data"]
+                    return await get_chart_renderer().arender(
+                        chart_df, chart_info.get("chart_type", "bar"), chart_info.get("x"), chart_info.get("y")
+                    )
+
+                async def chart_upload_stage(inputs):
+                    # PNG bytes go straight to Slack; nothing is written to disk
+                    await client.files_upload_v2(
+                        channel=channel,
+                        content=inputs["chart_render"],
+                        filename="chart.png",
+                        title="Chart",
+                        initial_comment="\n*Visualization of the data based on your request:*"
+                    )
+
+                async def export_stage(_):
+                    # COPY streams into a compressed file in a worker thread; Slack reads it from disk
+                    try:
+                        exported = await asyncio.to_thread(export_result, sql_query, None, export_format, SLACK_MAX_UPLOAD_BYTES)
+                    except (ExportTooLarge, ExportRejected) as e:
+                        await traced_post(client.chat_postMessage(channel=channel, text=f":warning: {e}"))
+                        return None
+                    try:
+                        await client.files_upload_v2(
+                            channel=channel,
+                            file=exported.path,
+                            filename=exported.filename,
+                            title="Full result",
+                            initial_comment=f"*Full result:* {exported.describe()}"
+                        )
+                    finally:
+                        exported.remove()
+                    return exported.describe()
+
+                stages = [Stage("analysis", analysis_stage, timeout=ANALYSIS_TIMEOUT)]
+                if export_format and len(df.columns):
+                    stages.append(Stage("export", export_stage, timeout=EXPORT_TIMEOUT))
+                if len(df.columns) and wants_chart(user_text):
+                    stages += [
+                        Stage("chart_spec", chart_spec_stage, timeout=CHART_SPEC_TIMEOUT),
+                        Stage("chart_data", chart_data_stage, ("chart_spec",), CHART_DATA_TIMEOUT),
+                        Stage("chart_render", chart_render_stage, ("chart_data",), CHART_RENDER_TIMEOUT),
+                        Stage("chart_upload", chart_upload_stage, ("chart_render",), CHART_UPLOAD_TIMEOUT),
+                    ]
+                pipeline = await run_stages(stages)
+                analysis = pipeline.value("analysis")
+                if analysis is None:
+                    # Keep whatever part of the analysis made it before the stream failed
+                    analysis = (streamed["text"].strip() + "\n\n" if streamed["text"].strip() else "") + ANALYSIS_UNAVAILABLE
+                await traced_post(client.chat_update(
+                    channel=channel,
+                    ts=posted["ts"],
+                    blocks=answer_blocks(analysis, result_text, sql_query, results.admission),
+                    text="SQL Query and Answer"
+                ))
+                return
             else:
                 blocks.append({
                     "type": "section",
@@ -151,4 +322,4 @@ def handle_message_event(event):
                         "text": "_No results found._"
                     }
                 })
-            client.chat_postMessage(channel=channel, blocks=blocks, text="SQL Query and Answer")
+            await traced_post(client.chat_postMessage(channel=channel, blocks=blocks, text="SQL Query and Answer"))
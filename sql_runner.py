@@ -1,52 +1,113 @@
-import psycopg2
-import re
-from dotenv import load_dotenv
 import os
+import uuid
+from dataclasses import dataclass, field
+from db_pool import connection
 
 
-load_dotenv()
+# Maximum rows pulled into memory for one answer; the true row count is still reported
+SQL_ROW_BUDGET = int(os.getenv("SQL_ROW_BUDGET", "10000"))
+# Rows per network round trip when reading from a server-side cursor
+SQL_ITERSIZE = int(os.getenv("SQL_ITERSIZE", "2000"))
 
-HOST_DB = os.getenv("HOST_DB")
-PASSWORD_DB = os.getenv("PASSWORD_DB")
-USER_DB = os.getenv("USER_DB")
-DB_NAME = os.getenv("DB_NAME")
 
+@dataclass
+class QueryResult:
+    """
+    Column-oriented query result. `arrays[i]` holds every fetched value of `columns[i]`,
+    `total_rows` is the real size of the result even when only `row_budget` rows were fetched.
+    """
+    columns: list
+    arrays: list
+    total_rows: int
+    truncated: bool = False
+    # Cost guard decision for the statement that produced this result, when it was guarded
+    admission: dict = None
+    _frame: object = field(default=None, repr=False, compare=False)
+
+    @property
+    def row_count(self):
+        return len(self.arrays[0]) if self.arrays else 0
+
+    def __len__(self):
+        return self.row_count
+
+    def to_frame(self):
+        if self._frame is None:
+            import pandas as pd
+            # Build from positional arrays so duplicate column names (e.g. two "id") survive
+            df = pd.DataFrame({i: array for i, array in enumerate(self.arrays)})
+            df.columns = self.columns
+            self._frame = df
+        return self._frame
+
+    def iter_records(self):
+        for values in zip(*self.arrays):
+            yield dict(zip(self.columns, values))
+
+    def records(self, limit=None):
+        arrays = self.arrays if limit is None else [array[:limit] for array in self.arrays]
+        return [dict(zip(self.columns, values)) for values in zip(*arrays)]
+
+    def head(self, n):
+        return QueryResult(self.columns, [array[:n] for array in self.arrays], self.total_rows, self.total_rows > n)
 
 
 def check_sql_columns(sql, all_columns):
     # all_columns: dict of {table: [col1, col2, ...]}
-    for table, columns in all_columns.items():
-        # Match both table.column and just column (if table is used in FROM)
-        for match in re.findall(rf"{table}\.([a-zA-Z0-9_]+)", sql):
-            if match not in columns:
-                return table, match
-        for match in re.findall(r"\b([a-zA-Z0-9_]+)\b", sql):
-            if match in columns:
-                continue
+    # Returns the first unknown (table, column); sql_validator.validate_sql reports every problem
+    from sql_validator import IdentifierIndex, validate_sql
+    for problem in validate_sql(sql, IdentifierIndex(all_columns)):
+        if problem.kind == "unknown_column":
+            return problem.table, problem.name
     return None, None
 
-def run_sql_query(sql, db_params=None):
-    if db_params is None:
-        db_params = {
-            "dbname": DB_NAME,
-            "user": USER_DB,
-            "password": PASSWORD_DB,
-            "host": HOST_DB,
-            "port": "5432"
-        }
-    conn = psycopg2.connect(**db_params)
-    cursor = conn.cursor()
-    cursor.execute(sql)
-    try:
-        results = cursor.fetchall()
-        columns = [desc[0] for desc in cursor.description]
-        data = [dict(zip(columns, row)) for row in results]
-    except psycopg2.errors.AmbiguousColumn as e:
-        # Return a clear error message
-        data = []
-        return None, f"Ambiguous column error: {e}. Please qualify column names with their table name."
-    except Exception:
-        data = []
-    cursor.close()
-    conn.close()
-    return data
\ No newline at end of file
+
+def _remaining_rows(conn, cursor_name):
+    # MOVE skips the rest of the cursor on the server and reports how many rows it passed
+    counter = conn.cursor()
+    counter.execute(f'MOVE FORWARD ALL IN "{cursor_name}"')
+    moved = int(counter.statusmessage.split()[-1])
+    counter.close()
+    return moved
+
+
+def fetch_result(sql, db_params=None, row_budget=SQL_ROW_BUDGET, itersize=SQL_ITERSIZE, settings=(),
+                 read_only=False):
+    """
+    Runs `sql` through a server-side cursor and returns a QueryResult holding at most
+    `row_budget` rows (None means no limit), fetched `itersize` rows at a time.
+    `settings` are statements run first in the same transaction (e.g. SET LOCAL ...).
+    `read_only` opens the transaction itself as read-only (BEGIN READ ONLY).
+    """
+    with connection(db_params, read_only=read_only) as conn:
+        if settings:
+            setup = conn.cursor()
+            for statement in settings:
+                setup.execute(statement)
+            setup.close()
+        cursor = conn.cursor(name=f"godeye_{uuid.uuid4().hex[:12]}")
+        cursor.itersize = itersize
+        cursor.execute(sql)
+        columns = None
+        arrays = None
+        fetched = 0
+        while row_budget is None or fetched < row_budget:
+            size = itersize if row_budget is None else min(itersize, row_budget - fetched)
+            batch = cursor.fetchmany(size)
+            if arrays is None:
+                # Named cursors only have a description after the first FETCH
+                columns = [desc[0] for desc in cursor.description]
+                arrays = [[] for _ in columns]
+            if not batch:
+                break
+            for array, values in zip(arrays, zip(*batch)):
+                array.extend(values)
+            fetched += len(batch)
+            if len(batch) < size:
+                break
+        total_rows = fetched
+        if row_budget is not None and fetched >= row_budget:
+            total_rows += _remaining_rows(conn, cursor.name)
+        cursor.close()
+        conn.rollback()
+    return QueryResult(columns, arrays, total_rows, total_rows > fetched)
@@ -0,0 +1,500 @@
+import difflib
+import re
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+
+
+_TOKEN = re.compile(r"""
+    (?P<ws>\s+)
+  | (?P<comment>--[^\n]*|/\*.*?\*/)
+  | (?P<string>(?:[EeBbXxNn])?'(?:[^']|'')*')
+  | (?P<dollar>\$(?P<tag>[A-Za-z_]*)\$.*?\$(?P=tag)\$)
+  | (?P<qident>"(?:[^"]|"")*")
+  | (?P<number>\d+(?:\.\d*)?(?:[eE][+-]?\d+)?|\.\d+)
+  | (?P<param>\$\d+|%\([A-Za-z_]+\)s|%s)
+  | (?P<ident>[A-Za-z_][A-Za-z0-9_$]*)
+  | (?P<op>::|<=|>=|<>|!=|\|\||->>|->|.)
+""", re.S | re.X)
+
+KEYWORDS = {
+    "all", "and", "any", "array", "as", "asc", "between", "both", "by", "case", "cast", "collate",
+    "cross", "current_date", "current_time", "current_timestamp", "current_user", "default", "desc",
+    "distinct", "else", "end", "except", "exists", "false", "fetch", "filter", "first", "following",
+    "for", "from", "full", "group", "having", "ilike", "in", "inner", "intersect", "interval", "into",
+    "is", "isnull", "join", "last", "lateral", "leading", "left", "like", "limit", "localtime",
+    "localtimestamp", "natural", "not", "notnull", "null", "nulls", "offset", "on", "only", "or",
+    "order", "outer", "over", "partition", "preceding", "range", "recursive", "right", "row", "rows",
+    "select", "similar", "some", "symmetric", "table", "then", "ties", "to", "trailing", "true",
+    "unbounded", "union", "unknown", "using", "values", "when", "where", "window", "with", "within",
+    "at", "time", "zone", "escape", "current", "next", "only", "returning", "materialized",
+    # type names
+    "bigint", "bool", "boolean", "char", "character", "date", "decimal", "double", "float", "int",
+    "integer", "json", "jsonb", "money", "numeric", "precision", "real", "serial", "smallint", "text",
+    "timestamp", "timestamptz", "uuid", "varchar", "varying", "without",
+    # date parts used bare inside EXTRACT(... FROM ...)
+    "century", "day", "decade", "dow", "doy", "epoch", "hour", "isodow", "isoyear", "microseconds",
+    "millennium", "milliseconds", "minute", "month", "quarter", "second", "week", "year",
+}
+
+# Keywords after which a table reference starts
+_SOURCE_STARTERS = {"from", "join"}
+# Keywords that end a FROM list
+_CLAUSE_KEYWORDS = {
+    "where", "group", "having", "order", "limit", "offset", "union", "intersect", "except", "window",
+    "fetch", "for", "returning", "on", "using", "select", "values",
+}
+_JOIN_WORDS = {"join", "inner", "left", "right", "full", "outer", "cross", "natural", "lateral"}
+# Functions whose argument syntax uses FROM without naming a table
+_FROM_FUNCTIONS = {"extract", "substring", "trim", "overlay", "position"}
+# Keywords that can end a select expression, so an identifier right after one is an alias
+_EXPRESSION_ENDS = {
+    "end", "null", "true", "false", "current_date", "current_time", "current_timestamp", "current_user",
+    "localtime", "localtimestamp",
+}
+
+
+@dataclass
+class Token:
+    kind: str
+    text: str
+    start: int
+    end: int
+
+    @property
+    def name(self):
+        # Unquoted identifiers are case-folded by Postgres; quoted ones keep their case
+        if self.kind == "qident":
+            return self.text[1:-1].replace('""', '"')
+        return self.text.lower()
+
+
+@dataclass
+class Problem:
+    kind: str  # "unknown_table", "unknown_alias", "unknown_column", "ambiguous_column" or "multiple_statements"
+    name: str
+    table: str = None
+    start: int = None
+    end: int = None
+    suggestion: str = None
+
+    def describe(self):
+        where = f" in '{self.table}'" if self.table else ""
+        text = {
+            "unknown_table": f"table '{self.name}' does not exist",
+            "unknown_alias": f"'{self.name}' is not a table or alias in the FROM clause",
+            "unknown_column": f"column '{self.name}' does not exist{where}",
+            "ambiguous_column": f"column '{self.name}' is ambiguous; qualify it with a table name or alias",
+            "multiple_statements": "it contains more than one statement; return a single SELECT",
+        }[self.kind]
+        if self.suggestion:
+            text += f" (did you mean '{self.suggestion}'?)"
+        return text
+
+
+class IdentifierIndex:
+    """
+    Hash index of the schema's tables and columns used to validate identifiers in O(1).
+    Names are kept exactly as the catalog has them and compared with Token.name, which
+    folds unquoted identifiers to lower case the way Postgres does.
+    """
+
+    def __init__(self, all_columns):
+        self.columns = {table: frozenset(cols) for table, cols in all_columns.items()}
+        self.column_lists = {table: list(cols) for table, cols in all_columns.items()}
+        self.tables_by_column = {}
+        for table, cols in self.columns.items():
+            for column in cols:
+                self.tables_by_column.setdefault(column, []).append(table)
+        self.all_columns = sorted(self.tables_by_column)
+
+    def closest_table(self, name):
+        return _closest(name, self.columns)
+
+    def closest_column(self, name, tables):
+        options = [c for table in tables for c in self.column_lists.get(table, [])] or self.all_columns
+        return _closest(name, options)
+
+
+def _closest(name, options):
+    # Case-insensitive, so an unquoted OrderDetails still finds "OrderDetails"
+    folded = {}
+    for option in options:
+        folded.setdefault(option.lower(), option)
+    matches = difflib.get_close_matches(name.lower(), list(folded), n=1)
+    return folded[matches[0]] if matches else None
+
+
+def quote_ident(name, force=False):
+    """
+    `name` as it must be written in SQL: bare when Postgres would fold it to itself,
+    double-quoted otherwise (or always with `force`).
+    """
+    if not force and re.fullmatch(r"[a-z_][a-z0-9_$]*", name) and name not in KEYWORDS:
+        return name
+    return '"' + name.replace('"', '""') + '"'
+
+
+def _render(name, token):
+    # Suggestions for a quoted identifier stay quoted
+    return quote_ident(name, force=token.kind == "qident") if name else None
+
+
+class MultipleStatements(ValueError):
+    def __init__(self):
+        super().__init__("Only a single SQL statement can be run; the query contains more than one.")
+
+
+def statement_separator(tokens):
+    """
+    The first `;` that is followed by anything but more `;` (strings, quoted names and
+    comments are already single tokens), or None for a single statement.
+    """
+    for i, token in enumerate(tokens):
+        if token.text == ";" and any(other.text != ";" for other in tokens[i + 1:]):
+            return token
+    return None
+
+
+def single_statement(sql):
+    """
+    `sql` without its trailing semicolons. Raises MultipleStatements when another statement
+    follows, which psycopg2 would otherwise run too (e.g. "SELECT 1; COMMIT; DROP ...").
+    """
+    if statement_separator(tokenize(sql)) is not None:
+        raise MultipleStatements()
+    return sql.strip().rstrip(";").rstrip()
+
+
+def tokenize(sql):
+    tokens = []
+    for match in _TOKEN.finditer(sql):
+        kind = match.lastgroup
+        if kind == "tag":
+            kind = "dollar"
+        if kind in ("ws", "comment"):
+            continue
+        tokens.append(Token(kind, match.group(), match.start(), match.end()))
+    return tokens
+
+
+def _is(token, *words):
+    return token is not None and token.kind == "ident" and token.text.lower() in words
+
+
+def _identifier(token):
+    return token is not None and (
+        token.kind == "qident" or (token.kind == "ident" and token.text.lower() not in KEYWORDS)
+    )
+
+
+class _Scope:
+    def __init__(self):
+        self.ctes = set()
+        self.aliases = {}  # alias or table name -> base table, or None for an opaque source
+        self.opaque = False
+        self.output_aliases = set()
+        self.refs = []  # (qualifier token or None, column token)
+        self.sources = []  # (token, name) of every base-table reference
+        self.using = []  # column tokens of JOIN ... USING (...) lists; never qualified
+        self.natural = set()  # base tables joined with NATURAL JOIN
+
+
+def _parse(tokens):
+    scope = _Scope()
+    n = len(tokens)
+
+    def at(i):
+        return tokens[i] if 0 <= i < n else None
+
+    # CTE names: WITH [RECURSIVE] name [(cols)] AS [NOT] [MATERIALIZED] ( ... ), ...
+    for i, token in enumerate(tokens):
+        if _identifier(token) and _is(at(i + 1), "as") and at(i + 2) is not None:
+            following = at(i + 2)
+            if following.text == "(" or _is(following, "not", "materialized"):
+                scope.ctes.add(token.name)
+        if _identifier(token) and at(i + 1) is not None and at(i + 1).text == "(":
+            # name(col, ...) AS ( -- CTE with a column list
+            depth, j = 0, i + 1
+            while j < n:
+                if tokens[j].text == "(":
+                    depth += 1
+                elif tokens[j].text == ")":
+                    depth -= 1
+                    if depth == 0:
+                        break
+                j += 1
+            if _is(at(j + 1), "as") and at(j + 2) is not None and at(j + 2).text == "(":
+                previous = at(i - 1)
+                if previous is not None and (_is(previous, "with", "recursive") or previous.text == ","):
+                    scope.ctes.add(token.name)
+
+    depth = 0
+    from_depths = []  # paren depths at which a FROM list is open
+    openers = []  # name of the function each open paren belongs to, if any
+    expect_source = False
+    natural = False
+    i = 0
+    while i < n:
+        token = tokens[i]
+        text = token.text.lower() if token.kind == "ident" else token.text
+        if token.text == "(":
+            depth += 1
+            previous = at(i - 1)
+            openers.append(previous.text.lower() if previous is not None and previous.kind == "ident" else None)
+        elif token.text == ")":
+            depth -= 1
+            if openers:
+                openers.pop()
+            while from_depths and from_depths[-1] > depth:
+                from_depths.pop()
+        elif text == "from" and token.kind == "ident" and (
+            (openers and openers[-1] in _FROM_FUNCTIONS) or _is(at(i - 1), "distinct")
+        ):
+            pass  # EXTRACT(year FROM x), IS DISTINCT FROM
+        elif token.kind == "ident" and text in _SOURCE_STARTERS:
+            expect_source = True
+            if text == "from" and not (from_depths and from_depths[-1] == depth):
+                from_depths.append(depth)
+            i += 1
+            continue
+        elif _is(token, "natural"):
+            natural = True
+        elif _is(token, "using") and at(i + 1) is not None and at(i + 1).text == "(":
+            # JOIN ... USING (a, b): each column is merged into one that belongs to no single table
+            end = _skip_parens(tokens, i + 1)
+            scope.using.extend(column for column in tokens[i + 2:end - 1] if _identifier(column))
+            if from_depths and from_depths[-1] == depth:
+                from_depths.pop()
+            i = end
+            continue
+        elif token.kind == "ident" and text in _CLAUSE_KEYWORDS and from_depths and from_depths[-1] == depth:
+            from_depths.pop()
+        elif token.text == "," and from_depths and from_depths[-1] == depth:
+            expect_source = True
+            i += 1
+            continue
+
+        if expect_source:
+            expect_source = False
+            joined_naturally, natural = natural, False
+            while _is(at(i), "only", "lateral"):
+                i += 1
+            token = at(i)
+            if token is None:
+                break
+            if token.text == "(" or (_identifier(token) and at(i + 1) is not None and at(i + 1).text == "("):
+                # Subquery or set-returning function: its columns are unknown
+                scope.opaque = True
+                alias_at = _skip_parens(tokens, i if token.text == "(" else i + 1)
+                alias_at, alias = _read_alias(tokens, alias_at)
+                if alias:
+                    scope.aliases[alias] = None
+                i = alias_at
+                continue
+            if _identifier(token):
+                name, j = token.name, i + 1
+                if at(j) is not None and at(j).text == "." and _identifier(at(j + 1)):
+                    # schema.table; only public tables are indexed
+                    name, token, j = at(j + 1).name, at(j + 1), j + 2
+                if name in scope.ctes:
+                    scope.opaque = True
+                    base = None
+                else:
+                    base = name
+                    scope.sources.append((token, name))
+                    if joined_naturally:
+                        scope.natural.add(name)
+                scope.aliases[name] = base
+                j, alias = _read_alias(tokens, j)
+                if alias:
+                    scope.aliases[alias] = base
+                i = j
+                continue
+
+        if _identifier(token):
+            previous, following = at(i - 1), at(i + 1)
+            if following is not None and following.text == "(":
+                pass  # function call
+            elif previous is not None and previous.text == "::":
+                pass  # type cast
+            elif _is(previous, "as"):
+                scope.output_aliases.add(token.name)
+            elif following is not None and following.text == "." and at(i + 2) is not None:
+                column = at(i + 2)
+                if _identifier(column) and not (at(i + 3) is not None and at(i + 3).text == "("):
+                    scope.refs.append((token, column))
+                    i += 3
+                    continue
+                i += 2  # qualifier.* or qualifier.keyword
+                continue
+            elif previous is not None and previous.text == ".":
+                pass
+            elif previous is not None and (
+                previous.text in (")", "]") or previous.kind in ("number", "string") or _identifier(previous)
+                or _is(previous, *_EXPRESSION_ENDS) or (at(i - 2) is not None and at(i - 2).text == "::")
+            ) and not _is(previous, *_SOURCE_STARTERS):
+                # Implicit output alias: SELECT sum(x) total, CASE ... END status, x::int n
+                scope.output_aliases.add(token.name)
+            else:
+                scope.refs.append((None, token))
+        i += 1
+    return scope
+
+
+def _skip_parens(tokens, i):
+    depth = 0
+    while i < len(tokens):
+        if tokens[i].text == "(":
+            depth += 1
+        elif tokens[i].text == ")":
+            depth -= 1
+            if depth == 0:
+                return i + 1
+        i += 1
+    return i
+
+
+def _read_alias(tokens, i):
+    token = tokens[i] if i < len(tokens) else None
+    if _is(token, "as"):
+        i += 1
+        token = tokens[i] if i < len(tokens) else None
+    if _identifier(token) and token.text.lower() not in _CLAUSE_KEYWORDS | _JOIN_WORDS:
+        i += 1
+        # Column alias list: AS t(a, b)
+        if i < len(tokens) and tokens[i].text == "(":
+            i = _skip_parens(tokens, i)
+        return i, token.name
+    return i, None
+
+
+def parse_sql(sql):
+    """
+    Returns (tokens, scope) for callers that rewrite SQL by token position.
+    """
+    tokens = tokenize(sql)
+    return tokens, _parse(tokens)
+
+
+def validate_sql(sql, index):
+    """
+    Parses `sql` once and returns every identifier problem found, each with the closest
+    valid replacement when there is one. Sources the index cannot see into (CTEs,
+    subqueries, functions) make unqualified columns unverifiable, so those are skipped.
+    """
+    tokens, scope = parse_sql(sql)
+    problems = []
+    separator = statement_separator(tokens)
+    if separator is not None:
+        problems.append(Problem("multiple_statements", ";", start=separator.start, end=separator.end))
+
+    for token, name in scope.sources:
+        if name not in index.columns:
+            problems.append(Problem("unknown_table", name, start=token.start, end=token.end,
+                                    suggestion=_render(index.closest_table(name), token)))
+    in_scope = [table for table in dict.fromkeys(scope.aliases.values()) if table in index.columns]
+    merged = _merged_columns(scope, index)
+    # With subqueries the flat alias view cannot tell which scope a bare column binds to
+    single_select = sum(1 for token in tokens if _is(token, "select")) == 1
+
+    for qualifier, column in scope.refs:
+        if qualifier is None:
+            name = column.name
+            if name in scope.output_aliases or name in scope.aliases:
+                continue
+            owners = [table for table in in_scope if name in index.columns[table]]
+            if len(owners) > 1 and single_select and name not in merged:
+                alias = alias_for(scope, owners[0])
+                problems.append(Problem("ambiguous_column", name, start=column.start, end=column.end,
+                                        suggestion=f"{quote_ident(alias)}.{_render(name, column)}"))
+            elif not owners and not scope.opaque and in_scope:
+                problems.append(Problem("unknown_column", name, start=column.start, end=column.end,
+                                        suggestion=_render(index.closest_column(name, in_scope), column)))
+            continue
+        alias = qualifier.name
+        if alias not in scope.aliases:
+            if alias in index.columns:
+                continue  # table referenced by name without being in FROM; Postgres will say so
+            problems.append(Problem("unknown_alias", alias, start=qualifier.start, end=qualifier.end,
+                                    suggestion=_render(_closest_alias(scope, alias), qualifier)))
+            continue
+        table = scope.aliases[alias]
+        if table is None or table not in index.columns:
+            continue
+        if column.name not in index.columns[table]:
+            problems.append(Problem("unknown_column", column.name, table=table, start=column.start, end=column.end,
+                                    suggestion=_render(index.closest_column(column.name, [table]), column)))
+
+    for column in scope.using:
+        # USING takes bare names only, so the suggestion stays unqualified
+        if in_scope and not scope.opaque and not any(column.name in index.columns[t] for t in in_scope):
+            problems.append(Problem("unknown_column", column.name, start=column.start, end=column.end,
+                                    suggestion=_render(index.closest_column(column.name, in_scope), column)))
+    return problems
+
+
+def _merged_columns(scope, index):
+    # Columns joined with USING or NATURAL JOIN appear once in the result, so a bare
+    # reference to them is not ambiguous even though two tables own them
+    merged = {column.name for column in scope.using}
+    joined = []
+    for _, name in scope.sources:
+        if name not in index.columns:
+            continue
+        if name in scope.natural:
+            merged.update(c for c in index.columns[name] if any(c in index.columns[t] for t in joined))
+        joined.append(name)
+    return merged
+
+
+def alias_for(scope, table):
+    aliases = [alias for alias, base in scope.aliases.items() if base == table and alias != table]
+    return aliases[0] if aliases else table
+
+
+def _closest_alias(scope, name):
+    return _closest(name, scope.aliases)
+
+
+def apply_fixes(sql, problems):
+    """
+    Rewrites each problem's exact token span with its suggestion. Unlike str.replace this
+    never touches other identifiers that merely contain the bad name. Names inside a
+    USING (...) list are never qualified, and a quoted identifier is never replaced by a
+    bare one, which Postgres would fold to a different name.
+    """
+    tokens, scope = parse_sql(sql)
+    using = {column.start for column in scope.using}
+    quoted = {token.start for token in tokens if token.kind == "qident"}
+    for problem in sorted(problems, key=lambda p: p.start, reverse=True):
+        if problem.start in using and "." in (problem.suggestion or ""):
+            continue
+        if problem.start in quoted and '"' not in (problem.suggestion or ""):
+            continue
+        if problem.suggestion and problem.start is not None:
+            sql = sql[:problem.start] + problem.suggestion + sql[problem.end:]
+    return sql
+
+
+_indexes = OrderedDict()
+_indexes_lock = threading.Lock()
+_MAX_INDEXES = 32
+
+
+def get_identifier_index(schema):
+    """
+    Returns the IdentifierIndex for a schema cache entry, built once per schema fingerprint.
+    """
+    with _indexes_lock:
+        index = _indexes.get(schema.fingerprint)
+        if index is not None:
+            _indexes.move_to_end(schema.fingerprint)
+            return index
+    index = IdentifierIndex(schema.columns)
+    with _indexes_lock:
+        _indexes[schema.fingerprint] = index
+        while len(_indexes) > _MAX_INDEXES:
+            _indexes.popitem(last=False)
+    return index
+
@@ -1,12 +1,29 @@
 import streamlit as st
 import os
+from contextlib import nullcontext
 from god_eye_core import generate_sql_and_results
 from dotenv import load_dotenv
-from analyse_data import analyse_and_format  # <-- Add this import
+from analyse_data import stream_analysis
 from chart_agent import run_chart_agent, wants_chart  # <-- Import the chart agent
+from tenants import get_tenant_registry, TenantBusy
+from cost_guard import describe_admission, guarded_fetch_result
+from answer_pipeline import Stage, submit_stages, CHART_SPEC_TIMEOUT, CHART_DATA_TIMEOUT
+from chart_data import chart_data
+from result_cache import cached_fetch_result
+from telemetry import trace
+from export import export_result, wants_export, ExportTooLarge, ExportRejected
 # Load environment variables
 load_dotenv()
 openai_api_key = os.getenv("OPENAI_API_KEY")
+# The download is served from the Streamlit server's memory, so keep it smaller than chat uploads
+STREAMLIT_EXPORT_MAX_BYTES = int(os.getenv("STREAMLIT_EXPORT_MAX_BYTES", str(200 * 1024 * 1024)))
+
+
+@st.cache_resource
+def tenant_registry():
+    # One registry per server process, so tenant pools and schemas outlive each rerun
+    return get_tenant_registry()
+
 
 # Set page config
 st.set_page_config(
@@ -39,11 +56,10 @@ with st.sidebar:
         db_params["user"] = st.text_input("User", value="myuser")
         db_params["password"] = st.text_input("Password", type="password")
         if st.button("Connect"):
-            import psycopg2
             try:
-                conn = psycopg2.connect(**db_params)
-                conn.close()
-                connection_status = "✅ Connected successfully!"
+                # Opens the tenant pool and loads the schema that later questions reuse
+                tenant = tenant_registry().connect(db_params)
+                connection_status = f"✅ Connected to {tenant.label}"
             except Exception as e:
                 connection_status = f"❌ Connection failed: {e}"
         if connection_status:
@@ -78,65 +94,119 @@ with st.form('chat_input_form'):
 
 # Main logic
 if user_input and submitted:
-    with st.spinner("Generating SQL and fetching results..."):
-        sql_query, results, error = generate_sql_and_results(user_input, openai_api_key, db_params if use_custom_db else None)
+    # Questions for a user database run through its tenant, which caps how many run at once
+    tenant = tenant_registry().register(db_params) if use_custom_db else None
+    # The tenant's key stands in for its parameters in every pool and cache call
+    answer_db = tenant.key if tenant is not None else None
+
+    def tenant_session():
+        return tenant.session() if tenant is not None else nullcontext()
+
+    with trace("answer") as answer_trace:
+        with st.spinner("Generating SQL and fetching results..."):
+            try:
+                with tenant_session():
+                    sql_query, results, error = generate_sql_and_results(user_input, openai_api_key, answer_db)
+            except TenantBusy as e:
+                sql_query, results, error = None, None, str(e)
+            except Exception as e:
+                # LLMTimeout, provider and database errors get a message instead of a traceback
+                print("Answer failed:", repr(e))
+                sql_query, results, error = None, None, "Something went wrong while answering your request. Please try again with a different question."
     
-    # st.markdown("#### Generated SQL Query")
+        # st.markdown("#### Generated SQL Query")
     
-    # st.code(sql_query, language="sql")
-    if error:
-        st.error(f"❌ {error}")
-    elif results is not None:
+        # st.code(sql_query, language="sql")
+        if error:
+            st.error(f"❌ {error}")
+        elif results is not None:
         
         
-        # Add analysis and formatting
-        with st.spinner("Analysing and formatting results..."):
-            df, analysis = analyse_and_format(user_input, sql_query, results, openai_api_key)
-        if df is not None:
-            
-            
-            if wants_chart(user_input):
-                st.markdown("#### Chart Visualization")
-                
-                df_chart = df.reset_index(drop=True)
-                # Call the chart agent
-                chart_info = run_chart_agent(user_input, df_chart, openai_api_key)
-                chart_type = chart_info.get("chart_type", "bar")
-                x = chart_info.get("x", df_chart.columns[0])
-                y = chart_info.get("y", df_chart.columns[1])
-                
-                try:
-                # Render the chart
-                    if chart_type == "bar":
-                        st.bar_chart(df_chart.set_index(x)[y])
-                    elif chart_type == "line":
-                        st.line_chart(df_chart.set_index(x)[y])
-                    elif chart_type == "pie":
-                        import matplotlib.pyplot as plt
-                        fig, ax = plt.subplots()
-                        ax.pie(df_chart[y], labels=df_chart[x], autopct='%1.1f%%')
-                        st.pyplot(fig)
-                    elif chart_type == "scatter":
-                        st.scatter_chart(df_chart, x=x, y=y)
-                    else:
-                        st.write("Chart type not supported.")
-                except Exception as e:
-                    st.error(f"Error rendering chart: {e}")
-                
-            
-        else:
-            st.write("No tabular results to display.")
-        
-        st.markdown("#### Analysis")
-        st.write(analysis)
-        if df is not None:
-            st.dataframe(df, use_container_width=True)
+            df = results.to_frame()
+            df_chart = df.reset_index(drop=True)
+            show_chart = len(df.columns) > 0 and wants_chart(user_input)
+
+            def fetch_chart_rows(query):
+                with tenant_session():
+                    return cached_fetch_result(query, answer_db, fetch=guarded_fetch_result)
+
+            # The chart spec runs in the background while the analysis streams in below it
+            chart_future = None
+            if show_chart:
+                chart_future = submit_stages([
+                    Stage("chart_spec", lambda _: run_chart_agent(user_input, df_chart, openai_api_key), timeout=CHART_SPEC_TIMEOUT),
+                    # Large results are aggregated (in SQL when they were truncated) down to what the chart can show
+                    Stage("chart_data", lambda inputs: chart_data(results, sql_query, inputs["chart_spec"], fetch_chart_rows),
+                          ("chart_spec",), CHART_DATA_TIMEOUT),
+                ])
+            chart_area = st.container()
+
+            st.markdown("#### Analysis")
+            try:
+                st.write_stream(stream_analysis(user_input, sql_query, results, openai_api_key))
+            except Exception as e:
+                print("Analysis stream failed:", repr(e))
+                st.write("The analysis is not available right now; the results and SQL are below.")
+
+            if chart_future is not None:
+                pipeline = chart_future.result()
+                with chart_area:
+                    if pipeline.ok("chart_data"):
+                        st.markdown("#### Chart Visualization")
+
+                        df_chart, chart_info = pipeline.value("chart_data")
+                        chart_type = chart_info.get("chart_type", "bar")
+                        x = chart_info.get("x", df_chart.columns[0])
+                        y = chart_info.get("y", df_chart.columns[1])
+
+                        try:
+                        # Render the chart
+                            if chart_type == "bar":
+                                st.bar_chart(df_chart.set_index(x)[y])
+                            elif chart_type == "line":
+                                st.line_chart(df_chart.set_index(x)[y])
+                            elif chart_type == "pie":
+                                import matplotlib.pyplot as plt
+                                fig, ax = plt.subplots()
+                                ax.pie(df_chart[y], labels=df_chart[x], autopct='%1.1f%%')
+                                st.pyplot(fig)
+                            elif chart_type == "scatter":
+                                st.scatter_chart(df_chart, x=x, y=y)
+                            else:
+                                st.write("Chart type not supported.")
+                        except Exception as e:
+                            st.error(f"Error rendering chart: {e}")
+
+            if df is not None:
+                st.dataframe(df, use_container_width=True)
+                export_format = wants_export(user_input)
+                if export_format:
+                    try:
+                        with st.spinner("Exporting the full result..."), tenant_session():
+                            exported = export_result(sql_query, answer_db, export_format, STREAMLIT_EXPORT_MAX_BYTES)
+                        try:
+                            with open(exported.path, "rb") as f:
+                                st.download_button(f"Download full result ({exported.describe()})", f.read(),
+                                                   file_name=exported.filename, mime=exported.mime_type)
+                        finally:
+                            exported.remove()
+                    except (ExportTooLarge, ExportRejected, TenantBusy) as e:
+                        st.warning(str(e))
+                elif results.truncated:
+                    st.caption(f"Showing the first {results.row_count:,} of {results.total_rows:,} rows. "
+                               "Ask to export the result to download every row.")
         
-        st.markdown("#### Generated SQL Query")
+            st.markdown("#### Generated SQL Query")
     
-        st.code(sql_query, language="sql")
-    else:
-        st.info("No results found. Try a different question.")
+            st.code(sql_query, language="sql")
+            if results.admission:
+                st.caption(describe_admission(results.admission))
+        else:
+            st.info("No results found. Try a different question.")
+
+    # Where this answer's time went: every stage, LLM call (with tokens) and query (with rows)
+    with st.expander(f"Timings ({answer_trace.total_seconds():.2f}s)"):
+        st.dataframe(answer_trace.rows(), use_container_width=True)
 
 
 # Ensure the DataFrame persists and update the chart
@@ -1,25 +1,166 @@
 from fastapi import FastAPI, Request
-from analyse_data import analyse_and_format
+from fastapi.responses import PlainTextResponse
+from async_core import agenerate_sql_and_results, astream_analysis, athrottled_text
 from dotenv import load_dotenv
 import os
-import requests
-from god_eye_core import generate_sql_and_results
-import openai
+import asyncio
+from contextlib import asynccontextmanager
+import httpx
+import async_db
+import db_pool
+from cost_guard import describe_admission
+from nl_cache import get_nl_cache
+from result_cache import get_result_cache
+from repair import repair_stats
+from llm_gateway import get_llm_gateway
+from telemetry import trace, span, metrics_text
+from warmup import start_prewarm, cancel_task
+from dedup import afirst_seen, get_dedup_store
+from export import export_result, wants_export, ExportTooLarge, ExportRejected, EXPORT_MAX_BYTES
 import re
 
 load_dotenv()
 openai_api_key = os.getenv("OPENAI_API_KEY")
 TELEGRAM_TOKEN = os.getenv("TELEGRAM_TOKEN")
 TELEGRAM_API_URL = f"https://api.telegram.org/bot{TELEGRAM_TOKEN}/sendMessage"
+TELEGRAM_EDIT_URL = f"https://api.telegram.org/bot{TELEGRAM_TOKEN}/editMessageText"
+TELEGRAM_DOCUMENT_URL = f"https://api.telegram.org/bot{TELEGRAM_TOKEN}/sendDocument"
+# Bots may upload documents up to 50 MB
+TELEGRAM_MAX_DOCUMENT_BYTES = min(EXPORT_MAX_BYTES, 50 * 1024 * 1024)
+TELEGRAM_UPLOAD_TIMEOUT = float(os.getenv("TELEGRAM_UPLOAD_TIMEOUT", "300"))
+# Telegram rejects messages longer than this
+TELEGRAM_MAX_MESSAGE_LEN = 4096
+# Replies carry the analysis of a digest rather than the rows, so a modest fetch is enough
+TELEGRAM_ROW_BUDGET = 5000
+
+http_client = None
+
+
+@asynccontextmanager
+async def lifespan(app):
+    # Nothing runs at import; the HTTP client opens here and the rest warms up in the background
+    global http_client
+    http_client = httpx.AsyncClient(timeout=30)
+    prewarm_task = start_prewarm()
+    yield
+    await cancel_task(prewarm_task)
+    await http_client.aclose()
+    await async_db.close_async_pools()
+    db_pool.close_all()
+
+
+app = FastAPI(lifespan=lifespan)
+
+
+@app.get("/stats/db")
+def db_stats():
+    return db_pool.pool_stats()
+
+
+@app.get("/stats/cache")
+def cache_stats():
+    return {"nl_sql": get_nl_cache().stats(), "results": get_result_cache().stats(), "dedup": get_dedup_store().stats()}
+
+
+@app.get("/metrics")
+def metrics():
+    return PlainTextResponse(metrics_text(), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/stats/answers")
+def answer_stats():
+    return repair_stats.stats()
+
+
+@app.get("/stats/llm")
+def llm_stats():
+    return get_llm_gateway().stats()
+
+
+async def telegram_post(url, payload):
+    with span("post"):
+        return await http_client.post(url, json=payload)
+
+
+async def stream_reply(chat_id, chunks, footer=""):
+    """
+    Sends a placeholder message and edits it with editMessageText as the text streams in,
+    at most once per STREAM_UPDATE_INTERVAL to stay within Telegram's edit rate limits.
+    """
+    response = await telegram_post(TELEGRAM_API_URL, {"chat_id": chat_id, "text": "Analysing the results…"})
+    message_id = response.json()["result"]["message_id"]
+    text = ""
+    try:
+        async for text in athrottled_text(chunks):
+            await telegram_post(TELEGRAM_EDIT_URL, {
+                "chat_id": chat_id,
+                "message_id": message_id,
+                "text": (text + " …")[:TELEGRAM_MAX_MESSAGE_LEN]
+            })
+        final = text.strip() + footer
+    except Exception as e:
+        print("Analysis stream failed:", repr(e))
+        final = (text.strip() + "\n\n" if text.strip() else "") + "The analysis is not available right now." + footer
+    await telegram_post(TELEGRAM_EDIT_URL, {
+        "chat_id": chat_id,
+        "message_id": message_id,
+        "text": final[:TELEGRAM_MAX_MESSAGE_LEN]
+    })
+
+
+EXPORT_FAILED = "The full result could not be sent as a file right now. Please ask for the export again later."
+
+
+async def send_export(chat_id, sql_query, export_format):
+    """
+    Runs the query with COPY into a compressed file and sends it with sendDocument.
+    The analysis has already been sent, so a failure here only gets an export message.
+    """
+    try:
+        exported = await asyncio.to_thread(export_result, sql_query, None, export_format, TELEGRAM_MAX_DOCUMENT_BYTES)
+    except (ExportTooLarge, ExportRejected) as e:
+        await telegram_post(TELEGRAM_API_URL, {"chat_id": chat_id, "text": str(e)})
+        return
+    except Exception as e:
+        print("Export failed:", repr(e))
+        await telegram_post(TELEGRAM_API_URL, {"chat_id": chat_id, "text": EXPORT_FAILED})
+        return
+    try:
+        with span("post"), open(exported.path, "rb") as document:
+            response = await http_client.post(
+                TELEGRAM_DOCUMENT_URL,
+                data={"chat_id": chat_id, "caption": f"Full result: {exported.describe()}"},
+                files={"document": (exported.filename, document, exported.mime_type)},
+                timeout=TELEGRAM_UPLOAD_TIMEOUT
+            )
+        if response.status_code != 200:
+            raise RuntimeError(f"sendDocument returned {response.status_code}: {response.text[:200]}")
+    except Exception as e:
+        print("Export upload failed:", repr(e))
+        await telegram_post(TELEGRAM_API_URL, {"chat_id": chat_id, "text": EXPORT_FAILED})
+    finally:
+        exported.remove()
 
-app = FastAPI()
 
 @app.post("/webhook")
 async def telegram_webhook(request: Request):
     data = await request.json()
+    # Telegram redelivers an update until the webhook answers; each update_id is answered once
+    if not await afirst_seen("telegram", data.get("update_id")):
+        print(f"Ignoring duplicate update: {data.get('update_id')}")
+        return {"ok": True}
+    with trace("answer") as answer_trace:
+        await answer_update(data)
+    print(f"Answer took {answer_trace.total_seconds():.2f}s:", answer_trace.rows())
+    return {"ok": True}
+
+
+async def answer_update(data):
     message = data.get("message", {})
     chat_id = message.get("chat", {}).get("id")
     text = message.get("text", "")
+    # Checked on the question as asked, before the dataset notes are appended to it
+    export_format = wants_export(text)
 
     try:
         # Latest current year for dataset
@@ -52,28 +193,18 @@ async def telegram_webhook(request: Request):
                     "Treat 1998 as 'this year' and 1997 as 'last year' in your SQL query. "
                     "Do NOT use CURRENT_DATE or EXTRACT(YEAR FROM CURRENT_DATE)."
                 )
-            sql_query, results, error = generate_sql_and_results(text, openai_api_key)
+            sql_query, results, error = await agenerate_sql_and_results(text, openai_api_key, row_budget=TELEGRAM_ROW_BUDGET)
             if error:
                 reply = error
             elif results:
-                # Shorten results if too long
-                reply_lines = []
-                total_len = 0
-                MAX_MSG_LEN = 2000  # Leave space for analysis text
-                for row in results:
-                    line = str(row) + "\n"
-                    if total_len + len(line) > MAX_MSG_LEN:
-                        reply_lines.append("...result is shortened...")
-                        break
-                    reply_lines.append(line)
-                    total_len += len(line)
-                # Prepare a shortened results list for analysis
-                if isinstance(results, list) and len(reply_lines) < len(results):
-                    # Only pass the rows that fit
-                    short_results = results[:len(reply_lines)-1]  # -1 for the "shortened" line
-                else:
-                    short_results = results
-                reply = analyse_and_format(text, sql_query, short_results, openai_api_key)
+                footer = "\n\n" + describe_admission(results.admission) if results.admission else ""
+                if results.truncated and not export_format:
+                    footer += "\n\nAsk to export the result to get every row as a file."
+                # Show the analysis as it is written instead of after the whole completion
+                await stream_reply(chat_id, astream_analysis(text, sql_query, results, openai_api_key), footer)
+                if export_format:
+                    await send_export(chat_id, sql_query, export_format)
+                return
             else:
                 reply = "There is no data available in the dataset for this specific request."
         else:
@@ -82,8 +213,7 @@ async def telegram_webhook(request: Request):
         reply = "There is no data available in the dataset for your request. Please try again with a different question."
 
     if chat_id:
-        requests.post(TELEGRAM_API_URL, json={
+        await telegram_post(TELEGRAM_API_URL, {
             "chat_id": chat_id,
             "text": reply
-        })
-    return {"ok": True}
\ No newline at end of file
+        })
\ No newline at end of file
@@ -0,0 +1,185 @@
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+
+
+# Upper bounds (seconds) of the latency histogram buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 40)
+ROW_BUCKETS = (0, 1, 10, 100, 1000, 10000, 100000, 1000000)
+
+
+class Histogram:
+    def __init__(self, name, help_text, buckets, labels):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = buckets
+        self.labels = labels
+        self._series = {}  # label values -> [bucket counts..., count, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels.get(label, "")) for label in self.labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += 1
+            series[-1] += value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = sorted((key, list(series)) for key, series in self._series.items())
+        for key, series in items:
+            base = ",".join(f'{label}="{_escape(value)}"' for label, value in zip(self.labels, key))
+            for bound, count in zip(self.buckets + ("+Inf",), series[:-2] + series[-2:-1]):
+                lines.append(f'{self.name}_bucket{{{base},le="{bound}"}} {count}')
+            lines.append(f"{self.name}_count{{{base}}} {series[-2]}")
+            lines.append(f"{self.name}_sum{{{base}}} {series[-1]}")
+        return lines
+
+
+class Counter:
+    def __init__(self, name, help_text, labels):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels.get(label, "")) for label in self.labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            base = ",".join(f'{label}="{_escape(v)}"' for label, v in zip(self.labels, key))
+            lines.append(f"{self.name}{{{base}}} {value}")
+        return lines
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+stage_seconds = Histogram("godeye_stage_duration_seconds", "Time spent per answer stage.",
+                          LATENCY_BUCKETS, ("stage", "status"))
+sql_rows = Histogram("godeye_sql_rows", "Rows fetched per executed query.", ROW_BUCKETS, ("stage",))
+llm_tokens = Counter("godeye_llm_tokens_total", "LLM tokens used, by model and kind.", ("model", "kind"))
+llm_requests = Counter("godeye_llm_requests_total", "LLM requests by provider, task and outcome "
+                       "(ok, error, lost to a hedge, timeout).", ("provider", "task", "outcome"))
+_metrics = [stage_seconds, sql_rows, llm_tokens, llm_requests]
+
+
+@dataclass
+class Span:
+    stage: str
+    seconds: float = 0.0
+    status: str = "ok"
+    attrs: dict = field(default_factory=dict)
+
+
+class Trace:
+    """
+    The spans of one answer, collected across threads and tasks that inherit its context.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.started = time.perf_counter()
+        self.spans = []
+        self._lock = threading.Lock()
+
+    def add(self, span):
+        with self._lock:
+            self.spans.append(span)
+
+    def rows(self):
+        with self._lock:
+            spans = list(self.spans)
+        return [{"stage": s.stage, "seconds": round(s.seconds, 3), "status": s.status, **s.attrs} for s in spans]
+
+    def total_seconds(self):
+        return time.perf_counter() - self.started
+
+
+_current_trace = contextvars.ContextVar("godeye_trace", default=None)
+
+
+@contextmanager
+def trace(name="answer"):
+    """
+    Collects every span recorded below it (including in copied contexts) and records
+    the whole answer as the `name` stage.
+    """
+    current = Trace(name)
+    token = _current_trace.set(current)
+    try:
+        with span(name):
+            yield current
+    finally:
+        _current_trace.reset(token)
+
+
+def current_trace():
+    return _current_trace.get()
+
+
+def record(stage, seconds, status="ok", **attrs):
+    stage_seconds.observe(seconds, stage=stage, status=status)
+    if "rows" in attrs:
+        sql_rows.observe(attrs["rows"], stage=stage)
+    current = _current_trace.get()
+    if current is not None:
+        current.add(Span(stage, seconds, status, attrs))
+
+
+@contextmanager
+def span(stage, **attrs):
+    """
+    Times the block as `stage`. The yielded dict takes extra attributes (rows, tokens)
+    to show in the answer's trace; an exception marks the span as "error".
+    """
+    started = time.perf_counter()
+    status = "ok"
+    try:
+        yield attrs
+    except BaseException:
+        status = "error"
+        raise
+    finally:
+        record(stage, time.perf_counter() - started, status, **attrs)
+
+
+def record_usage(attrs, model, usage):
+    """
+    Adds an OpenAI-style `usage` (prompt/completion tokens) to span attributes and counters.
+    """
+    if usage is None:
+        return
+    prompt_tokens = getattr(usage, "prompt_tokens", 0) or 0
+    completion_tokens = getattr(usage, "completion_tokens", 0) or 0
+    attrs["model"] = model
+    attrs["prompt_tokens"] = attrs.get("prompt_tokens", 0) + prompt_tokens
+    attrs["completion_tokens"] = attrs.get("completion_tokens", 0) + completion_tokens
+    llm_tokens.inc(prompt_tokens, model=model, kind="prompt")
+    llm_tokens.inc(completion_tokens, model=model, kind="completion")
+
+
+def metrics_text():
+    """
+    All metrics in the Prometheus text exposition format.
+    """
+    lines = []
+    for metric in _metrics:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,184 @@
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import db_pool
+import schema_cache
+from db_config import resolve_db_params, register_target, forget_target, describe_target
+
+
+# User-supplied databases get smaller pools than the app's own database
+TENANT_POOL_MAX_SIZE = int(os.getenv("TENANT_POOL_MAX_SIZE", "4"))
+# Answers running at once per tenant; the rest wait up to TENANT_ACQUIRE_TIMEOUT seconds
+TENANT_MAX_CONCURRENT = int(os.getenv("TENANT_MAX_CONCURRENT", "2"))
+TENANT_ACQUIRE_TIMEOUT = float(os.getenv("TENANT_ACQUIRE_TIMEOUT", "10"))
+# libpq connect_timeout so an unreachable database fails fast instead of hanging a session
+TENANT_CONNECT_TIMEOUT = int(os.getenv("TENANT_CONNECT_TIMEOUT", "5"))
+TENANT_IDLE_TIMEOUT = float(os.getenv("TENANT_IDLE_TIMEOUT", "1800"))
+TENANT_MAX_COUNT = int(os.getenv("TENANT_MAX_COUNT", "50"))
+TENANT_MAX_BYTES = int(os.getenv("TENANT_MAX_BYTES", str(256 * 1024 * 1024)))
+# Rough client-side cost of one open connection (libpq buffers, psycopg2 objects)
+TENANT_CONNECTION_BYTES = int(os.getenv("TENANT_CONNECTION_BYTES", str(2 * 1024 * 1024)))
+
+
+class TenantBusy(Exception):
+    pass
+
+
+class Tenant:
+    """
+    One user-supplied connection target. Its parameters (and password) are registered in
+    db_config and held by its pool; callers pass `key` to the query layer in their place.
+    """
+
+    def __init__(self, key, label):
+        self.key = key
+        self.label = label
+        self.created = time.time()
+        self.last_used = self.created
+        self.active = 0
+        self._slots = threading.BoundedSemaphore(TENANT_MAX_CONCURRENT)
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return f"Tenant({self.label}, key={self.key})"
+
+    @contextmanager
+    def session(self, timeout=TENANT_ACQUIRE_TIMEOUT):
+        """
+        Holds one of the tenant's TENANT_MAX_CONCURRENT slots, so a slow database can only
+        tie up that many of the app's workers. Raises TenantBusy when none frees up in time.
+        """
+        if not self._slots.acquire(timeout=timeout):
+            raise TenantBusy(f"{self.label} is busy with other questions. Please try again shortly.")
+        with self._lock:
+            self.active += 1
+            self.last_used = time.time()
+        try:
+            yield self
+        finally:
+            with self._lock:
+                self.active -= 1
+                self.last_used = time.time()
+            self._slots.release()
+
+    def estimated_bytes(self):
+        pool = db_pool._pools.get(self.key)
+        size = pool.stats()["size"] * TENANT_CONNECTION_BYTES if pool is not None else 0
+        entry = schema_cache._entries.get(self.key)
+        if entry is not None:
+            size += len(json.dumps(entry.as_tuple(), default=str))
+        return size
+
+    def stats(self):
+        return {
+            "target": self.label,
+            "active": self.active,
+            "idle_seconds": round(time.time() - self.last_used, 1),
+            "estimated_bytes": self.estimated_bytes(),
+        }
+
+
+class TenantRegistry:
+    """
+    Pools and schema caches for user-supplied databases, keyed by target hash and kept
+    across Streamlit reruns. Idle tenants are closed after TENANT_IDLE_TIMEOUT, and the
+    least recently used ones go first when TENANT_MAX_COUNT or TENANT_MAX_BYTES is exceeded.
+    """
+
+    def __init__(self):
+        self._tenants = OrderedDict()  # key -> Tenant, least recently used first
+        self._lock = threading.Lock()
+        self._stats = {"registered": 0, "evicted": 0}
+
+    def register(self, db_params):
+        db_params = resolve_db_params(db_params)
+        db_params.setdefault("connect_timeout", TENANT_CONNECT_TIMEOUT)
+        key = register_target(db_params)
+        with self._lock:
+            tenant = self._tenants.get(key)
+            if tenant is None:
+                tenant = self._tenants[key] = Tenant(key, describe_target(db_params))
+                self._stats["registered"] += 1
+            self._tenants.move_to_end(key)
+            tenant.last_used = time.time()
+        # Created here so the tenant's pool gets the smaller per-tenant size
+        db_pool.get_pool(key, max_size=TENANT_POOL_MAX_SIZE)
+        self.enforce_limits(keep=key)
+        return tenant
+
+    def connect(self, db_params):
+        """
+        Registers the target, checks it answers and loads its schema into the cache.
+        Raises the driver error when the database cannot be reached.
+        """
+        tenant = self.register(db_params)
+        with tenant.session():
+            with db_pool.connection(tenant.key) as conn:
+                cursor = conn.cursor()
+                cursor.execute("SELECT 1")
+                cursor.close()
+            schema_cache.get_schema_entry(tenant.key)
+        return tenant
+
+    def get(self, key):
+        with self._lock:
+            tenant = self._tenants.get(key) if key else None
+            if tenant is not None:
+                self._tenants.move_to_end(key)
+                tenant.last_used = time.time()
+        return tenant
+
+    def evict(self, key):
+        with self._lock:
+            tenant = self._tenants.pop(key, None)
+            if tenant is None:
+                return
+            self._stats["evicted"] += 1
+        print(f"Closing idle tenant {tenant.label}")
+        db_pool.close_pool(tenant.key)
+        schema_cache.invalidate(tenant.key)
+        forget_target(tenant.key)
+
+    def enforce_limits(self, keep=None):
+        now = time.time()
+        with self._lock:
+            tenants = list(self._tenants.values())
+        # Tenants answering a question are never closed under them
+        idle = [t for t in tenants if not t.active and t.key != keep]
+        expired = [t for t in idle if now - t.last_used > TENANT_IDLE_TIMEOUT]
+        for tenant in expired:
+            self.evict(tenant.key)
+        remaining = [t for t in idle if t not in expired]
+        count = len(tenants) - len(expired)
+        total = sum(t.estimated_bytes() for t in tenants if t not in expired)
+        for tenant in remaining:  # least recently used first
+            if count <= TENANT_MAX_COUNT and total <= TENANT_MAX_BYTES:
+                break
+            total -= tenant.estimated_bytes()
+            count -= 1
+            self.evict(tenant.key)
+
+    def stats(self):
+        self.enforce_limits()
+        with self._lock:
+            tenants = list(self._tenants.values())
+            stats = dict(self._stats)
+        stats["tenants"] = {tenant.key: tenant.stats() for tenant in tenants}
+        return stats
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_tenant_registry():
+    global _registry
+    if _registry is None:
+        with _registry_lock:
+            if _registry is None:
+                _registry = TenantRegistry()
+    return _registry
@@ -0,0 +1,105 @@
+import pytest
+
+from sql_validator import IdentifierIndex, MultipleStatements, Problem, apply_fixes, single_statement, validate_sql
+
+
+@pytest.fixture
+def index():
+    return IdentifierIndex({
+        "orders": ["order_id", "customer_id", "status", "order_date"],
+        "order_details": ["order_id", "product_id", "quantity"],
+        "customers": ["customer_id", "company_name"],
+        "OrderItems": ["OrderId", "UnitPrice"],
+    })
+
+
+def kinds(sql, index):
+    return [problem.kind for problem in validate_sql(sql, index)]
+
+
+def test_ambiguous_column_is_qualified(index):
+    sql = "SELECT order_id, quantity FROM orders o JOIN order_details d ON o.order_id = d.order_id"
+    (problem,) = validate_sql(sql, index)
+    assert problem.kind == "ambiguous_column"
+    assert apply_fixes(sql, [problem]).startswith("SELECT o.order_id,")
+
+
+def test_unknown_qualified_column(index):
+    (problem,) = validate_sql("SELECT o.order_idd FROM orders o", index)
+    assert (problem.kind, problem.suggestion) == ("unknown_column", "order_id")
+
+
+def test_using_column_is_merged(index):
+    assert kinds("SELECT order_id, quantity FROM orders JOIN order_details USING (order_id)", index) == []
+
+
+def test_unknown_using_column_gets_a_bare_suggestion(index):
+    (problem,) = validate_sql("SELECT quantity FROM orders JOIN order_details USING (order_idd)", index)
+    assert (problem.kind, problem.suggestion) == ("unknown_column", "order_id")
+
+
+def test_using_list_is_never_qualified():
+    sql = "SELECT order_id FROM orders JOIN order_details USING (order_id)"
+    start = sql.rindex("order_id")
+    problem = Problem("ambiguous_column", "order_id", start=start, end=start + 8, suggestion="orders.order_id")
+    assert apply_fixes(sql, [problem]) == sql
+
+
+def test_natural_join_columns_are_merged(index):
+    assert kinds("SELECT order_id, quantity FROM orders NATURAL JOIN order_details", index) == []
+
+
+@pytest.mark.parametrize("sql", [
+    "SELECT CASE WHEN quantity > 10 THEN 'bulk' ELSE 'single' END size FROM order_details ORDER BY size",
+    "SELECT order_date::date day_, count(*) n FROM orders GROUP BY 1",
+    "SELECT NULL missing, quantity FROM order_details",
+])
+def test_implicit_aliases(index, sql):
+    assert kinds(sql, index) == []
+
+
+def test_quoted_mixed_case_names_are_valid(index):
+    assert kinds('SELECT "UnitPrice" FROM "OrderItems"', index) == []
+
+
+def test_unquoted_mixed_case_table_is_suggested_quoted(index):
+    sql = 'SELECT 1 FROM OrderItems'
+    (problem,) = validate_sql(sql, index)
+    assert (problem.kind, problem.suggestion) == ("unknown_table", '"OrderItems"')
+    assert apply_fixes(sql, [problem]) == 'SELECT 1 FROM "OrderItems"'
+
+
+def test_quoted_identifier_keeps_its_quotes(index):
+    sql = 'SELECT i."UnitPrise" FROM "OrderItems" i'
+    (problem,) = validate_sql(sql, index)
+    assert problem.suggestion == '"UnitPrice"'
+    assert apply_fixes(sql, [problem]) == 'SELECT i."UnitPrice" FROM "OrderItems" i'
+
+
+def test_quoted_identifier_is_never_rewritten_bare():
+    sql = 'SELECT "UnitPrice" FROM items'
+    problem = Problem("unknown_column", "UnitPrice", start=7, end=18, suggestion="unitprice")
+    assert apply_fixes(sql, [problem]) == sql
+
+
+@pytest.mark.parametrize("sql", [
+    "SELECT 1; COMMIT; DROP TABLE orders",
+    "SELECT 1;\nDROP TABLE orders;",
+    "SELECT 1; -- trailing comment\nDELETE FROM orders",
+])
+def test_multiple_statements_are_rejected(index, sql):
+    assert "multiple_statements" in kinds(sql, index)
+    with pytest.raises(MultipleStatements):
+        single_statement(sql)
+
+
+@pytest.mark.parametrize("sql", [
+    "SELECT 1;",
+    "SELECT 1;;  ",
+    "SELECT ';' AS semicolon",
+    'SELECT 1 AS ";"',
+    "SELECT 1 /* ; DROP TABLE orders */",
+])
+def test_single_statement(index, sql):
+    assert "multiple_statements" not in kinds(sql, index)
+    assert not single_statement(sql).endswith(";")
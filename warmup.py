@@ -0,0 +1,72 @@
+import asyncio
+import importlib
+import os
+import time
+
+import async_db
+import db_pool
+
+
+# Warm connections and heavy imports in the background once the worker is up ("0" to skip)
+PREWARM = os.getenv("PREWARM", "1") == "1"
+# Modules the first answer would otherwise import while a user waits
+PREWARM_MODULES = tuple(
+    name.strip() for name in os.getenv(
+        "PREWARM_MODULES", "openai,pandas,result_digest,chart_data,chart_renderer,matplotlib.backends.backend_agg"
+    ).split(",") if name.strip()
+)
+
+
+def import_modules(names):
+    """
+    Imports each module and returns {name: seconds}; a missing optional module is skipped.
+    """
+    timings = {}
+    for name in names:
+        started = time.perf_counter()
+        try:
+            importlib.import_module(name)
+        except ImportError as e:
+            print(f"Prewarm skipped {name}: {e}")
+            continue
+        timings[name] = round(time.perf_counter() - started, 3)
+    return timings
+
+
+async def prewarm(modules=PREWARM_MODULES):
+    """
+    Opens the database pools and imports the heavy modules, so the first answer does not pay for them.
+    """
+    started = time.perf_counter()
+    # The schema cache still loads through the blocking pool; queries go through asyncpg
+    await asyncio.to_thread(db_pool.get_pool().warm)
+    await async_db.get_async_pool()
+    timings = await asyncio.to_thread(import_modules, modules)
+    print(f"Prewarmed in {time.perf_counter() - started:.2f}s (imports: {timings})")
+
+
+def start_prewarm(modules=PREWARM_MODULES):
+    """
+    Runs prewarm() as a background task when PREWARM is on, so the worker starts taking
+    requests at once. Returns the task (or None); a failed prewarm is only logged.
+    """
+    if not PREWARM:
+        return None
+
+    async def run():
+        try:
+            await prewarm(modules)
+        except Exception as e:
+            print("Prewarm failed:", repr(e))
+
+    return asyncio.create_task(run())
+
+
+async def cancel_task(task):
+    # For the lifespan shutdown: a prewarm (or other startup task) still running is dropped
+    if task is not None and not task.done():
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass